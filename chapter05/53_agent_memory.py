@@ -21,14 +21,22 @@ import os
 import dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage, messages_from_dict, messages_to_dict
+from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.runnables import RunnableWithMessageHistory
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.output_parsers import StrOutputParser
-from typing import List
+from typing import List, Optional, Sequence
 import json
+import threading
 from datetime import datetime
 
+from background_summary import BackgroundSummarizer
+from memory_journal import MessageJournal
+from memory_tokens import create_token_counter
+from session_store import BoundedSessionStore
+from summary_compaction import HierarchicalSummary
+
 # ============================================================================
 # 环境配置和模型初始化
 # ============================================================================
@@ -51,16 +59,9 @@ llm = ChatOpenAI(
     temperature=0.7                               # 控制输出的随机性，0-1之间，越高越随机
 )
 
-print("=" * 60)
-print("LangChain 记忆模块完整示例（详细注释版）")
-print("=" * 60)
-
 # ============================================================================
 # 1. 基础聊天记忆 - ChatMessageHistory
 # ============================================================================
-print("\n1. 基础聊天记忆 - ChatMessageHistory")
-print("-" * 40)
-
 """
 ChatMessageHistory 是LangChain中最基础的记忆组件
 - 功能：简单地存储和检索聊天消息历史
@@ -69,34 +70,36 @@ ChatMessageHistory 是LangChain中最基础的记忆组件
 - 存储结构：消息列表，每个消息包含类型（用户/AI）和内容
 """
 
-# 创建聊天记忆历史实例
-# ChatMessageHistory是一个简单的内存存储，用于保存对话消息
-chat_history = ChatMessageHistory()
-
-# 添加用户和AI的历史消息
-# add_user_message(): 添加用户消息，会创建HumanMessage对象
-# add_ai_message(): 添加AI消息，会创建AIMessage对象
-chat_history.add_user_message("你好，我叫张三")
-chat_history.add_ai_message("你好张三！很高兴认识你。")
-chat_history.add_user_message("我喜欢编程")
-chat_history.add_ai_message("编程是一个很有趣的技能！你主要使用什么编程语言？")
-
-# 遍历并显示所有历史消息
-# chat_history.messages 返回所有消息的列表
-print("聊天历史:")
-for message in chat_history.messages:
-    # 使用isinstance()检查消息类型，并相应地显示
-    if isinstance(message, HumanMessage):
-        print(f"用户: {message.content}")
-    elif isinstance(message, AIMessage):
-        print(f"AI: {message.content}")
+def demo_chat_history():
+    """演示基础聊天记忆"""
+    print("\n1. 基础聊天记忆 - ChatMessageHistory")
+    print("-" * 40)
+
+    # 创建聊天记忆历史实例
+    # ChatMessageHistory是一个简单的内存存储，用于保存对话消息
+    chat_history = ChatMessageHistory()
+
+    # 添加用户和AI的历史消息
+    # add_user_message(): 添加用户消息，会创建HumanMessage对象
+    # add_ai_message(): 添加AI消息，会创建AIMessage对象
+    chat_history.add_user_message("你好，我叫张三")
+    chat_history.add_ai_message("你好张三！很高兴认识你。")
+    chat_history.add_user_message("我喜欢编程")
+    chat_history.add_ai_message("编程是一个很有趣的技能！你主要使用什么编程语言？")
+
+    # 遍历并显示所有历史消息
+    # chat_history.messages 返回所有消息的列表
+    print("聊天历史:")
+    for message in chat_history.messages:
+        # 使用isinstance()检查消息类型，并相应地显示
+        if isinstance(message, HumanMessage):
+            print(f"用户: {message.content}")
+        elif isinstance(message, AIMessage):
+            print(f"AI: {message.content}")
 
 # ============================================================================
 # 2. 带记忆的对话链 - RunnableWithMessageHistory
 # ============================================================================
-print("\n\n2. 带记忆的对话链 - RunnableWithMessageHistory")
-print("-" * 40)
-
 """
 RunnableWithMessageHistory 是LangChain中用于创建有记忆的对话链的核心组件
 - 功能：将记忆功能集成到LangChain的处理链中
@@ -121,12 +124,24 @@ prompt = ChatPromptTemplate.from_messages([
 # 这是LangChain的链式调用模式，数据从左到右流动
 chain = prompt | llm | StrOutputParser()
 
-# 创建会话存储字典，用于保存不同用户的对话历史
+# 创建会话存储，用于保存不同用户的对话历史
 # 键：session_id（会话ID），值：ChatMessageHistory对象
 # 这允许系统同时处理多个用户的独立对话
-store = {}
-
-def get_session_history(session_id: str) -> ChatMessageHistory:
+# BoundedSessionStore（见 session_store.py）限制常驻内存的会话数和字节数，
+# 超出时把最久未使用的会话换出到磁盘，再次访问时自动加载回来
+# 存储在第一次使用时才创建（见 get_store），导入本模块不会创建存储
+_store: Optional[BoundedSessionStore] = None
+_store_lock = threading.Lock()
+
+def get_store() -> BoundedSessionStore:
+    """返回聊天历史的会话存储，第一次调用时创建"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BoundedSessionStore(max_sessions=1000, max_bytes=64 * 1024 * 1024)
+        return _store
+
+def get_session_history(session_id: str) -> BaseChatMessageHistory:
     """
     获取指定会话的历史记录
     
@@ -136,15 +151,13 @@ def get_session_history(session_id: str) -> ChatMessageHistory:
         session_id (str): 会话唯一标识符，通常是用户ID或会话ID
         
     Returns:
-        ChatMessageHistory: 该会话的历史记录对象
+        BaseChatMessageHistory: 该会话历史的代理对象，每次读写都经过会话存储，
+                                会话在两次调用之间被换出到磁盘也不会丢失消息
         
     Note:
-        如果会话不存在，会自动创建新的ChatMessageHistory实例
+        如果会话不存在，会在第一次读写时自动创建新的ChatMessageHistory实例
     """
-    # 如果会话不存在，创建新的ChatMessageHistory
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
+    return get_store().chat_history(session_id, ChatMessageHistory)
 
 # 创建带记忆功能的处理链
 # RunnableWithMessageHistory 包装基础链，添加记忆功能
@@ -155,41 +168,43 @@ chain_with_history = RunnableWithMessageHistory(
     history_messages_key="chat_history", # 历史消息的键名
 )
 
-# 演示多轮对话，展示记忆功能
-session_id = "user_123"  # 定义会话ID，用于标识特定用户的对话
-print(f"会话ID: {session_id}")
-
-# 第一轮对话：用户自我介绍
-# invoke() 方法调用带记忆的链，传入输入和配置
-response1 = chain_with_history.invoke(
-    {"input": "我叫李四，我是一名软件工程师"},  # 用户输入
-    config={"configurable": {"session_id": session_id}}  # 配置会话ID
-)
-print(f"用户: 我叫李四，我是一名软件工程师")
-print(f"AI: {response1}")
-
-# 第二轮对话：测试AI是否记住了用户姓名
-response2 = chain_with_history.invoke(
-    {"input": "你还记得我的名字吗？"},
-    config={"configurable": {"session_id": session_id}}
-)
-print(f"用户: 你还记得我的名字吗？")
-print(f"AI: {response2}")
-
-# 第三轮对话：测试AI是否记住了用户职业
-response3 = chain_with_history.invoke(
-    {"input": "我的职业是什么？"},
-    config={"configurable": {"session_id": session_id}}
-)
-print(f"用户: 我的职业是什么？")
-print(f"AI: {response3}")
+def demo_chain_with_history():
+    """演示带记忆的多轮对话（会调用LLM）"""
+    print("\n\n2. 带记忆的对话链 - RunnableWithMessageHistory")
+    print("-" * 40)
+
+    # 演示多轮对话，展示记忆功能
+    session_id = "user_123"  # 定义会话ID，用于标识特定用户的对话
+    print(f"会话ID: {session_id}")
+
+    # 第一轮对话：用户自我介绍
+    # invoke() 方法调用带记忆的链，传入输入和配置
+    response1 = chain_with_history.invoke(
+        {"input": "我叫李四，我是一名软件工程师"},  # 用户输入
+        config={"configurable": {"session_id": session_id}}  # 配置会话ID
+    )
+    print(f"用户: 我叫李四，我是一名软件工程师")
+    print(f"AI: {response1}")
+
+    # 第二轮对话：测试AI是否记住了用户姓名
+    response2 = chain_with_history.invoke(
+        {"input": "你还记得我的名字吗？"},
+        config={"configurable": {"session_id": session_id}}
+    )
+    print(f"用户: 你还记得我的名字吗？")
+    print(f"AI: {response2}")
+
+    # 第三轮对话：测试AI是否记住了用户职业
+    response3 = chain_with_history.invoke(
+        {"input": "我的职业是什么？"},
+        config={"configurable": {"session_id": session_id}}
+    )
+    print(f"用户: 我的职业是什么？")
+    print(f"AI: {response3}")
 
 # ============================================================================
 # 3. 现代缓冲记忆 - 使用ChatMessageHistory
 # ============================================================================
-print("\n\n3. 现代缓冲记忆 - 使用ChatMessageHistory")
-print("-" * 40)
-
 """
 缓冲记忆(Buffer Memory)是最简单的记忆类型
 - 功能：保存所有的对话历史，不做任何处理
@@ -244,29 +259,42 @@ class BufferMemory:
         """
         return len(self.chat_history.messages)
 
-# 创建缓冲记忆实例
-buffer_memory = BufferMemory()
-
-# 添加对话历史到缓冲记忆
-# 这些对话会被完整保存，不会被删除或修改
-buffer_memory.add_conversation("我今天学习了Python", "太好了！Python是一门很实用的编程语言。")
-buffer_memory.add_conversation("我想学习机器学习", "机器学习很有趣！建议从scikit-learn开始。")
-
-# 获取并显示缓冲记忆中的所有内容
-print("缓冲记忆内容:")
-print(f"总消息数: {buffer_memory.get_message_count()}")
-for message in buffer_memory.get_messages():
-    if isinstance(message, HumanMessage):
-        print(f"用户: {message.content}")
-    elif isinstance(message, AIMessage):
-        print(f"AI: {message.content}")
+    def to_dict(self) -> dict:
+        """序列化为字典（会话存储换出到磁盘时使用）"""
+        return {"type": "buffer", "messages": messages_to_dict(self.chat_history.messages)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BufferMemory":
+        """从 to_dict() 的结果恢复"""
+        memory = cls()
+        memory.chat_history.add_messages(messages_from_dict(data["messages"]))
+        return memory
+
+def demo_buffer_memory():
+    """演示缓冲记忆"""
+    print("\n\n3. 现代缓冲记忆 - 使用ChatMessageHistory")
+    print("-" * 40)
+
+    # 创建缓冲记忆实例
+    buffer_memory = BufferMemory()
+
+    # 添加对话历史到缓冲记忆
+    # 这些对话会被完整保存，不会被删除或修改
+    buffer_memory.add_conversation("我今天学习了Python", "太好了！Python是一门很实用的编程语言。")
+    buffer_memory.add_conversation("我想学习机器学习", "机器学习很有趣！建议从scikit-learn开始。")
+
+    # 获取并显示缓冲记忆中的所有内容
+    print("缓冲记忆内容:")
+    print(f"总消息数: {buffer_memory.get_message_count()}")
+    for message in buffer_memory.get_messages():
+        if isinstance(message, HumanMessage):
+            print(f"用户: {message.content}")
+        elif isinstance(message, AIMessage):
+            print(f"AI: {message.content}")
 
 # ============================================================================
 # 4. 现代窗口记忆 - 只保留最近的对话
 # ============================================================================
-print("\n\n4. 现代窗口记忆 - 只保留最近的对话")
-print("-" * 40)
-
 """
 窗口记忆(Window Memory)只保留最近的N轮对话
 - 功能：维护固定大小的对话窗口，自动删除旧对话
@@ -338,38 +366,51 @@ class WindowMemory:
             "current_conversations": len(self.chat_history.messages) // 2
         }
 
-# 创建窗口记忆（只保留最近2轮对话）
-window_memory = WindowMemory(k=2)
-
-# 添加多轮对话，观察窗口记忆的行为
-conversations = [
-    ("我叫王五", "你好王五！"),
-    ("我住在北京", "北京是个很棒的城市！"),
-    ("我喜欢旅游", "旅游能开阔视野，很不错！"),
-    ("我想去上海", "上海也是个很有魅力的城市！"),
-    ("你还记得我的名字吗？", "让我看看...")
-]
-
-print("逐步添加对话到窗口记忆:")
-for i, (user_msg, ai_msg) in enumerate(conversations, 1):
-    window_memory.add_conversation(user_msg, ai_msg)
-    info = window_memory.get_window_info()
-    print(f"第{i}轮对话后 - 当前对话数: {info['current_conversations']}/{info['window_size']}")
-
-# 获取窗口记忆内容（只显示最近k=2轮对话）
-print("\n窗口记忆内容（最近2轮对话）:")
-for message in window_memory.get_messages():
-    if isinstance(message, HumanMessage):
-        print(f"用户: {message.content}")
-    elif isinstance(message, AIMessage):
-        print(f"AI: {message.content}")
+    def to_dict(self) -> dict:
+        """序列化为字典（会话存储换出到磁盘时使用）"""
+        return {"type": "window", "k": self.k, "messages": messages_to_dict(self.chat_history.messages)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "WindowMemory":
+        """从 to_dict() 的结果恢复"""
+        memory = cls(k=data["k"])
+        memory.chat_history.add_messages(messages_from_dict(data["messages"]))
+        return memory
+
+def demo_window_memory():
+    """演示窗口记忆"""
+    print("\n\n4. 现代窗口记忆 - 只保留最近的对话")
+    print("-" * 40)
+
+    # 创建窗口记忆（只保留最近2轮对话）
+    window_memory = WindowMemory(k=2)
+
+    # 添加多轮对话，观察窗口记忆的行为
+    conversations = [
+        ("我叫王五", "你好王五！"),
+        ("我住在北京", "北京是个很棒的城市！"),
+        ("我喜欢旅游", "旅游能开阔视野，很不错！"),
+        ("我想去上海", "上海也是个很有魅力的城市！"),
+        ("你还记得我的名字吗？", "让我看看...")
+    ]
+
+    print("逐步添加对话到窗口记忆:")
+    for i, (user_msg, ai_msg) in enumerate(conversations, 1):
+        window_memory.add_conversation(user_msg, ai_msg)
+        info = window_memory.get_window_info()
+        print(f"第{i}轮对话后 - 当前对话数: {info['current_conversations']}/{info['window_size']}")
+
+    # 获取窗口记忆内容（只显示最近k=2轮对话）
+    print("\n窗口记忆内容（最近2轮对话）:")
+    for message in window_memory.get_messages():
+        if isinstance(message, HumanMessage):
+            print(f"用户: {message.content}")
+        elif isinstance(message, AIMessage):
+            print(f"AI: {message.content}")
 
 # ============================================================================
 # 5. 现代摘要记忆 - 使用LLM生成对话摘要
 # ============================================================================
-print("\n\n5. 现代摘要记忆 - 使用LLM生成对话摘要")
-print("-" * 40)
-
 """
 摘要记忆(Summary Memory)使用LLM来压缩对话历史
 - 功能：当对话过长时，使用LLM生成摘要来压缩历史信息
@@ -377,6 +418,9 @@ print("-" * 40)
 - 缺点：可能丢失一些细节信息，依赖LLM的摘要质量
 - 适用场景：长期对话，需要保留历史信息但控制内存使用
 - 内存复杂度：O(1)，摘要大小相对固定
+- 后台摘要：摘要在线程池中生成（见 background_summary.py），添加对话时不等待LLM；
+  摘要完成前，上下文继续使用旧摘要和尚未压缩的原始消息
+- 分层压缩：摘要本身也有token预算（见 summary_compaction.py），超出时由LLM合并成更高一层的摘要
 """
 
 class SummaryMemory:
@@ -387,18 +431,34 @@ class SummaryMemory:
     保留最近的对话和历史摘要，实现内存使用的平衡
     """
 
-    def __init__(self, llm, max_messages: int = 10):
+    def __init__(self, llm, max_messages: int = 10, background: bool = True,
+                 summarizer: Optional[BackgroundSummarizer] = None,
+                 summary_level_budgets: Sequence[int] = (200, 200)):
         """
         初始化摘要记忆
 
         Args:
             llm: 用于生成摘要的语言模型
             max_messages (int): 触发摘要的最大消息数，默认10条
+            background (bool): 是否在后台生成摘要，False 时在 add_conversation 中同步生成
+            summarizer: 自定义的后台摘要调度器（例如使用指定的线程池）
+            summary_level_budgets: 分层摘要每层的token预算，长度即层数，默认两层各200个token；
+                                  新摘要按第0层预算的四分之一限制长度，第0层可以容纳几段摘要
         """
         self.llm = llm
         self.max_messages = max_messages
         self.chat_history = ChatMessageHistory()
-        self.summary = ""  # 存储历史对话的摘要
+        self.summary = ""  # 存储历史对话的摘要（分层摘要渲染后的文本）
+
+        # 分层摘要：新摘要进入第0层，某层超出预算时合并到上一层
+        self.token_counter = create_token_counter(getattr(llm, "model_name", None))
+        self._summary_levels = HierarchicalSummary(summary_level_budgets, self.token_counter)
+
+        # 双缓冲：开始摘要时旧消息从 chat_history 移到 _pending_messages，
+        # 摘要完成前上下文仍然包含这些原始消息，完成后再丢弃
+        self._pending_messages: List[BaseMessage] = []
+        self._lock = threading.RLock()
+        self._summarizer = (summarizer or BackgroundSummarizer()) if background else None
 
     def add_conversation(self, user_msg: str, ai_msg: str):
         """
@@ -407,59 +467,143 @@ class SummaryMemory:
         Args:
             user_msg (str): 用户消息
             ai_msg (str): AI回复消息
+
+        Note:
+            后台模式下只提交摘要任务，不等待摘要完成；
+            摘要进行中再次超限时与当前任务合并，完成后再补充摘要一次
         """
-        self.chat_history.add_user_message(user_msg)
-        self.chat_history.add_ai_message(ai_msg)
+        with self._lock:
+            self.chat_history.add_user_message(user_msg)
+            self.chat_history.add_ai_message(ai_msg)
+            over_limit = len(self.chat_history.messages) > self.max_messages
 
         # 如果消息数量超过限制，生成摘要
-        if len(self.chat_history.messages) > self.max_messages:
-            self._create_summary()
+        if over_limit:
+            if self._summarizer:
+                self._summarizer.request(self._create_summary)
+            else:
+                self._create_summary()
 
     def _create_summary(self):
         """
         创建对话摘要
 
         将较旧的对话转换为摘要，只保留最近的对话
-        这是一个私有方法，由add_conversation自动调用
+        这是一个私有方法，由add_conversation触发（后台模式下在线程池中执行）
+        """
+        with self._lock:
+            # 合并的触发到这里时可能已经不再超限
+            if len(self.chat_history.messages) <= self.max_messages:
+                return
+
+            # 保留最近2轮对话（4条消息），旧消息移到待摘要缓冲区
+            old_messages = self.chat_history.messages[:-4]
+            if not old_messages:
+                return
+            self._pending_messages = old_messages
+            self.chat_history.messages = self.chat_history.messages[-4:]
+
+        # 构建要摘要的文本
+        messages_text = ""
+        for msg in old_messages:
+            if isinstance(msg, HumanMessage):
+                messages_text += f"用户: {msg.content}\n"
+            elif isinstance(msg, AIMessage):
+                messages_text += f"AI: {msg.content}\n"
+
+        # 创建摘要提示（长度按分层摘要第0层的预算限制）
+        summary_prompt = f"""
+        请将以下对话总结成简洁的摘要，保留关键信息，长度控制在约{self._summary_levels.summary_budget}个token以内：
+
+        {messages_text}
+
+        摘要：
         """
-        # 保留最近2轮对话（4条消息）
-        recent_messages = self.chat_history.messages[-4:]
-        old_messages = self.chat_history.messages[:-4]
 
-        if old_messages:
-            # 构建要摘要的文本
-            messages_text = ""
-            for msg in old_messages:
-                if isinstance(msg, HumanMessage):
-                    messages_text += f"用户: {msg.content}\n"
-                elif isinstance(msg, AIMessage):
-                    messages_text += f"AI: {msg.content}\n"
+        try:
+            # 使用LLM生成摘要（不持有锁，前台可以继续读写记忆）
+            new_summary = self._invoke_llm(summary_prompt)
+        except Exception as e:
+            print(f"生成摘要时出错: {e}")
+            with self._lock:
+                # 旧消息放回历史开头，不丢失对话
+                self.chat_history.messages = self._pending_messages + self.chat_history.messages
+                self._pending_messages = []
+            return
+
+        with self._lock:
+            # 更新摘要：新摘要追加到分层摘要的第0层
+            self._summary_levels.add(new_summary)
+            self.summary = self._summary_levels.render()
+
+            # 摘要已经覆盖待摘要缓冲区中的消息，可以丢弃
+            self._pending_messages = []
+            print(f"生成了新的对话摘要")
+
+        # 摘要超出分层预算时继续压缩摘要本身（仍在同一个摘要任务中）
+        try:
+            compacted = self._summary_levels.compact(self._invoke_llm, self._lock)
+        except Exception as e:
+            print(f"压缩摘要时出错: {e}")
+            compacted = 1  # 出错前可能已经完成了部分合并
+        if compacted:
+            with self._lock:
+                self.summary = self._summary_levels.render()
+            print(f"压缩了对话摘要")
 
-            # 创建摘要提示
-            summary_prompt = f"""
-            请将以下对话总结成简洁的摘要，保留关键信息：
+    def _invoke_llm(self, prompt: str) -> str:
+        """
+        调用LLM并返回文本结果
+
+        Args:
+            prompt (str): 提示词
+
+        Returns:
+            str: LLM生成的文本
+        """
+        response = self.llm.invoke(prompt)
+        return response.content if hasattr(response, 'content') else str(response)
 
-            {messages_text}
+    def wait_for_summary(self, timeout: Optional[float] = None):
+        """
+        等待后台摘要完成
 
-            摘要：
-            """
+        Args:
+            timeout (float): 最长等待秒数，None 表示一直等待
+        """
+        if self._summarizer:
+            self._summarizer.wait(timeout)
 
-            try:
-                # 使用LLM生成摘要
-                response = self.llm.invoke(summary_prompt)
-                new_summary = response.content if hasattr(response, 'content') else str(response)
+    @property
+    def is_summarizing(self) -> bool:
+        """是否有后台摘要正在进行（此时不能把记忆换出到磁盘）"""
+        return bool(self._summarizer and self._summarizer.running)
 
-                # 更新摘要：如果已有摘要，则合并；否则创建新摘要
-                if self.summary:
-                    self.summary = f"{self.summary}\n{new_summary}"
-                else:
-                    self.summary = new_summary
+    def to_dict(self) -> dict:
+        """序列化为字典（会话存储换出到磁盘时使用）"""
+        with self._lock:
+            return {
+                "type": "summary",
+                "max_messages": self.max_messages,
+                "messages": messages_to_dict(self._pending_messages + self.chat_history.messages),
+                "summary_levels": self._summary_levels.to_dict()
+            }
 
-                # 清除旧消息，只保留最近的对话
-                self.chat_history.messages = recent_messages
-                print(f"生成了新的对话摘要")
-            except Exception as e:
-                print(f"生成摘要时出错: {e}")
+    @classmethod
+    def from_dict(cls, data: dict, llm) -> "SummaryMemory":
+        """
+        从 to_dict() 的结果恢复
+
+        Args:
+            data (dict): to_dict() 的结果
+            llm: 用于生成摘要的语言模型（不参与序列化）
+        """
+        levels = data["summary_levels"]
+        memory = cls(llm, max_messages=data["max_messages"], summary_level_budgets=levels["level_budgets"])
+        memory.chat_history.add_messages(messages_from_dict(data["messages"]))
+        memory._summary_levels = HierarchicalSummary.from_dict(levels, memory.token_counter)
+        memory.summary = memory._summary_levels.render()
+        return memory
 
     def get_context(self) -> str:
         """
@@ -468,12 +612,17 @@ class SummaryMemory:
         Returns:
             str: 包含历史摘要和最近对话的完整上下文
         """
+        with self._lock:
+            summary = self.summary
+            # 摘要生成期间，正在被压缩的原始消息仍然作为最近对话的一部分
+            messages = self._pending_messages + self.chat_history.messages
+
         context = ""
-        if self.summary:
-            context += f"对话摘要: {self.summary}\n\n"
+        if summary:
+            context += f"对话摘要: {summary}\n\n"
 
         context += "最近对话:\n"
-        for msg in self.chat_history.messages:
+        for msg in messages:
             if isinstance(msg, HumanMessage):
                 context += f"用户: {msg.content}\n"
             elif isinstance(msg, AIMessage):
@@ -488,42 +637,53 @@ class SummaryMemory:
         Returns:
             dict: 包含摘要长度、当前消息数等统计信息
         """
-        return {
-            "has_summary": bool(self.summary),
-            "summary_length": len(self.summary) if self.summary else 0,
-            "current_messages": len(self.chat_history.messages),
-            "max_messages": self.max_messages
-        }
-
-# 创建摘要记忆
-summary_memory = SummaryMemory(llm, max_messages=6)
-
-# 添加长对话历史，触发摘要生成
-long_conversations = [
-    ("我是一名数据科学家", "很高兴认识你！数据科学是个很有前景的领域。"),
-    ("我在一家互联网公司工作", "互联网行业发展很快，一定很有挑战性。"),
-    ("我们公司主要做电商业务", "电商是个竞争激烈的行业，需要不断创新。"),
-    ("我负责用户行为分析", "用户行为分析对业务决策很重要。"),
-    ("我们使用Python和SQL进行数据分析", "这是数据分析的经典组合工具。"),
-    ("最近在学习深度学习", "深度学习在很多领域都有应用，值得深入学习。")
-]
-
-print("添加长对话历史...")
-for user_msg, ai_msg in long_conversations:
-    summary_memory.add_conversation(user_msg, ai_msg)
-    stats = summary_memory.get_memory_stats()
-    print(f"当前消息数: {stats['current_messages']}, 有摘要: {stats['has_summary']}")
-
-# 获取摘要记忆内容
-print("\n摘要记忆内容:")
-print(summary_memory.get_context())
+        with self._lock:
+            return {
+                "has_summary": bool(self.summary),
+                "summary_length": len(self.summary) if self.summary else 0,
+                "summary_tokens": self._summary_levels.total_tokens,
+                "buffer_tokens": sum(self.token_counter(msg.content)
+                                     for msg in self._pending_messages + self.chat_history.messages),
+                "summary_levels": self._summary_levels.stats(),
+                "current_messages": len(self.chat_history.messages),
+                "summarizing_messages": len(self._pending_messages),
+                "max_messages": self.max_messages
+            }
+
+def demo_summary_memory():
+    """演示摘要记忆（会调用LLM）"""
+    print("\n\n5. 现代摘要记忆 - 使用LLM生成对话摘要")
+    print("-" * 40)
+
+    # 创建摘要记忆
+    summary_memory = SummaryMemory(llm, max_messages=6)
+
+    # 添加长对话历史，触发摘要生成
+    long_conversations = [
+        ("我是一名数据科学家", "很高兴认识你！数据科学是个很有前景的领域。"),
+        ("我在一家互联网公司工作", "互联网行业发展很快，一定很有挑战性。"),
+        ("我们公司主要做电商业务", "电商是个竞争激烈的行业，需要不断创新。"),
+        ("我负责用户行为分析", "用户行为分析对业务决策很重要。"),
+        ("我们使用Python和SQL进行数据分析", "这是数据分析的经典组合工具。"),
+        ("最近在学习深度学习", "深度学习在很多领域都有应用，值得深入学习。")
+    ]
+
+    print("添加长对话历史...")
+    for user_msg, ai_msg in long_conversations:
+        summary_memory.add_conversation(user_msg, ai_msg)
+        stats = summary_memory.get_memory_stats()
+        print(f"当前消息数: {stats['current_messages']}, 有摘要: {stats['has_summary']}")
+
+    # 摘要在后台生成，展示最终内容前等待进行中的摘要完成
+    summary_memory.wait_for_summary()
+
+    # 获取摘要记忆内容
+    print("\n摘要记忆内容:")
+    print(summary_memory.get_context())
 
 # ============================================================================
 # 6. 现代多会话记忆管理
 # ============================================================================
-print("\n\n6. 现代多会话记忆管理")
-print("-" * 40)
-
 """
 多会话记忆管理允许系统同时处理多个用户的独立对话
 - 功能：为不同用户维护独立的记忆空间
@@ -532,9 +692,52 @@ print("-" * 40)
 - 实现方式：使用会话ID作为键，存储不同的记忆实例
 """
 
+def load_session_memory(data: dict):
+    """
+    从磁盘层的字典恢复记忆实例（供会话存储加载被换出的会话）
+
+    Args:
+        data (dict): 记忆实例 to_dict() 的结果
+
+    Returns:
+        记忆实例：根据 data["type"] 恢复相应的记忆对象
+    """
+    if data["type"] == "buffer":
+        return BufferMemory.from_dict(data)
+    if data["type"] == "window":
+        return WindowMemory.from_dict(data)
+    if data["type"] == "summary":
+        return SummaryMemory.from_dict(data, llm)
+    raise ValueError(f"不支持的记忆类型: {data['type']}")
+
 # 创建多个会话的记忆存储
-# 这是一个全局存储，用于管理所有用户的记忆
-session_store = {}
+# 这是一个全局存储，用于管理所有用户的记忆，第一次使用时才创建（见 get_session_store）
+# 与聊天历史的存储一样限制常驻的会话数和字节数，最久未使用的记忆换出到磁盘；
+# 后台摘要进行中的摘要记忆不会被换出
+_session_store: Optional[BoundedSessionStore] = None
+
+def get_session_store() -> BoundedSessionStore:
+    """返回记忆实例的会话存储，第一次调用时创建"""
+    global _session_store
+    with _store_lock:
+        if _session_store is None:
+            _session_store = BoundedSessionStore(
+                max_sessions=1000,
+                max_bytes=64 * 1024 * 1024,
+                dump=lambda memory: memory.to_dict(),
+                load=load_session_memory,
+                can_evict=lambda memory: not getattr(memory, "is_summarizing", False)
+            )
+        return _session_store
+
+def close_session_stores():
+    """关闭已创建的会话存储，删除换出到磁盘的会话和存储创建的临时目录"""
+    global _store, _session_store
+    with _store_lock:
+        for created in (_store, _session_store):
+            if created is not None:
+                created.close()
+        _store = _session_store = None
 
 def create_session_memory(session_id: str, memory_type: str = "buffer"):
     """
@@ -545,104 +748,122 @@ def create_session_memory(session_id: str, memory_type: str = "buffer"):
         memory_type (str): 记忆类型，可选值：buffer, window, summary
 
     Returns:
-        记忆实例：根据memory_type返回相应的记忆对象
+        StoredSessionProxy: 记忆实例的代理（见 session_store.py），用法与记忆对象相同
 
     Note:
-        如果会话已存在，直接返回现有的记忆实例
-        如果会话不存在，根据memory_type创建新的记忆实例
+        如果会话已存在，沿用现有的记忆实例；如果会话不存在，根据memory_type创建新的记忆实例
+        代理不持有记忆对象，每次访问都经过会话存储：会话在两次访问之间被换出到磁盘时自动加载，
+        写入不会丢失，常驻字节数也在每次调用后重新估算
     """
-    if session_id not in session_store:
+    def create():
         if memory_type == "buffer":
-            session_store[session_id] = BufferMemory()
+            return BufferMemory()
         elif memory_type == "window":
-            session_store[session_id] = WindowMemory(k=3)  # 保留3轮对话
+            return WindowMemory(k=3)  # 保留3轮对话
         elif memory_type == "summary":
-            session_store[session_id] = SummaryMemory(llm, max_messages=4)
+            return SummaryMemory(llm, max_messages=4)
+        raise ValueError(f"不支持的记忆类型: {memory_type}")
+
+    # 立即创建会话，不支持的记忆类型在这里报错
+    session_store = get_session_store()
+    with session_store.session(session_id, create):
+        pass
+    return session_store.proxy(session_id, create)
+
+def demo_session_memory():
+    """演示多会话记忆管理"""
+    print("\n\n6. 现代多会话记忆管理")
+    print("-" * 40)
+
+    # 模拟不同用户的会话
+    # 每个元组包含：(用户ID, 记忆类型, 对话列表)
+    users = [
+        ("user_001", "buffer", [("我是张三", "你好张三！"), ("我喜欢编程", "编程很有趣！")]),
+        ("user_002", "window", [("我是李四", "你好李四！"), ("我是老师", "教师是个伟大的职业！")]),
+        ("user_003", "summary", [("我在学习AI", "AI是未来的趋势！"), ("我想做研究", "研究工作很有意义！")])
+    ]
+
+    print("为不同用户创建独立的记忆空间:")
+    for user_id, mem_type, conversations in users:
+        print(f"\n用户 {user_id} (使用{mem_type}记忆):")
+
+        # 为用户创建或获取记忆实例
+        memory = create_session_memory(user_id, mem_type)
+
+        # 添加用户的对话历史
+        for user_msg, ai_msg in conversations:
+            memory.add_conversation(user_msg, ai_msg)
+
+        # 显示记忆内容
+        if mem_type == "summary":
+            memory.wait_for_summary()
+            print(f"  上下文: {memory.get_context()}")
         else:
-            raise ValueError(f"不支持的记忆类型: {memory_type}")
-    return session_store[session_id]
-
-# 模拟不同用户的会话
-# 每个元组包含：(用户ID, 记忆类型, 对话列表)
-users = [
-    ("user_001", "buffer", [("我是张三", "你好张三！"), ("我喜欢编程", "编程很有趣！")]),
-    ("user_002", "window", [("我是李四", "你好李四！"), ("我是老师", "教师是个伟大的职业！")]),
-    ("user_003", "summary", [("我在学习AI", "AI是未来的趋势！"), ("我想做研究", "研究工作很有意义！")])
-]
-
-print("为不同用户创建独立的记忆空间:")
-for user_id, mem_type, conversations in users:
-    print(f"\n用户 {user_id} (使用{mem_type}记忆):")
-
-    # 为用户创建或获取记忆实例
-    memory = create_session_memory(user_id, mem_type)
-
-    # 添加用户的对话历史
-    for user_msg, ai_msg in conversations:
-        memory.add_conversation(user_msg, ai_msg)
+            print("  对话历史:")
+            for msg in memory.get_messages():
+                if isinstance(msg, HumanMessage):
+                    print(f"    用户: {msg.content}")
+                elif isinstance(msg, AIMessage):
+                    print(f"    AI: {msg.content}")
 
-    # 显示记忆内容
-    if mem_type == "summary":
-        print(f"  上下文: {memory.get_context()}")
-    else:
-        print("  对话历史:")
-        for msg in memory.get_messages():
-            if isinstance(msg, HumanMessage):
-                print(f"    用户: {msg.content}")
-            elif isinstance(msg, AIMessage):
-                print(f"    AI: {msg.content}")
+    session_store = get_session_store()
+    print(f"\n当前管理的会话数: {len(session_store)}")
 
-print(f"\n当前管理的会话数: {len(session_store)}")
+    # 会话存储统计：命中率、淘汰次数、常驻会话数和常驻字节数
+    stats = session_store.get_stats()
+    print(f"会话存储统计: 命中率 {stats['hit_rate']:.0%}，淘汰 {stats['evictions']} 次，"
+          f"常驻 {stats['resident_sessions']} 个会话 / {stats['resident_bytes']} 字节")
 
 # ============================================================================
 # 7. 持久化记忆示例
 # ============================================================================
-print("\n\n7. 持久化记忆示例")
-print("-" * 40)
-
 """
 持久化记忆将对话历史保存到文件系统
 - 功能：将记忆数据保存到磁盘，程序重启后可恢复
 - 特点：数据持久化，支持自动保存和加载
 - 适用场景：需要长期保存用户对话历史的应用
-- 存储格式：JSON格式，便于读取和编辑
+- 存储格式：JSON快照 + JSONL追加日志（见 memory_journal.py）
+- 写入开销：每轮对话只在日志末尾追加两行，不再重写整个文件；
+  日志超过快照一定倍数时才压缩成新快照，摊还后每条消息的写入开销是常数
 """
 
 class PersistentMemory:
     """
     可持久化的记忆类
 
-    将对话历史保存到JSON文件，支持自动加载和保存
+    将对话历史保存到 JSON 快照和 JSONL 追加日志，支持自动加载和保存
     适合需要在程序重启后保持对话历史的场景
     """
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, fsync_interval: Optional[float] = None,
+                 compact_ratio: float = 2.0):
         """
         初始化持久化记忆
 
         Args:
-            file_path (str): 保存记忆数据的文件路径
+            file_path (str): 快照文件路径，追加日志保存在 file_path + ".journal"
+            fsync_interval (float): 组提交的 fsync 间隔（秒），None 不调用 fsync，0 每轮都 fsync
+            compact_ratio (float): 日志超过快照大小的这个倍数时压缩成新快照
         """
         self.file_path = file_path
         self.memory = ChatMessageHistory()
+        self.journal = MessageJournal(file_path, fsync_interval=fsync_interval,
+                                      compact_ratio=compact_ratio)
         self.load_memory()  # 初始化时自动加载已有数据
 
+    @staticmethod
+    def _to_record(msg: BaseMessage) -> dict:
+        """把消息转换为持久化记录"""
+        return {"type": "human" if isinstance(msg, HumanMessage) else "ai", "content": msg.content}
+
     def save_memory(self):
         """
         保存记忆到文件
 
-        将当前的对话历史序列化为JSON格式并保存到文件
+        把当前的全部对话历史写成新快照并清空追加日志（即手动压缩）
         """
-        data = []
-        for msg in self.memory.messages:
-            if isinstance(msg, HumanMessage):
-                data.append({"type": "human", "content": msg.content})
-            elif isinstance(msg, AIMessage):
-                data.append({"type": "ai", "content": msg.content})
-
         try:
-            with open(self.file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.journal.compact([self._to_record(msg) for msg in self.memory.messages])
             print(f"记忆已保存到 {self.file_path}")
         except Exception as e:
             print(f"保存记忆时出错: {e}")
@@ -651,20 +872,20 @@ class PersistentMemory:
         """
         从文件加载记忆
 
-        读取JSON文件并恢复对话历史
+        读取快照并重放追加日志，恢复对话历史
+        日志末尾因崩溃写了一半的记录会被丢弃
         如果文件不存在，会创建新的空记忆
         """
         try:
-            with open(self.file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            records = self.journal.load()
 
             # 重建对话历史
-            for item in data:
+            for item in records:
                 if item["type"] == "human":
                     self.memory.add_user_message(item["content"])
                 elif item["type"] == "ai":
                     self.memory.add_ai_message(item["content"])
-            print(f"记忆已从 {self.file_path} 加载，共{len(data)}条消息")
+            print(f"记忆已从 {self.file_path} 加载，共{len(records)}条消息")
         except FileNotFoundError:
             print(f"记忆文件 {self.file_path} 不存在，创建新的记忆")
         except Exception as e:
@@ -677,10 +898,19 @@ class PersistentMemory:
         Args:
             user_msg (str): 用户消息
             ai_msg (str): AI回复消息
+
+        Note:
+            只把这一轮的两条消息追加到日志，日志过大时再压缩成快照
         """
         self.memory.add_user_message(user_msg)
         self.memory.add_ai_message(ai_msg)
-        self.save_memory()  # 每次添加对话后自动保存
+        try:
+            self.journal.append([{"type": "human", "content": user_msg},
+                                 {"type": "ai", "content": ai_msg}])
+            if self.journal.should_compact():
+                self.journal.compact([self._to_record(msg) for msg in self.memory.messages])
+        except Exception as e:
+            print(f"保存记忆时出错: {e}")
 
     def get_messages(self):
         """
@@ -691,46 +921,81 @@ class PersistentMemory:
         """
         return self.memory.messages
 
+    def close(self):
+        """
+        关闭追加日志（设置了 fsync_interval 时先把最近的写入落盘）
+        """
+        self.journal.close()
+
     def clear_memory(self):
         """
-        清空记忆并删除文件
+        清空记忆并删除快照和日志文件
         """
         self.memory.clear()
         try:
-            os.remove(self.file_path)
-            print(f"已清空记忆并删除文件 {self.file_path}")
-        except FileNotFoundError:
-            print("文件不存在，无需删除")
+            existed = os.path.exists(self.file_path) or os.path.exists(self.journal.journal_path)
+            self.journal.clear()
+            if existed:
+                print(f"已清空记忆并删除文件 {self.file_path}")
+            else:
+                print("文件不存在，无需删除")
         except Exception as e:
             print(f"删除文件时出错: {e}")
 
-# 创建持久化记忆实例
-persistent_memory = PersistentMemory("data/memory_data.json")
+def demo_persistent_memory():
+    """演示持久化记忆"""
+    print("\n\n7. 持久化记忆示例")
+    print("-" * 40)
+
+    # 创建持久化记忆实例
+    persistent_memory = PersistentMemory("data/memory_data.json")
 
-# 添加对话（会自动保存到文件）
-print("添加对话到持久化记忆:")
-persistent_memory.add_conversation("我喜欢看电影", "电影是很好的娱乐方式！你喜欢什么类型的电影？")
-persistent_memory.add_conversation("我喜欢科幻电影", "科幻电影很有想象力，能带我们探索未来世界。")
+    # 添加对话（会自动保存到文件）
+    print("添加对话到持久化记忆:")
+    persistent_memory.add_conversation("我喜欢看电影", "电影是很好的娱乐方式！你喜欢什么类型的电影？")
+    persistent_memory.add_conversation("我喜欢科幻电影", "科幻电影很有想象力，能带我们探索未来世界。")
+
+    # 显示记忆内容
+    print("\n持久化记忆内容:")
+    for msg in persistent_memory.get_messages():
+        if isinstance(msg, HumanMessage):
+            print(f"用户: {msg.content}")
+        elif isinstance(msg, AIMessage):
+            print(f"AI: {msg.content}")
 
-# 显示记忆内容
-print("\n持久化记忆内容:")
-for msg in persistent_memory.get_messages():
-    if isinstance(msg, HumanMessage):
-        print(f"用户: {msg.content}")
-    elif isinstance(msg, AIMessage):
-        print(f"AI: {msg.content}")
+    # 关闭追加日志
+    persistent_memory.close()
 
 # ============================================================================
 # 总结和最佳实践
 # ============================================================================
-print("\n" + "=" * 60)
-print("现代记忆模块示例演示完成！")
-print("=" * 60)
-
-print("\n📚 记忆类型总结:")
-print("1. 基础记忆 (ChatMessageHistory) - 简单存储，适合基础应用")
-print("2. 缓冲记忆 (BufferMemory) - 完整保存，适合短期对话")
-print("3. 窗口记忆 (WindowMemory) - 固定大小，适合长期对话")
-print("4. 摘要记忆 (SummaryMemory) - 智能压缩，适合复杂对话")
-print("5. 多会话管理 - 用户隔离，适合多用户系统")
-print("6. 持久化记忆 - 数据保存，适合长期应用")
+def print_summary():
+    """打印记忆类型总结"""
+    print("\n" + "=" * 60)
+    print("现代记忆模块示例演示完成！")
+    print("=" * 60)
+
+    print("\n📚 记忆类型总结:")
+    print("1. 基础记忆 (ChatMessageHistory) - 简单存储，适合基础应用")
+    print("2. 缓冲记忆 (BufferMemory) - 完整保存，适合短期对话")
+    print("3. 窗口记忆 (WindowMemory) - 固定大小，适合长期对话")
+    print("4. 摘要记忆 (SummaryMemory) - 智能压缩，适合复杂对话")
+    print("5. 多会话管理 - 用户隔离，适合多用户系统")
+    print("6. 持久化记忆 - 数据保存，适合长期应用")
+
+
+# 演示部分只在直接运行脚本时执行，其他脚本（如基准测试）可以单独导入记忆类
+if __name__ == "__main__":
+    print("=" * 60)
+    print("LangChain 记忆模块完整示例（详细注释版）")
+    print("=" * 60)
+
+    demo_chat_history()
+    demo_chain_with_history()
+    demo_buffer_memory()
+    demo_window_memory()
+    demo_summary_memory()
+    demo_session_memory()
+    demo_persistent_memory()
+    print_summary()
+    close_session_stores()
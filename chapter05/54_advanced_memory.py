@@ -26,14 +26,19 @@ LangChain 现代高级记忆模块示例
 
 import json
 import os
+import threading
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Sequence
 
 import dotenv
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
 from langchain_openai import ChatOpenAI
 
+from background_summary import BackgroundSummarizer
+from memory_tokens import create_token_counter
+from summary_compaction import HierarchicalSummary
+
 # ============================================================================
 # 环境配置和模型初始化
 # ============================================================================
@@ -71,6 +76,12 @@ print("-" * 50)
 - 优点：既保留了重要信息，又控制了内存使用
 - 适用场景：长期对话，需要平衡信息保留和内存控制
 - 工作原理：监控token使用量，超限时将旧对话压缩为摘要
+- token计数：默认使用模型自己的分词器（见 memory_tokens.py），不可用时按字符类别估算；
+  每条消息的token数在加入时计算一次并缓存，维护累计值，检查是否超限是O(1)操作
+- 后台摘要：摘要在线程池中生成（见 background_summary.py），add_conversation 不等待LLM；
+  摘要生成期间上下文仍然包含旧摘要和正在被压缩的原始消息
+- 分层压缩：摘要本身也有预算（见 summary_compaction.py），某层超出预算时由LLM合并成
+  更高一层的摘要，避免摘要无限增长占满token预算
 """
 
 class SummaryBufferMemory:
@@ -84,53 +95,107 @@ class SummaryBufferMemory:
     4. 提供完整的上下文信息
     """
 
-    def __init__(self, llm, max_token_limit: int = 100):
+    def __init__(self, llm, max_token_limit: int = 100,
+                 token_counter: Optional[Callable[[str], int]] = None,
+                 background: bool = True, summarizer: Optional[BackgroundSummarizer] = None,
+                 summary_level_budgets: Optional[Sequence[int]] = None):
         """
         初始化摘要缓冲记忆
         
         Args:
             llm: 用于生成摘要的语言模型
             max_token_limit (int): token使用量的上限，超过时触发摘要生成
+            token_counter: 计算文本token数的可调用对象，默认按llm的模型名称
+                          由 create_token_counter() 选择
+            background (bool): 是否在后台生成摘要，False 时在 add_conversation 中同步生成
+            summarizer: 自定义的后台摘要调度器（例如使用指定的线程池）
+            summary_level_budgets: 分层摘要每层的token预算，长度即层数；默认两层，
+                                  第0层为 max_token_limit 的三分之一（可以容纳几段新摘要），
+                                  最高层为六分之一，摘要合计不超过 max_token_limit 的一半
         """
         self.llm = llm                              # 语言模型实例
         self.max_token_limit = max_token_limit      # token限制
         self.chat_history = ChatMessageHistory()   # 当前对话历史
         self.summary = ""                           # 历史对话摘要
+        self.token_counter = token_counter or create_token_counter(getattr(llm, "model_name", None))
+
+        # 与 chat_history.messages 一一对应的token数缓存，以及缓冲区和摘要的累计token数
+        self._message_tokens: List[int] = []
+        self._buffer_tokens = 0
+        self._summary_tokens = 0
+
+        # 分层摘要，self.summary 是它渲染后的文本
+        if summary_level_budgets is None:
+            summary_level_budgets = (max(max_token_limit // 3, 1), max(max_token_limit // 6, 1))
+        self._summary_levels = HierarchicalSummary(summary_level_budgets, self.token_counter)
+
+        # 双缓冲：开始摘要时旧消息从 chat_history 移到 _pending_messages，
+        # 摘要完成前上下文仍然包含这些原始消息，完成后再丢弃
+        self._pending_messages: List[BaseMessage] = []
+        self._pending_message_tokens: List[int] = []
+        self._pending_tokens = 0
+        self._lock = threading.RLock()
+        self._summarizer = (summarizer or BackgroundSummarizer()) if background else None
 
     def _estimate_tokens(self, text: str) -> int:
         """
-        简单估算文本的token数量
+        计算文本的token数量
         
         Args:
-            text (str): 要估算的文本
+            text (str): 要计算的文本
             
         Returns:
-            int: 估算的token数量
+            int: token数量
             
         Note:
-            这是一个简化的估算方法，实际应用中可以使用更精确的tokenizer
-            一般来说，1个token约等于4个字符（对于英文）
+            由 token_counter 计算，使用真实分词器时与模型的计数一致；
+            字符估算时一个汉字约为1个token，英文约4个字符1个token
         """
-        return len(text) // 4
+        return self.token_counter(text)
 
     def _get_total_tokens(self) -> int:
         """
         获取当前记忆的总token数
         
         Returns:
-            int: 当前记忆使用的总token数（包括摘要和当前对话）
+            int: 当前记忆使用的总token数（包括摘要、正在摘要的消息和当前对话）
+            
+        Note:
+            直接返回累计值，不再遍历全部消息重新计数
+        """
+        return self._buffer_tokens + self._pending_tokens + self._summary_tokens
+
+    def _add_message(self, message: BaseMessage):
         """
-        total = 0
+        添加一条消息，同时缓存它的token数并更新累计值
         
-        # 计算当前对话的token数
-        for msg in self.chat_history.messages:
-            total += self._estimate_tokens(msg.content)
+        Args:
+            message (BaseMessage): 要添加的消息
+        """
+        tokens = self._estimate_tokens(message.content)
+        self.chat_history.add_message(message)
+        self._message_tokens.append(tokens)
+        self._buffer_tokens += tokens
+
+    def _refresh_summary(self):
+        """
+        分层摘要变化后，更新渲染后的摘要文本和摘要的token数
+        """
+        self.summary = self._summary_levels.render()
+        self._summary_tokens = self._summary_levels.total_tokens
+
+    def _invoke_llm(self, prompt: str) -> str:
+        """
+        调用LLM并返回文本结果
         
-        # 计算摘要的token数
-        if self.summary:
-            total += self._estimate_tokens(self.summary)
+        Args:
+            prompt (str): 提示词
             
-        return total
+        Returns:
+            str: LLM生成的文本
+        """
+        response = self.llm.invoke(prompt)
+        return response.content if hasattr(response, 'content') else str(response)
 
     def add_conversation(self, user_msg: str, ai_msg: str):
         """
@@ -139,62 +204,123 @@ class SummaryBufferMemory:
         Args:
             user_msg (str): 用户消息
             ai_msg (str): AI回复消息
+            
+        Note:
+            后台模式下只提交摘要任务，不等待摘要完成；
+            摘要进行中再次超限时与当前任务合并，完成后再补充摘要一次
         """
-        # 添加新的对话到历史记录
-        self.chat_history.add_user_message(user_msg)
-        self.chat_history.add_ai_message(ai_msg)
+        with self._lock:
+            # 添加新的对话到历史记录（每条消息只计数一次）
+            self._add_message(HumanMessage(content=user_msg))
+            self._add_message(AIMessage(content=ai_msg))
+            over_limit = self._get_total_tokens() > self.max_token_limit
 
         # 检查是否超过token限制，如果超过则生成摘要
-        if self._get_total_tokens() > self.max_token_limit:
-            self._create_summary()
+        if over_limit:
+            if self._summarizer:
+                self._summarizer.request(self._create_summary)
+            else:
+                self._create_summary()
 
     def _create_summary(self):
         """
         创建摘要并保留最近的对话
         
         这是记忆管理的核心方法：
-        1. 将较旧的对话转换为摘要
-        2. 保留最近的对话以维持上下文连续性
-        3. 更新内部状态
+        1. 将较旧的对话移到待摘要缓冲区，前台只保留最近的对话
+        2. 在锁外调用LLM生成摘要，期间可以继续添加对话
+        3. 摘要完成后合并摘要并丢弃待摘要缓冲区；失败时把旧消息放回历史
+        4. 摘要超出分层预算时继续压缩摘要本身
         """
-        # 保留最近2轮对话（4条消息）
-        recent_messages = self.chat_history.messages[-4:]
-        old_messages = self.chat_history.messages[:-4]
-
-        if old_messages:
-            # 构建要摘要的文本
-            messages_text = ""
-            for msg in old_messages:
-                if isinstance(msg, HumanMessage):
-                    messages_text += f"用户: {msg.content}\n"
-                elif isinstance(msg, AIMessage):
-                    messages_text += f"AI: {msg.content}\n"
-
-            # 创建摘要提示词
-            summary_prompt = f"""
-            请将以下对话总结成简洁的摘要，保留关键信息：
-
-            {messages_text}
-
-            摘要：
-            """
-
-            try:
-                # 使用LLM生成摘要
-                response = self.llm.invoke(summary_prompt)
-                new_summary = response.content if hasattr(response, 'content') else str(response)
-
-                # 更新摘要：如果已有摘要，则合并；否则创建新摘要
-                if self.summary:
-                    self.summary = f"{self.summary}\n{new_summary}"
-                else:
-                    self.summary = new_summary
-
-                # 只保留最近的消息
-                self.chat_history.messages = recent_messages
-                print(f"生成了新的摘要，当前token数: {self._get_total_tokens()}")
-            except Exception as e:
-                print(f"生成摘要时出错: {e}")
+        with self._lock:
+            # 合并的触发到这里时可能已经不再超限
+            if self._get_total_tokens() <= self.max_token_limit:
+                return
+
+            # 保留最近2轮对话（4条消息）
+            old_messages = self.chat_history.messages[:-4]
+            if not old_messages:
+                return
+
+            # 交换缓冲区：旧消息及其token数移到待摘要缓冲区
+            self._pending_messages = old_messages
+            self._pending_message_tokens = self._message_tokens[:-4]
+            self._pending_tokens = sum(self._pending_message_tokens)
+            self.chat_history.messages = self.chat_history.messages[-4:]
+            self._message_tokens = self._message_tokens[-4:]
+            self._buffer_tokens -= self._pending_tokens
+
+        # 构建要摘要的文本
+        messages_text = ""
+        for msg in old_messages:
+            if isinstance(msg, HumanMessage):
+                messages_text += f"用户: {msg.content}\n"
+            elif isinstance(msg, AIMessage):
+                messages_text += f"AI: {msg.content}\n"
+
+        # 创建摘要提示词（长度按分层摘要第0层的预算限制）
+        summary_prompt = f"""
+        请将以下对话总结成简洁的摘要，保留关键信息，长度控制在约{self._summary_levels.summary_budget}个token以内：
+
+        {messages_text}
+
+        摘要：
+        """
+
+        try:
+            # 使用LLM生成摘要（不持有锁，前台可以继续读写记忆）
+            new_summary = self._invoke_llm(summary_prompt)
+        except Exception as e:
+            print(f"生成摘要时出错: {e}")
+            with self._lock:
+                # 旧消息放回历史开头，不丢失对话
+                self.chat_history.messages = self._pending_messages + self.chat_history.messages
+                self._message_tokens = self._pending_message_tokens + self._message_tokens
+                self._buffer_tokens += self._pending_tokens
+                self._pending_messages = []
+                self._pending_message_tokens = []
+                self._pending_tokens = 0
+            return
+
+        with self._lock:
+            # 更新摘要：新摘要追加到分层摘要的第0层
+            self._summary_levels.add(new_summary)
+            self._refresh_summary()
+
+            # 摘要已经覆盖待摘要缓冲区中的消息，可以丢弃
+            self._pending_messages = []
+            self._pending_message_tokens = []
+            self._pending_tokens = 0
+            print(f"生成了新的摘要，当前token数: {self._get_total_tokens()}")
+
+        self._compact_summary()
+
+    def _compact_summary(self):
+        """
+        摘要超出分层预算时，由LLM把超预算的层合并成更高一层的摘要
+        
+        Note:
+            和 _create_summary 在同一个摘要任务中执行，同样不阻塞添加对话
+        """
+        try:
+            compacted = self._summary_levels.compact(self._invoke_llm, self._lock)
+        except Exception as e:
+            print(f"压缩摘要时出错: {e}")
+            compacted = 1  # 出错前可能已经完成了部分合并
+        if compacted:
+            with self._lock:
+                self._refresh_summary()
+                print(f"压缩了摘要，摘要token数: {self._summary_tokens}")
+
+    def wait_for_summary(self, timeout: Optional[float] = None):
+        """
+        等待后台摘要完成
+        
+        Args:
+            timeout (float): 最长等待秒数，None 表示一直等待
+        """
+        if self._summarizer:
+            self._summarizer.wait(timeout)
 
     def get_context(self) -> str:
         """
@@ -203,15 +329,20 @@ class SummaryBufferMemory:
         Returns:
             str: 包含历史摘要和最近对话的完整上下文
         """
+        with self._lock:
+            summary = self.summary
+            # 摘要生成期间，正在被压缩的原始消息仍然作为最近对话的一部分
+            messages = self._pending_messages + self.chat_history.messages
+
         context = ""
         
         # 添加历史摘要（如果存在）
-        if self.summary:
-            context += f"对话摘要: {self.summary}\n\n"
+        if summary:
+            context += f"对话摘要: {summary}\n\n"
 
         # 添加最近的对话
         context += "最近对话:\n"
-        for msg in self.chat_history.messages:
+        for msg in messages:
             if isinstance(msg, HumanMessage):
                 context += f"用户: {msg.content}\n"
             elif isinstance(msg, AIMessage):
@@ -226,44 +357,58 @@ class SummaryBufferMemory:
         Returns:
             dict: 包含各种统计信息的字典
         """
-        return {
-            "total_tokens": self._get_total_tokens(),
-            "max_token_limit": self.max_token_limit,
-            "has_summary": bool(self.summary),
-            "summary_length": len(self.summary) if self.summary else 0,
-            "current_messages": len(self.chat_history.messages),
-            "utilization": self._get_total_tokens() / self.max_token_limit
-        }
-
-# 创建摘要缓冲记忆实例
-summary_buffer_memory = SummaryBufferMemory(llm, max_token_limit=100)
-
-# 准备测试对话数据
-# 这些对话模拟了一个软件工程师的自我介绍和工作讨论
-long_conversation = [
-    ("我是一名软件工程师，在北京工作", "很高兴认识你！软件工程师是个很有前景的职业。"),
-    ("我主要使用Python和Java开发", "这两种语言都很流行，Python特别适合数据处理。"),
-    ("我们公司是做金融科技的", "金融科技是个快速发展的领域，技术要求很高。"),
-    ("我负责后端API开发", "后端开发是系统的核心，责任重大。"),
-    ("最近在学习微服务架构", "微服务架构能提高系统的可扩展性和维护性。"),
-    ("我们使用Docker和Kubernetes", "容器化技术确实能简化部署和管理。"),
-    ("你还记得我的工作地点吗？", "让我回忆一下...")
-]
-
-print("添加对话历史...")
-for i, (user_msg, ai_msg) in enumerate(long_conversation, 1):
-    summary_buffer_memory.add_conversation(user_msg, ai_msg)
+        with self._lock:
+            return {
+                "total_tokens": self._get_total_tokens(),
+                "token_counter": getattr(self.token_counter, "name", type(self.token_counter).__name__),
+                "max_token_limit": self.max_token_limit,
+                "summary_tokens": self._summary_tokens,
+                "buffer_tokens": self._buffer_tokens + self._pending_tokens,
+                "has_summary": bool(self.summary),
+                "summary_length": len(self.summary) if self.summary else 0,
+                "summary_levels": self._summary_levels.stats(),
+                "current_messages": len(self.chat_history.messages),
+                "summarizing_messages": len(self._pending_messages),
+                "summary_requests": dict(self._summarizer.stats) if self._summarizer else None,
+                "utilization": self._get_total_tokens() / self.max_token_limit
+            }
+
+# 演示部分只在直接运行脚本时执行，其他脚本（如基准测试）可以单独导入记忆类
+if __name__ == "__main__":
+    # 创建摘要缓冲记忆实例
+    summary_buffer_memory = SummaryBufferMemory(llm, max_token_limit=100)
+
+    # 准备测试对话数据
+    # 这些对话模拟了一个软件工程师的自我介绍和工作讨论
+    long_conversation = [
+        ("我是一名软件工程师，在北京工作", "很高兴认识你！软件工程师是个很有前景的职业。"),
+        ("我主要使用Python和Java开发", "这两种语言都很流行，Python特别适合数据处理。"),
+        ("我们公司是做金融科技的", "金融科技是个快速发展的领域，技术要求很高。"),
+        ("我负责后端API开发", "后端开发是系统的核心，责任重大。"),
+        ("最近在学习微服务架构", "微服务架构能提高系统的可扩展性和维护性。"),
+        ("我们使用Docker和Kubernetes", "容器化技术确实能简化部署和管理。"),
+        ("你还记得我的工作地点吗？", "让我回忆一下...")
+    ]
+
+    print("添加对话历史...")
+    for i, (user_msg, ai_msg) in enumerate(long_conversation, 1):
+        summary_buffer_memory.add_conversation(user_msg, ai_msg)
+        stats = summary_buffer_memory.get_memory_stats()
+        print(f"第{i}轮对话后 - Token使用率: {stats['utilization']:.2f}")
+
+    # 摘要在后台生成，展示最终内容前等待进行中的摘要完成
+    summary_buffer_memory.wait_for_summary()
+
+    # 获取并显示记忆内容
+    print("\n摘要缓冲记忆内容:")
+    print(summary_buffer_memory.get_context())
+
+    # 显示详细统计信息
     stats = summary_buffer_memory.get_memory_stats()
-    print(f"第{i}轮对话后 - Token使用率: {stats['utilization']:.2f}")
-
-# 获取并显示记忆内容
-print("\n摘要缓冲记忆内容:")
-print(summary_buffer_memory.get_context())
-
-# 显示详细统计信息
-stats = summary_buffer_memory.get_memory_stats()
-print(f"\n记忆统计信息:")
-print(f"总Token数: {stats['total_tokens']}/{stats['max_token_limit']}")
-print(f"使用率: {stats['utilization']:.2%}")
-print(f"有摘要: {stats['has_summary']}")
-print(f"当前消息数: {stats['current_messages']}")
+    print(f"\n记忆统计信息:")
+    print(f"总Token数: {stats['total_tokens']}/{stats['max_token_limit']}")
+    print(f"其中摘要Token数: {stats['summary_tokens']}，对话缓冲Token数: {stats['buffer_tokens']}")
+    print(f"Token计数器: {stats['token_counter']}")
+    print(f"使用率: {stats['utilization']:.2%}")
+    print(f"有摘要: {stats['has_summary']}")
+    print(f"当前消息数: {stats['current_messages']}")
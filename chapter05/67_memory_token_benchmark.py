@@ -0,0 +1,150 @@
+"""
+摘要缓冲记忆 token 计数基准测试
+============================
+
+对比 SummaryBufferMemory（见 54_advanced_memory.py）两种检查token上限的方式：
+1. 旧实现：每次 add_conversation 都遍历全部消息重新计数，耗时随历史长度线性增长
+2. 新实现：消息加入时计数一次并缓存，维护累计值，耗时与历史长度无关
+
+为了只测量计数开销，基准把 max_token_limit 设得足够大，不会触发摘要，也不发起任何LLM调用。
+另外列出不同计数器对示例中文对话的计数结果，说明 len(text) // 4 对中文的低估程度。
+
+运行方式：
+python 67_memory_token_benchmark.py
+python 67_memory_token_benchmark.py --checkpoints 1000 5000 10000 --window 20
+
+作者：AI助手
+日期：2024年
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from memory_tokens import (CharClassTokenCounter, TiktokenCounter, TransformersTokenCounter,
+                           TIKTOKEN_AVAILABLE, TRANSFORMERS_AVAILABLE)
+
+# 基准不调用LLM，没有配置API密钥时使用占位值即可加载模块
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-placeholder")
+
+SAMPLE_CONVERSATION = [
+    ("我是一名软件工程师，在北京工作", "很高兴认识你！软件工程师是个很有前景的职业。"),
+    ("我主要使用Python和Java开发", "这两种语言都很流行，Python特别适合数据处理。"),
+    ("我们公司是做金融科技的", "金融科技是个快速发展的领域，技术要求很高。"),
+    ("我负责后端API开发", "后端开发是系统的核心，责任重大。"),
+    ("最近在学习微服务架构", "微服务架构能提高系统的可扩展性和维护性。"),
+    ("我们使用Docker和Kubernetes", "容器化技术确实能简化部署和管理。"),
+]
+
+
+def load_memory_module():
+    """按文件路径加载高级记忆模块（演示部分不会执行）"""
+    spec = importlib.util.spec_from_file_location(
+        "advanced_memory", os.path.join(SCRIPT_DIR, "54_advanced_memory.py"))
+    module = importlib.util.module_from_spec(spec)
+    with redirect_stdout(StringIO()):
+        spec.loader.exec_module(module)
+    return module
+
+
+def make_legacy_class(module):
+    """旧实现：每次检查上限都遍历全部消息和摘要重新计数"""
+
+    class LegacySummaryBufferMemory(module.SummaryBufferMemory):
+        def _get_total_tokens(self) -> int:
+            total = 0
+            for msg in self.chat_history.messages:
+                total += self._estimate_tokens(msg.content)
+            if self.summary:
+                total += self._estimate_tokens(self.summary)
+            return total
+
+    return LegacySummaryBufferMemory
+
+
+def measure(module, memory_class, token_counter, checkpoints, window: int):
+    """在历史达到每个检查点轮数时，测量接下来 window 轮的平均添加耗时（微秒）"""
+    memory = memory_class(None, max_token_limit=10 ** 12, token_counter=token_counter)
+    results = {}
+    added = 0
+    for checkpoint in checkpoints:
+        # 预填充历史时跳过上限检查，否则旧实现的预填充本身就是O(n²)
+        while added < checkpoint:
+            user_msg, ai_msg = SAMPLE_CONVERSATION[added % len(SAMPLE_CONVERSATION)]
+            memory._add_message(module.HumanMessage(content=user_msg))
+            memory._add_message(module.AIMessage(content=ai_msg))
+            added += 1
+
+        start = time.perf_counter()
+        for i in range(window):
+            user_msg, ai_msg = SAMPLE_CONVERSATION[i % len(SAMPLE_CONVERSATION)]
+            memory.add_conversation(user_msg, ai_msg)
+        results[checkpoint] = (time.perf_counter() - start) / window * 1e6
+        added += window
+    return results
+
+
+def available_counters(model_name: str):
+    """列出当前环境可用的计数器"""
+    counters = [("len // 4（旧估算）", lambda text: len(text) // 4),
+                ("字符类别估算", CharClassTokenCounter())]
+    if TIKTOKEN_AVAILABLE:
+        try:
+            counters.append(("tiktoken cl100k_base", TiktokenCounter()))
+        except Exception as e:
+            print(f"⚠️ tiktoken 词表加载失败，跳过: {type(e).__name__}")
+    if TRANSFORMERS_AVAILABLE:
+        try:
+            counters.append((f"{model_name} 分词器", TransformersTokenCounter(model_name)))
+        except Exception as e:
+            print(f"⚠️ {model_name} 分词器加载失败，跳过: {type(e).__name__}")
+    return counters
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="摘要缓冲记忆 token 计数基准测试")
+    parser.add_argument("--checkpoints", type=int, nargs="+", default=[100, 1000, 2000, 5000],
+                        help="测量时的历史轮数")
+    parser.add_argument("--window", type=int, default=50, help="每个检查点测量的轮数")
+    parser.add_argument("--model", default="Qwen/Qwen2.5-7B-Instruct", help="transformers 分词器的模型名称")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("摘要缓冲记忆 token 计数基准测试")
+    print("=" * 60)
+
+    module = load_memory_module()
+    legacy_class = make_legacy_class(module)
+    counter = CharClassTokenCounter()  # 两种实现使用同一个计数器，只比较计数方式
+
+    print("\n📊 计数器对比（示例对话）:")
+    text = "".join(user_msg + ai_msg for user_msg, ai_msg in SAMPLE_CONVERSATION)
+    for name, token_counter in available_counters(args.model):
+        print(f"  {name:<32} {token_counter(text):>6} tokens")
+
+    checkpoints = sorted(args.checkpoints)
+    print(f"\n⏱️ 每轮 add_conversation 平均耗时（微秒，每个检查点测量 {args.window} 轮）:")
+    legacy = measure(module, legacy_class, counter, checkpoints, args.window)
+    incremental = measure(module, module.SummaryBufferMemory, counter, checkpoints, args.window)
+
+    header = f"{'历史轮数':>10} {'旧实现':>12} {'新实现':>12} {'加速比':>8}"
+    print(header)
+    print("-" * len(header))
+    for checkpoint in checkpoints:
+        print(f"{checkpoint:>10} {legacy[checkpoint]:>12.1f} {incremental[checkpoint]:>12.1f} "
+              f"{legacy[checkpoint] / incremental[checkpoint]:>8.1f}x")
+
+    growth = incremental[checkpoints[-1]] / incremental[checkpoints[0]]
+    print(f"\n✅ 新实现在 {checkpoints[0]} 轮和 {checkpoints[-1]} 轮时的耗时比为 {growth:.2f}")
+
+
+if __name__ == "__main__":
+    main()
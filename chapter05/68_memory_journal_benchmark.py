@@ -0,0 +1,163 @@
+"""
+持久化记忆写入吞吐基准测试
+======================
+
+对比 PersistentMemory（见 53_agent_memory.py）两种保存方式在不同历史长度下的写入吞吐：
+1. 旧实现：每轮对话后把全部消息重新序列化，覆盖整个JSON文件（LegacyWriter 保留原来的写入路径）
+2. 追加日志：直接测量 53_agent_memory.py 中的 PersistentMemory，每轮对话只在 JSONL 日志末尾追加两行，
+   日志过大时压缩成快照（见 memory_journal.py）
+
+53_agent_memory.py 按文件路径导入，演示只在直接运行时执行；导入时只创建LLM客户端，
+没有API密钥时使用占位密钥。每个历史长度先一次性写好初始数据，再计时若干轮 add_conversation，
+不发起任何LLM调用。加载耗时为创建 PersistentMemory（读取快照并重放日志）的时间。
+
+运行方式：
+python 68_memory_journal_benchmark.py
+python 68_memory_journal_benchmark.py --sizes 10000 100000 --legacy-rounds 5 --journal-rounds 5000
+
+作者：AI助手
+日期：2024年
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+from contextlib import redirect_stdout
+from io import StringIO
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.messages import HumanMessage, AIMessage
+
+from memory_journal import MessageJournal
+
+USER_MESSAGE = "我喜欢科幻电影，最近在看《星际穿越》"
+AI_MESSAGE = "科幻电影很有想象力，能带我们探索未来世界。"
+
+
+class LegacyWriter:
+    """旧实现：每轮对话后重写整个JSON文件"""
+
+    def __init__(self, file_path: str, memory: ChatMessageHistory):
+        self.file_path = file_path
+        self.memory = memory
+
+    def save_memory(self):
+        data = []
+        for msg in self.memory.messages:
+            if isinstance(msg, HumanMessage):
+                data.append({"type": "human", "content": msg.content})
+            elif isinstance(msg, AIMessage):
+                data.append({"type": "ai", "content": msg.content})
+        with open(self.file_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    def add_conversation(self, user_msg: str, ai_msg: str):
+        self.memory.add_user_message(user_msg)
+        self.memory.add_ai_message(ai_msg)
+        self.save_memory()
+
+
+def load_memory_module():
+    """按文件路径导入 53_agent_memory.py（只定义记忆类，不执行演示）"""
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark-placeholder")
+    spec = importlib.util.spec_from_file_location("agent_memory", os.path.join(SCRIPT_DIR, "53_agent_memory.py"))
+    module = importlib.util.module_from_spec(spec)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # 演示用到的 RunnableWithMessageHistory 的弃用提示
+        spec.loader.exec_module(module)
+    return module
+
+
+def open_persistent_memory(memory_module, file_path: str, fsync_interval=None):
+    """创建 PersistentMemory，屏蔽加载时的提示输出"""
+    with redirect_stdout(StringIO()):
+        return memory_module.PersistentMemory(file_path, fsync_interval=fsync_interval)
+
+
+def build_history(size: int) -> ChatMessageHistory:
+    """构造包含 size 条消息的对话历史"""
+    messages = []
+    for i in range(size // 2):
+        messages.append(HumanMessage(content=f"{USER_MESSAGE} #{i}"))
+        messages.append(AIMessage(content=AI_MESSAGE))
+    return ChatMessageHistory(messages=messages)
+
+
+def timed_rounds(writer, rounds: int) -> float:
+    """计时 rounds 轮对话，返回每秒写入的消息数"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        writer.add_conversation(USER_MESSAGE, AI_MESSAGE)
+    return rounds * 2 / (time.perf_counter() - start)
+
+
+def benchmark_size(memory_module, size: int, legacy_rounds: int, journal_rounds: int,
+                   fsync_interval: float, workdir: str):
+    """测量一个历史长度下三种写入方式的吞吐，以及 PersistentMemory 的加载耗时"""
+    history = build_history(size)
+    base_messages = list(history.messages)
+
+    # 旧实现：先写好初始文件，再计时重写
+    legacy = LegacyWriter(os.path.join(workdir, f"legacy_{size}.json"), ChatMessageHistory(messages=list(base_messages)))
+    legacy.save_memory()
+    legacy_rate = timed_rounds(legacy, legacy_rounds)
+
+    results = {"size": size, "legacy": legacy_rate}
+    for name, interval in (("journal", None), ("group_commit", fsync_interval)):
+        path = os.path.join(workdir, f"{name}_{size}.json")
+        # 先写好初始快照，PersistentMemory 创建时加载它
+        MessageJournal(path).compact([{"type": "human" if isinstance(msg, HumanMessage) else "ai",
+                                       "content": msg.content} for msg in base_messages])
+        memory = open_persistent_memory(memory_module, path, fsync_interval=interval)
+        results[name] = timed_rounds(memory, journal_rounds)
+        memory.close()
+
+        if name == "journal":
+            start = time.perf_counter()
+            reloaded = open_persistent_memory(memory_module, path)
+            results["load_seconds"] = time.perf_counter() - start
+            assert len(reloaded.get_messages()) == size // 2 * 2 + journal_rounds * 2
+            reloaded.close()
+    return results
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="持久化记忆写入吞吐基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="初始历史的消息数")
+    parser.add_argument("--legacy-rounds", type=int, default=3, help="旧实现计时的对话轮数")
+    parser.add_argument("--journal-rounds", type=int, default=2000, help="追加日志计时的对话轮数")
+    parser.add_argument("--fsync-interval", type=float, default=0.05, help="组提交的 fsync 间隔（秒）")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("持久化记忆写入吞吐基准测试")
+    print("=" * 60)
+    print(f"\n旧实现每个规模计时 {args.legacy_rounds} 轮，追加日志计时 {args.journal_rounds} 轮"
+          f"（组提交 fsync 间隔 {args.fsync_interval}s）\n")
+
+    header = f"{'历史消息数':>10} {'旧实现 msg/s':>14} {'追加日志 msg/s':>16} {'组提交 msg/s':>14} {'加速比':>10} {'加载耗时':>10}"
+    memory_module = load_memory_module()
+    print(header)
+    print("-" * len(header))
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            result = benchmark_size(memory_module, size, args.legacy_rounds, args.journal_rounds,
+                                    args.fsync_interval, workdir)
+            print(f"{size:>10} {result['legacy']:>14.1f} {result['journal']:>16.0f} {result['group_commit']:>14.0f} "
+                  f"{result['journal'] / result['legacy']:>9.0f}x {result['load_seconds']:>9.2f}s")
+
+    print("\n✅ 追加日志的写入吞吐与历史长度无关，旧实现随历史长度线性下降")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+后台摘要调度
+==========
+
+摘要记忆原来在 add_conversation 里直接调用 llm.invoke 生成摘要，触发摘要的那一轮
+要多等一次LLM调用。BackgroundSummarizer 把摘要任务提交到线程池，add_conversation
+立即返回；摘要生成期间记忆继续提供旧摘要加上尚未压缩的原始消息。
+
+同一个记忆对象同时只有一个摘要任务：任务运行期间再次触发时只记一个标记，
+当前任务结束后再运行一次（任务自己会重新检查是否仍然需要摘要），
+多次触发合并为一次补充摘要。
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+_default_executor: Optional[ThreadPoolExecutor] = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor() -> ThreadPoolExecutor:
+    """所有记忆对象共享的摘要线程池（首次使用时创建）"""
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="memory-summary")
+        return _default_executor
+
+
+class BackgroundSummarizer:
+    """在线程池中运行摘要任务，并发触发合并为一次"""
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        """
+        Args:
+            executor: 运行摘要任务的线程池，默认使用共享线程池
+        """
+        self.executor = executor or get_default_executor()
+        self._lock = threading.Lock()
+        self._future: Optional[Future] = None
+        self._rerun = False
+        self.stats = {"requested": 0, "started": 0, "coalesced": 0, "failed": 0}
+
+    @property
+    def running(self) -> bool:
+        """是否有摘要任务正在排队或运行"""
+        with self._lock:
+            return self._future is not None
+
+    def request(self, job: Callable[[], None]) -> bool:
+        """
+        请求运行一次摘要任务
+
+        Args:
+            job: 摘要任务，在后台线程中执行，应自行检查是否仍需要摘要
+
+        Returns:
+            bool: True 表示提交了新任务，False 表示与正在运行的任务合并
+        """
+        with self._lock:
+            self.stats["requested"] += 1
+            if self._future is not None:
+                self._rerun = True
+                self.stats["coalesced"] += 1
+                return False
+            self.stats["started"] += 1
+            self._future = self.executor.submit(self._run, job)
+            return True
+
+    def _run(self, job: Callable[[], None]):
+        """运行任务；期间有新的触发时再运行一次"""
+        while True:
+            try:
+                job()
+            except Exception as e:
+                with self._lock:
+                    self.stats["failed"] += 1
+                print(f"后台摘要任务出错: {e}")
+
+            with self._lock:
+                if not self._rerun:
+                    self._future = None
+                    return
+                self._rerun = False
+
+    def wait(self, timeout: Optional[float] = None):
+        """
+        等待正在进行的摘要任务（包括合并的补充摘要）完成
+
+        Args:
+            timeout: 最长等待秒数，None 表示一直等待
+        """
+        with self._lock:
+            future = self._future
+        if future is not None:
+            future.result(timeout)
@@ -0,0 +1,256 @@
+"""
+追加日志式的消息持久化
+===================
+
+PersistentMemory 原来每添加一轮对话就把全部历史重新序列化并覆盖整个JSON文件，
+每次写入的开销与历史总长度成正比。
+
+MessageJournal 改为 "快照 + 追加日志"：
+- 快照文件（file_path）：某一时刻的全部消息，JSON格式
+- 日志文件（file_path + ".journal"）：快照之后新增的消息，每行一条JSON（JSONL），只追加不改写
+
+每条日志记录带有递增的序号 seq，快照记录它包含的消息数 count。
+加载时先读快照，再重放日志中 seq >= count 的记录，因此：
+- 写入中途崩溃留下的半行记录会被忽略，并从文件中截掉
+- 压缩在 "写入新快照" 和 "清空日志" 之间崩溃时，日志里已经进入快照的记录会被跳过，不会重复
+
+日志大小超过快照的 compact_ratio 倍时，由调用方传入全部消息压缩成新快照（临时文件写完后原子替换），
+摊还下来每条消息的写入开销仍是常数。
+
+fsync_interval 控制落盘策略：
+- None：每次追加只 flush 到操作系统，不调用 fsync（进程崩溃不丢数据，断电可能丢最近的写入）
+- 0：每次追加都 fsync
+- 大于0：组提交，距离上次 fsync 超过该秒数的追加直接 fsync；否则启动一个定时器，
+  在间隔到期时由后台线程 fsync 尚未落盘的写入（之后没有新的追加也会落盘），
+  因此断电最多丢失最近约 fsync_interval 秒内的写入；close() 取消定时器并 fsync
+
+日志文件的读写和定时 fsync 由同一把锁保护。
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+SNAPSHOT_VERSION = 1
+
+
+class MessageJournal:
+    """快照 + JSONL 追加日志的消息存储"""
+
+    def __init__(self, file_path: str, fsync_interval: Optional[float] = None,
+                 compact_ratio: float = 2.0, min_compact_bytes: int = 64 * 1024):
+        """
+        Args:
+            file_path: 快照文件路径，日志文件为 file_path + ".journal"
+            fsync_interval: 组提交的 fsync 间隔（秒），None 不调用 fsync，0 每次追加都 fsync
+            compact_ratio: 日志大小超过快照大小的这个倍数时需要压缩
+            min_compact_bytes: 快照很小时按这个大小计算压缩阈值，避免频繁压缩
+        """
+        self.file_path = file_path
+        self.journal_path = file_path + ".journal"
+        self.fsync_interval = fsync_interval
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+
+        self.count = 0              # 已持久化的消息总数（下一条记录的seq）
+        self.snapshot_bytes = 0
+        self.journal_bytes = 0
+        self._file = None
+        self._last_sync = time.monotonic()
+        self._dirty = False                               # 是否有尚未 fsync 的写入
+        self._timer: Optional[threading.Timer] = None     # 组提交的定时 fsync
+        self._lock = threading.RLock()
+        self.stats = {"appended": 0, "fsyncs": 0, "compactions": 0, "replayed": 0, "torn_bytes": 0}
+
+    def load(self) -> List[Dict[str, Any]]:
+        """
+        读取快照并重放日志
+
+        Returns:
+            List[dict]: 全部消息记录，每条为 {"type": "human"/"ai", "content": ...}
+
+        Raises:
+            FileNotFoundError: 快照和日志都不存在
+        """
+        if not os.path.exists(self.file_path) and not os.path.exists(self.journal_path):
+            raise FileNotFoundError(self.file_path)
+
+        records: List[Dict[str, Any]] = []
+        snapshot_count = 0
+        if os.path.exists(self.file_path):
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # 兼容旧格式：消息列表，或 {"messages": [...]}（role 字段为 user/ai）
+            if isinstance(data, list):
+                messages = data
+            else:
+                messages = data.get("messages", [])
+            records = [_normalize(item) for item in messages]
+            snapshot_count = data.get("count", len(records)) if isinstance(data, dict) else len(records)
+            self.snapshot_bytes = os.path.getsize(self.file_path)
+
+        self.count = snapshot_count
+        self.journal_bytes = 0
+        if os.path.exists(self.journal_path):
+            records.extend(self._replay_journal(snapshot_count))
+        return records
+
+    def _replay_journal(self, snapshot_count: int) -> List[Dict[str, Any]]:
+        """重放日志中快照之后的记录，截掉末尾不完整的记录"""
+        records = []
+        good_offset = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 写入中途崩溃留下的半行
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    break
+                good_offset += len(line)
+                if item["seq"] < snapshot_count:
+                    continue  # 压缩时已经写入快照
+                records.append(_normalize(item))
+                self.count = item["seq"] + 1
+
+        size = os.path.getsize(self.journal_path)
+        if size > good_offset:
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(good_offset)
+            self.stats["torn_bytes"] += size - good_offset
+        self.journal_bytes = good_offset
+        self.stats["replayed"] += len(records)
+        return records
+
+    def append(self, records: List[Dict[str, Any]]):
+        """
+        追加消息记录到日志
+
+        Args:
+            records: 消息记录列表，每条为 {"type": ..., "content": ...}
+        """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.journal_path, 'a', encoding='utf-8', newline='\n')
+
+            lines = []
+            for record in records:
+                lines.append(json.dumps({"seq": self.count, "type": record["type"], "content": record["content"]},
+                                        ensure_ascii=False) + "\n")
+                self.count += 1
+            data = "".join(lines)
+            self._file.write(data)
+            self._file.flush()
+            self._dirty = True
+            self.journal_bytes += len(data.encode('utf-8'))
+            self.stats["appended"] += len(records)
+
+            if self.fsync_interval is None:
+                return
+            elapsed = time.monotonic() - self._last_sync
+            if elapsed >= self.fsync_interval:
+                self.sync()
+            elif self._timer is None:
+                # 间隔到期时由定时器落盘，不依赖下一次追加
+                self._timer = threading.Timer(self.fsync_interval - elapsed, self._timed_sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def sync(self):
+        """把已写入的日志 fsync 到磁盘"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self.stats["fsyncs"] += 1
+            self._dirty = False
+            self._last_sync = time.monotonic()
+
+    def _timed_sync(self):
+        """定时器线程：组提交间隔到期，fsync 尚未落盘的写入"""
+        with self._lock:
+            # 定时器已被 close() 取消或替换时不处理
+            if self._timer is not threading.current_thread():
+                return
+            self._timer = None
+            if self._dirty:
+                self.sync()
+
+    def should_compact(self) -> bool:
+        """日志是否已经大到需要压缩成快照"""
+        return self.journal_bytes > self.compact_ratio * max(self.snapshot_bytes, self.min_compact_bytes)
+
+    def compact(self, records: List[Dict[str, Any]]):
+        """
+        把全部消息写成新快照并清空日志
+
+        Args:
+            records: 当前全部消息记录（应与 load() 加 append() 的结果一致）
+        """
+        with self._lock:
+            self.close()
+
+            tmp_path = self.file_path + ".tmp"
+            snapshot = {"version": SNAPSHOT_VERSION, "count": len(records),
+                        "messages": [{"type": r["type"], "content": r["content"]} for r in records]}
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+            _fsync_directory(self.file_path)
+
+            # 快照已经包含全部记录，日志中的记录即使没清空也会在加载时被跳过
+            with open(self.journal_path, 'w', encoding='utf-8'):
+                pass
+            self.count = len(records)
+            self.snapshot_bytes = os.path.getsize(self.file_path)
+            self.journal_bytes = 0
+            self.stats["compactions"] += 1
+
+    def close(self):
+        """取消定时 fsync，fsync 并关闭日志文件"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._file is not None:
+                if self.fsync_interval is not None:
+                    self.sync()
+                self._file.close()
+                self._file = None
+
+    def clear(self):
+        """删除快照和日志"""
+        with self._lock:
+            self.close()
+            for path in (self.file_path, self.journal_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.count = 0
+            self.snapshot_bytes = 0
+            self.journal_bytes = 0
+
+
+def _normalize(item: Dict[str, Any]) -> Dict[str, Any]:
+    """统一为 {"type": "human"/"ai", "content": ...}，兼容 role 为 user/ai 的旧数据"""
+    message_type = item.get("type") or item.get("role")
+    if message_type == "user":
+        message_type = "human"
+    return {"type": message_type, "content": item["content"]}
+
+
+def _fsync_directory(path: str):
+    """fsync 文件所在目录，让 os.replace 的改名持久化（Windows 不支持时跳过）"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,122 @@
+"""
+记忆模块的 token 计数
+===================
+
+记忆类用 token 数判断何时需要压缩对话历史。原来的 len(text) // 4 是英文的经验值，
+中文里一个汉字通常就接近一个 token，按这个算法会把中文对话低估三到四倍。
+
+这里提供可替换的 token 计数器，计数器都是 "文本 -> token数" 的可调用对象：
+- TransformersTokenCounter：使用模型自己的分词器（如 Qwen/Qwen2.5-7B-Instruct），结果与模型一致
+- TiktokenCounter：使用 tiktoken 的BPE词表，词表与 Qwen 不同但远比字符估算准确
+- CharClassTokenCounter：不依赖分词器，按字符类别估算（中日韩字符一个 token，其余约4个字符一个 token）
+
+create_token_counter() 按上面的顺序选择第一个可用的计数器，分词器未安装或词表下载失败时
+回退到字符估算，不影响记忆类正常工作。
+"""
+
+from functools import lru_cache
+from typing import Optional
+
+try:
+    from transformers import AutoTokenizer
+    TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    TRANSFORMERS_AVAILABLE = False
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+
+def _is_cjk(char: str) -> bool:
+    """判断字符是否为中日韩文字或全角标点"""
+    code = ord(char)
+    return (
+        0x4E00 <= code <= 0x9FFF      # 中日韩统一表意文字
+        or 0x3400 <= code <= 0x4DBF   # 扩展A
+        or 0x3000 <= code <= 0x30FF   # 中日韩标点、假名
+        or 0xAC00 <= code <= 0xD7AF   # 韩文音节
+        or 0xFF00 <= code <= 0xFFEF   # 全角字符
+    )
+
+
+class CharClassTokenCounter:
+    """按字符类别估算 token 数，不需要任何分词器"""
+
+    name = "char_class"
+
+    def __call__(self, text: str) -> int:
+        if not text:
+            return 0
+        cjk_count = sum(1 for char in text if _is_cjk(char))
+        other_count = len(text) - cjk_count
+        return cjk_count + (other_count + 3) // 4
+
+
+class TransformersTokenCounter:
+    """使用 Hugging Face 分词器计数，与模型的真实词表一致"""
+
+    def __init__(self, model_name: str):
+        """
+        Args:
+            model_name: Hugging Face 模型名或本地分词器目录
+        """
+        if not TRANSFORMERS_AVAILABLE:
+            raise ImportError("需要安装 transformers: pip install transformers")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.name = f"transformers:{model_name}"
+
+    def __call__(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+
+class TiktokenCounter:
+    """使用 tiktoken 的BPE词表计数"""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        """
+        Args:
+            encoding_name: tiktoken 编码名称
+        """
+        if not TIKTOKEN_AVAILABLE:
+            raise ImportError("需要安装 tiktoken: pip install tiktoken")
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.name = f"tiktoken:{encoding_name}"
+
+    def __call__(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=None)
+def create_token_counter(model_name: Optional[str] = None, encoding_name: str = "cl100k_base"):
+    """
+    选择可用的 token 计数器
+
+    加载分词器的开销较大，同样的参数只创建一次，多个记忆实例共享同一个计数器。
+
+    Args:
+        model_name: 模型名称，transformers 可用时加载该模型的分词器
+        encoding_name: transformers 不可用时使用的 tiktoken 编码
+
+    Returns:
+        计数器对象，调用 counter(text) 得到 token 数，counter.name 为计数器名称
+    """
+    if model_name and TRANSFORMERS_AVAILABLE:
+        try:
+            return TransformersTokenCounter(model_name)
+        except Exception:
+            pass  # 离线或模型名不是HF仓库时继续尝试下一种
+
+    if TIKTOKEN_AVAILABLE:
+        try:
+            return TiktokenCounter(encoding_name)
+        except Exception:
+            pass  # 词表需要联网下载，失败时回退到字符估算
+
+    return CharClassTokenCounter()
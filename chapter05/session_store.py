@@ -0,0 +1,402 @@
+"""
+有界会话存储
+==========
+
+get_session_history 和 create_session_memory 背后原来都是普通字典，
+每个会话ID一个 ChatMessageHistory 或记忆对象，会话只增不减，内存无限增长。
+
+BoundedSessionStore 是带上限的会话注册表：
+- 常驻会话数（max_sessions）和/或常驻字节数（max_bytes）超限时，按LRU顺序把最久未使用的
+  空闲会话序列化后写入磁盘层（spill_dir），从内存中移除
+- 再次访问被换出的会话时，从磁盘透明加载回内存
+- 统计命中率、磁盘加载次数、淘汰次数和常驻字节数
+
+接入 RunnableWithMessageHistory 时使用 chat_history(session_id)：它返回一个代理对象，
+每次读写消息都经过存储查找，会话在两次调用之间被换出也不会丢失写入。
+其他会话对象（例如记忆类）使用 proxy(session_id, factory)：代理的每次属性访问和方法调用
+都在 store.session() 中进行，调用期间会话被固定，结束时重新估算字节数。
+get / get_or_create 返回的是对象本身，被换出后与存储脱离，只适合立即使用；
+需要在一段代码中多次访问时使用 with store.session(session_id) as obj: 固定会话。
+
+常驻字节数是估算值（消息内容的UTF-8字节数加上每条消息的固定开销），在访问会话时更新。
+磁盘层只在当前进程内有效，不作为持久化存储使用。未指定 spill_dir 时，第一次换出才创建临时目录，
+用完后调用 close()（或使用 with 语句）删除换出文件和存储自己创建的目录。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+# 每条消息在内存中的固定开销估算（对象头、类型、元数据等）
+MESSAGE_OVERHEAD_BYTES = 200
+
+
+def dump_chat_history(history: BaseChatMessageHistory) -> Dict[str, Any]:
+    """把聊天历史序列化为可写入JSON的字典"""
+    return {"messages": messages_to_dict(history.messages)}
+
+
+def load_chat_history(data: Dict[str, Any]) -> ChatMessageHistory:
+    """从 dump_chat_history 的结果恢复聊天历史"""
+    return ChatMessageHistory(messages=messages_from_dict(data["messages"]))
+
+
+def estimate_size(obj: Any) -> int:
+    """
+    估算会话对象的常驻字节数
+
+    支持聊天历史（有 messages 属性）和本章的记忆类（有 chat_history 属性，可能有摘要）
+    """
+    history = getattr(obj, "chat_history", obj)
+    messages: List[BaseMessage] = list(getattr(history, "messages", []))
+    messages += getattr(obj, "_pending_messages", [])
+    size = sum(len(str(msg.content).encode("utf-8")) + MESSAGE_OVERHEAD_BYTES for msg in messages)
+    summary = getattr(obj, "summary", "")
+    if isinstance(summary, str):
+        size += len(summary.encode("utf-8"))
+    return size
+
+
+class _Entry:
+    """常驻会话：对象、估算字节数和固定计数"""
+
+    __slots__ = ("value", "size", "pins")
+
+    def __init__(self, value: Any, size: int):
+        self.value = value
+        self.size = size
+        self.pins = 0
+
+
+class BoundedSessionStore:
+    """按会话数和字节预算把空闲会话换出到磁盘的LRU会话存储"""
+
+    def __init__(self, max_sessions: Optional[int] = None, max_bytes: Optional[int] = None,
+                 spill_dir: Optional[str] = None,
+                 dump: Callable[[Any], Dict[str, Any]] = dump_chat_history,
+                 load: Callable[[Dict[str, Any]], Any] = load_chat_history,
+                 sizeof: Callable[[Any], int] = estimate_size,
+                 can_evict: Optional[Callable[[Any], bool]] = None):
+        """
+        Args:
+            max_sessions: 最多常驻的会话数，None 表示不限制
+            max_bytes: 常驻会话的估算字节数上限，None 表示不限制
+            spill_dir: 磁盘层目录，默认在第一次换出时创建临时目录
+            dump: 把会话对象序列化为字典（需要能写成JSON）
+            load: 从字典恢复会话对象
+            sizeof: 估算会话对象的常驻字节数
+            can_evict: 判断会话当前能否换出（例如后台摘要进行中的记忆不能换出）
+        """
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._owns_spill_dir = False  # 目录是否由存储自己创建（close() 时删除）
+        self.dump = dump
+        self.load = load
+        self.sizeof = sizeof
+        self.can_evict = can_evict
+
+        self._resident: "OrderedDict[str, _Entry]" = OrderedDict()  # 按最近使用排序，末尾最新
+        self._spilled: Dict[str, str] = {}                          # 会话ID -> 磁盘文件路径
+        self._resident_bytes = 0
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "disk_loads": 0, "creates": 0, "evictions": 0, "spill_bytes": 0}
+
+    # ------------------------------------------------------------------
+    # 字典接口：让原来按字典使用的代码不需要修改
+    # ------------------------------------------------------------------
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._resident or session_id in self._spilled
+
+    def __getitem__(self, session_id: str) -> Any:
+        value = self.get(session_id)
+        if value is None:
+            raise KeyError(session_id)
+        return value
+
+    def __setitem__(self, session_id: str, value: Any):
+        self.put(session_id, value)
+
+    def __delitem__(self, session_id: str):
+        if not self.delete(session_id):
+            raise KeyError(session_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._resident) + len(self._spilled)
+
+    def keys(self) -> List[str]:
+        """全部会话ID（常驻和已换出）"""
+        with self._lock:
+            return list(self._resident) + list(self._spilled)
+
+    # ------------------------------------------------------------------
+    # 会话访问
+    # ------------------------------------------------------------------
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """取出会话对象，已换出时从磁盘加载；不存在时返回 None"""
+        with self._lock:
+            entry = self._acquire(session_id)
+            if entry is None:
+                return None
+            self._enforce_limits()
+            return entry.value
+
+    def get_or_create(self, session_id: str, factory: Callable[[], Any]) -> Any:
+        """取出会话对象，不存在时用 factory() 创建"""
+        with self._lock:
+            entry = self._acquire(session_id)
+            if entry is None:
+                entry = self._insert(session_id, factory())
+                self.stats["creates"] += 1
+            self._enforce_limits()
+            return entry.value
+
+    def put(self, session_id: str, value: Any):
+        """放入（或替换）会话对象"""
+        with self._lock:
+            self.delete(session_id)
+            self._insert(session_id, value)
+            self._enforce_limits()
+
+    def delete(self, session_id: str) -> bool:
+        """删除会话（包括磁盘层中的副本），返回会话是否存在"""
+        with self._lock:
+            entry = self._resident.pop(session_id, None)
+            if entry is not None:
+                self._resident_bytes -= entry.size
+            path = self._spilled.pop(session_id, None)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+            return entry is not None or path is not None
+
+    @contextmanager
+    def session(self, session_id: str, factory: Optional[Callable[[], Any]] = None) -> Iterator[Any]:
+        """
+        固定会话：with 块内会话不会被换出，退出时更新它的估算字节数
+
+        Args:
+            session_id: 会话ID
+            factory: 会话不存在时的创建函数；为 None 且会话不存在时抛出 KeyError
+        """
+        with self._lock:
+            entry = self._acquire(session_id)
+            if entry is None:
+                if factory is None:
+                    raise KeyError(session_id)
+                entry = self._insert(session_id, factory())
+                self.stats["creates"] += 1
+            entry.pins += 1
+        try:
+            yield entry.value
+        finally:
+            with self._lock:
+                entry.pins -= 1
+                if self._resident.get(session_id) is entry:
+                    self._resize(entry)
+                self._enforce_limits()
+
+    def chat_history(self, session_id: str,
+                     factory: Callable[[], BaseChatMessageHistory] = ChatMessageHistory) -> "StoredChatMessageHistory":
+        """返回可以交给 RunnableWithMessageHistory 的会话历史代理"""
+        return StoredChatMessageHistory(self, session_id, factory)
+
+    def proxy(self, session_id: str, factory: Optional[Callable[[], Any]] = None) -> "StoredSessionProxy":
+        """返回会话对象的代理，可以长期持有，会话被换出后再次访问时自动加载"""
+        return StoredSessionProxy(self, session_id, factory)
+
+    # ------------------------------------------------------------------
+    # 内部实现（调用方持有 self._lock）
+    # ------------------------------------------------------------------
+
+    def _acquire(self, session_id: str) -> Optional[_Entry]:
+        """查找常驻会话或从磁盘加载，移到LRU末尾并更新估算字节数"""
+        entry = self._resident.get(session_id)
+        if entry is not None:
+            self.stats["hits"] += 1
+            self._resident.move_to_end(session_id)
+            # 上次取出之后对象可能已被修改，访问时重新估算
+            self._resize(entry)
+            return entry
+
+        path = self._spilled.pop(session_id, None)
+        if path is None:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        os.remove(path)
+        self.stats["disk_loads"] += 1
+        return self._insert(session_id, self.load(data))
+
+    def _insert(self, session_id: str, value: Any) -> _Entry:
+        entry = _Entry(value, self.sizeof(value))
+        self._resident[session_id] = entry
+        self._resident_bytes += entry.size
+        return entry
+
+    def _resize(self, entry: _Entry):
+        size = self.sizeof(entry.value)
+        self._resident_bytes += size - entry.size
+        entry.size = size
+
+    def _over_limit(self) -> bool:
+        return ((self.max_sessions is not None and len(self._resident) > self.max_sessions)
+                or (self.max_bytes is not None and self._resident_bytes > self.max_bytes))
+
+    def _enforce_limits(self):
+        """从最久未使用的会话开始换出，跳过被固定或暂时不能换出的会话；最新的会话总是保留"""
+        if not self._over_limit():
+            return
+        for session_id in list(self._resident)[:-1]:
+            entry = self._resident[session_id]
+            if entry.pins or (self.can_evict is not None and not self.can_evict(entry.value)):
+                continue
+            self._spill(session_id, entry)
+            if not self._over_limit():
+                return
+
+    def _ensure_spill_dir(self) -> str:
+        """第一次换出时才创建磁盘层目录，只创建存储而不换出时不在磁盘上留下任何东西"""
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="session_spill_")
+            self._owns_spill_dir = True
+        else:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        return self.spill_dir
+
+    def _spill(self, session_id: str, entry: _Entry):
+        """把会话写入磁盘层（先写临时文件再原子替换）并从内存中移除"""
+        self._ensure_spill_dir()
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        path = os.path.join(self.spill_dir, f"{digest}.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.dump(entry.value), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        del self._resident[session_id]
+        self._resident_bytes -= entry.size
+        self._spilled[session_id] = path
+        self.stats["evictions"] += 1
+        self.stats["spill_bytes"] += os.path.getsize(path)
+
+    # ------------------------------------------------------------------
+    # 清理
+    # ------------------------------------------------------------------
+
+    def close(self):
+        """清空存储：删除全部会话和换出文件，存储自己创建的临时目录一并删除"""
+        with self._lock:
+            for path in self._spilled.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            self._spilled.clear()
+            self._resident.clear()
+            self._resident_bytes = 0
+            if self._owns_spill_dir:
+                shutil.rmtree(self.spill_dir, ignore_errors=True)
+                self.spill_dir = None
+                self._owns_spill_dir = False
+
+    def __enter__(self) -> "BoundedSessionStore":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 统计
+    # ------------------------------------------------------------------
+
+    def get_stats(self) -> Dict[str, Any]:
+        """命中率、淘汰次数、常驻会话数和常驻字节数等统计"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["disk_loads"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                "resident_sessions": len(self._resident),
+                "spilled_sessions": len(self._spilled),
+                "resident_bytes": self._resident_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes
+            }
+
+
+class StoredChatMessageHistory(BaseChatMessageHistory):
+    """
+    存储中某个会话历史的代理
+
+    自身不保存消息，每次读写都通过 BoundedSessionStore 找到（必要时从磁盘加载）真正的历史，
+    因此 RunnableWithMessageHistory 在一次调用的开始和结束之间，会话被换出也不会丢失写入。
+    """
+
+    def __init__(self, store: BoundedSessionStore, session_id: str,
+                 factory: Callable[[], BaseChatMessageHistory] = ChatMessageHistory):
+        self.store = store
+        self.session_id = session_id
+        self.factory = factory
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        with self.store.session(self.session_id, self.factory) as history:
+            return list(history.messages)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        with self.store.session(self.session_id, self.factory) as history:
+            history.add_messages(messages)
+
+    def clear(self) -> None:
+        with self.store.session(self.session_id, self.factory) as history:
+            history.clear()
+
+
+class StoredSessionProxy:
+    """
+    存储中某个会话对象的代理
+
+    读取属性时在 store.session() 中取值；方法调用整个在 store.session() 中执行，
+    调用期间会话不会被换出，结束时更新估算字节数。代理本身不持有会话对象，
+    会话在两次访问之间被换出也不会丢失修改。
+    """
+
+    def __init__(self, store: BoundedSessionStore, session_id: str,
+                 factory: Optional[Callable[[], Any]] = None):
+        object.__setattr__(self, "_store", store)
+        object.__setattr__(self, "_session_id", session_id)
+        object.__setattr__(self, "_factory", factory)
+
+    @property
+    def session_id(self) -> str:
+        return self._session_id
+
+    def __getattr__(self, name: str) -> Any:
+        with self._store.session(self._session_id, self._factory) as value:
+            attr = getattr(value, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._store.session(self._session_id, self._factory) as value:
+                return getattr(value, name)(*args, **kwargs)
+        return call
+
+    def __setattr__(self, name: str, value: Any):
+        with self._store.session(self._session_id, self._factory) as obj:
+            setattr(obj, name, value)
+
+    def __repr__(self) -> str:
+        return f"StoredSessionProxy({self._session_id!r})"
@@ -0,0 +1,175 @@
+"""
+分层摘要压缩
+==========
+
+摘要记忆每次生成新摘要都直接拼接到旧摘要后面，长对话里摘要本身会无限增长，
+最终占满它本来要保护的token预算。
+
+HierarchicalSummary 把摘要分成若干层，每层有自己的token预算：
+- 新摘要追加到第0层；生成摘要的提示词应使用 summary_budget 限制长度，
+  约为第0层预算的 1/SUMMARIES_PER_LEVEL，第0层可以容纳几段摘要后才需要合并
+- 某一层超出预算时，如果有两段以上，把这一层的所有段落交给LLM合并成一段更精炼的摘要，放入上一层；
+  只有一段时合并没有意义，直接把它移到上一层，不调用LLM
+- 最高层超出预算且有两段以上时，在本层内合并成一段
+
+渲染时从最高层（最早、最概括）到第0层（最近、最详细）依次拼接。
+摘要总长度大致不超过各层预算之和（最高层只剩一段时无法再合并，可能略有超出）。
+"""
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from memory_tokens import CharClassTokenCounter
+
+# 第0层预算按新摘要的目标长度计算，大约可以容纳的摘要段数
+SUMMARIES_PER_LEVEL = 4
+
+COMPACTION_PROMPT = """
+请将以下几段对话摘要合并成一段更精炼的摘要，保留关键信息，长度控制在约{budget}个token以内：
+
+{summaries}
+
+合并后的摘要：
+"""
+
+
+class HierarchicalSummary:
+    """按层预算压缩的对话摘要（本身不加锁，由记忆对象负责同步）"""
+
+    def __init__(self, level_budgets: Sequence[int] = (200, 200),
+                 token_counter: Optional[Callable[[str], int]] = None):
+        """
+        Args:
+            level_budgets: 每层的token预算，长度即层数，第0层存放最新的摘要
+            token_counter: 计算文本token数的可调用对象，默认按字符类别估算
+        """
+        if not level_budgets:
+            raise ValueError("至少需要一层摘要")
+        self.level_budgets = list(level_budgets)
+        self.token_counter = token_counter or CharClassTokenCounter()
+        # 每层的 (摘要段落, token数) 列表，以及每层的token累计值
+        self.levels: List[List[Tuple[str, int]]] = [[] for _ in self.level_budgets]
+        self._level_tokens = [0] * len(self.level_budgets)
+        self.compactions = 0
+        self.promotions = 0
+
+    @property
+    def summary_budget(self) -> int:
+        """新摘要的目标token数，生成摘要的提示词用它限制长度"""
+        return max(self.level_budgets[0] // SUMMARIES_PER_LEVEL, 1)
+
+    @property
+    def total_tokens(self) -> int:
+        """所有层摘要段落的token数之和"""
+        return sum(self._level_tokens)
+
+    def add(self, summary: str):
+        """把新生成的摘要追加到第0层"""
+        if summary:
+            self._append(0, summary)
+
+    def render(self) -> str:
+        """从最高层到第0层拼接全部摘要段落"""
+        return "\n".join(text for level in reversed(self.levels) for text, _ in level)
+
+    def compact(self, summarize: Callable[[str], str], lock) -> int:
+        """
+        压缩所有超出预算的层
+
+        LLM调用在锁外进行；同一个记忆对象同时只有一个摘要任务，
+        压缩期间不会有其他线程修改各层内容，锁只用于与读取上下文的线程同步。
+        只有一段的超预算层直接移到上一层，不调用LLM，也不计入合并次数。
+
+        Args:
+            summarize: 调用LLM的函数，参数为提示词，返回合并后的摘要
+            lock: 记忆对象的锁
+
+        Returns:
+            int: 本次执行的合并次数
+        """
+        count = 0
+        while True:
+            with lock:
+                task = self._next_compaction()
+            if task is None:
+                return count
+
+            level, chunk_count, prompt = task
+            merged = summarize(prompt)
+            with lock:
+                self._apply_compaction(level, chunk_count, merged)
+            count += 1
+
+    def stats(self) -> Dict[str, object]:
+        """各层段落数、token数和预算，以及累计合并次数和直接上移次数"""
+        return {
+            "levels": [{"chunks": len(level), "tokens": tokens, "budget": budget}
+                       for level, tokens, budget in zip(self.levels, self._level_tokens, self.level_budgets)],
+            "compactions": self.compactions,
+            "promotions": self.promotions
+        }
+
+    def to_dict(self) -> Dict[str, object]:
+        """序列化为可写入JSON的字典（token数在恢复时重新计算）"""
+        return {"level_budgets": list(self.level_budgets),
+                "levels": [[text for text, _ in level] for level in self.levels],
+                "compactions": self.compactions, "promotions": self.promotions}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object],
+                  token_counter: Optional[Callable[[str], int]] = None) -> "HierarchicalSummary":
+        """从 to_dict() 的结果恢复"""
+        summary = cls(data["level_budgets"], token_counter)
+        for level, texts in enumerate(data["levels"]):
+            for text in texts:
+                summary._append(level, text)
+        summary.compactions = data.get("compactions", 0)
+        summary.promotions = data.get("promotions", 0)
+        return summary
+
+    def _append(self, level: int, text: str):
+        tokens = self.token_counter(text)
+        self.levels[level].append((text, tokens))
+        self._level_tokens[level] += tokens
+
+    def _next_compaction(self) -> Optional[Tuple[int, int, str]]:
+        """
+        找到最低的需要LLM合并的超预算层，返回 (层号, 参与合并的段落数, 合并提示词)
+
+        途中只有一段的超预算层直接移到上一层；最高层只剩一段时已经无法再合并。
+        """
+        top = len(self.levels) - 1
+        for level in range(len(self.levels)):
+            if self._level_tokens[level] <= self.level_budgets[level]:
+                continue
+            if len(self.levels[level]) < 2:
+                if level < top:
+                    self._promote(level)
+                continue
+            target = level if level == top else level + 1
+            summaries = "\n".join(text for text, _ in self.levels[level])
+            return level, len(self.levels[level]), COMPACTION_PROMPT.format(
+                budget=self.level_budgets[target], summaries=summaries)
+        return None
+
+    def _promote(self, level: int):
+        """把只有一段的层原样移到上一层，不调用LLM"""
+        (text, tokens), = self.levels[level]
+        self.levels[level] = []
+        self._level_tokens[level] = 0
+        self.levels[level + 1].append((text, tokens))
+        self._level_tokens[level + 1] += tokens
+        self.promotions += 1
+
+    def _apply_compaction(self, level: int, chunk_count: int, merged: str):
+        """用合并结果替换该层最早的 chunk_count 段，放入上一层（最高层放回本层开头）"""
+        removed = self.levels[level][:chunk_count]
+        self.levels[level] = self.levels[level][chunk_count:]
+        self._level_tokens[level] -= sum(tokens for _, tokens in removed)
+
+        if level == len(self.levels) - 1:
+            tokens = self.token_counter(merged)
+            self.levels[level].insert(0, (merged, tokens))
+            self._level_tokens[level] += tokens
+        else:
+            self._append(level + 1, merged)
+        self.compactions += 1
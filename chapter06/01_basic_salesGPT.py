@@ -13,6 +13,7 @@
 - 易于理解和修改
 - 基础的销售对话流程
 - 简单的阶段转换逻辑
+- 支持流式输出回复，遇到 <END_OF_TURN> 立即停止生成
 
 作者：AI助手
 日期：2024年
@@ -21,7 +22,7 @@
 
 import os
 import warnings
-from typing import Dict, Any
+from typing import Any, AsyncIterator, Dict, Iterator
 
 import dotenv
 from langchain.chains.llm import LLMChain
@@ -29,6 +30,9 @@ from langchain_core.language_models import BaseLLM
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 
+from history_buffer import TokenBudgetHistory, rollback_on_abort
+from turn_streaming import astream_until_end_of_turn, stream_until_end_of_turn
+
 # 过滤弃用警告
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -62,11 +66,13 @@ SALES_STAGES = {
 class BasicSalesGPT:
     """基础版销售对话代理"""
     
-    def __init__(self, llm):
+    def __init__(self, llm, history_token_budget: int = 1000):
         """初始化销售代理"""
         self.llm = llm
         self.current_stage = "1"
         self.conversation_history = []
+        # 提示词中的对话历史：最近5轮，且不超过token预算
+        self.history_buffer = TokenBudgetHistory(history_token_budget, max_turns=5, separator="\n")
         
         # 基础销售人员信息
         self.salesperson_info = {
@@ -127,32 +133,47 @@ class BasicSalesGPT:
         else:
             return "5"  # 保持在最后阶段
     
-    def step(self, user_input: str = None) -> str:
-        """执行一步对话"""
+    def _append_history(self, entry: str):
+        """记录一轮对话：完整记录保存在 conversation_history，提示词使用按token预算维护的历史窗口"""
+        self.conversation_history.append(entry)
+        self.history_buffer.append(entry)
+    
+    def _prepare_turn(self, user_input: str = None) -> Dict[str, Any]:
+        """记录用户输入、更新阶段，并构建本轮提示变量"""
         # 如果有用户输入，添加到历史记录并更新阶段
         if user_input:
-            self.conversation_history.append(f"客户：{user_input}")
+            self._append_history(f"客户：{user_input}")
             self.current_stage = self._get_next_stage(user_input)
         
         # 构建对话历史字符串
-        history_str = "\n".join(self.conversation_history[-5:])  # 只保留最近5轮对话
+        history_str = self.history_buffer.render()
         if not history_str:
             history_str = "对话开始"
         
+        return {
+            "name": self.salesperson_info["name"],
+            "role": self.salesperson_info["role"],
+            "company": self.salesperson_info["company"],
+            "stage": SALES_STAGES[self.current_stage],
+            "history": history_str
+        }
+    
+    def _finish_turn(self, response: str):
+        """把回复添加到历史记录"""
+        self._append_history(f"{self.salesperson_info['name']}：{response}")
+    
+    def step(self, user_input: str = None) -> str:
+        """执行一步对话"""
+        inputs = self._prepare_turn(user_input)
+        
         # 生成回复
         try:
-            result = self.conversation_chain.invoke({
-                "name": self.salesperson_info["name"],
-                "role": self.salesperson_info["role"],
-                "company": self.salesperson_info["company"],
-                "stage": SALES_STAGES[self.current_stage],
-                "history": history_str
-            })
+            result = self.conversation_chain.invoke(inputs)
             
             response = result.get("text", "").strip()
             
             # 添加到历史记录
-            self.conversation_history.append(f"{self.salesperson_info['name']}：{response}")
+            self._finish_turn(response)
             
             return response
             
@@ -160,12 +181,50 @@ class BasicSalesGPT:
             print(f"生成回复时出错: {e}")
             return "抱歉，我遇到了一些问题，请稍后再试。"
     
+    def stream_step(self, user_input: str = None) -> Iterator[str]:
+        """流式执行一步对话，逐段产出回复，遇到 <END_OF_TURN> 立即停止生成"""
+        with rollback_on_abort(self.conversation_history, self.history_buffer):
+            inputs = self._prepare_turn(user_input)
+            prompt = self.conversation_chain.prompt.format_prompt(**inputs)
+            
+            chunks = []
+            try:
+                for text in stream_until_end_of_turn(self.llm, prompt):
+                    chunks.append(text)
+                    yield text
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield "抱歉，我遇到了一些问题，请稍后再试。"
+                return
+            
+            self._finish_turn("".join(chunks).strip())
+    
+    async def astream_step(self, user_input: str = None) -> AsyncIterator[str]:
+        """异步流式执行一步对话"""
+        with rollback_on_abort(self.conversation_history, self.history_buffer):
+            inputs = self._prepare_turn(user_input)
+            prompt = self.conversation_chain.prompt.format_prompt(**inputs)
+            
+            chunks = []
+            try:
+                async for text in astream_until_end_of_turn(self.llm, prompt):
+                    chunks.append(text)
+                    yield text
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield "抱歉，我遇到了一些问题，请稍后再试。"
+                return
+            
+            self._finish_turn("".join(chunks).strip())
+    
     def get_current_stage_info(self) -> Dict[str, str]:
         """获取当前阶段信息"""
         return {
             "stage_number": self.current_stage,
             "stage_description": SALES_STAGES[self.current_stage],
-            "conversation_turns": len(self.conversation_history)
+            "conversation_turns": len(self.conversation_history),
+            "history_tokens": self.history_buffer.token_count,
+            "history_token_budget": self.history_buffer.max_tokens
         }
 
 def demonstrate_basic_sales():
@@ -15,15 +15,18 @@
 - 改进的提示词工程
 - 对话上下文管理
 - 销售策略指导
+- 流式输出回复，遇到 <END_OF_TURN> 立即停止生成
 
 作者：AI助手
 日期：2024年
 版本：2.0 - 增强对话版
 """
 
+import asyncio
 import os
 import warnings
-from typing import Dict, Any, List
+from contextlib import nullcontext
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
 
 import dotenv
 from langchain.chains.llm import LLMChain
@@ -31,6 +34,12 @@ from langchain_core.language_models import BaseLLM
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 
+from stage_classifier import LocalFirstStageAnalysis, LocalStageClassifier
+from stage_policy import StageStickinessPolicy
+from token_accounting import TokenAccountant, record_cache_hit, usage_config, use_turn
+from history_buffer import TokenBudgetHistory, rollback_on_abort
+from turn_streaming import astream_until_end_of_turn, stream_until_end_of_turn
+
 # 过滤弃用警告
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -66,8 +75,17 @@ SALES_STAGES = {
 class StageAnalyzer:
     """智能阶段分析器"""
     
-    def __init__(self, llm):
+    def __init__(self, llm, classifier: Optional[LocalStageClassifier] = None, label_log_path: str = None,
+                 policy: Optional[StageStickinessPolicy] = None):
         self.llm = llm
+        # 本地分类器优先、LLM兜底；可选的样本日志记录LLM给出的阶段，用于训练本地分类器
+        self.local_first = LocalFirstStageAnalysis(SALES_STAGES, classifier, label_log_path)
+        # 可选的阶段粘滞策略，客户消息没有转换信号时沿用上一轮阶段
+        self.policy = policy
+        self.sticky_turns = 0
+        # 是否已经分析过客户轮次，还没有时不沿用初始阶段
+        self.stage_analyzed = False
+        self.stats = self.local_first.stats
         self.analyzer_chain = self._create_analyzer_chain()
     
     def _create_analyzer_chain(self):
@@ -98,31 +116,56 @@ class StageAnalyzer:
         
         return LLMChain(prompt=prompt, llm=self.llm, verbose=False)
     
-    def analyze_stage(self, conversation_history: str) -> str:
-        """分析当前应该进入的阶段"""
+    def _reuse_previous_stage(self, user_input: Optional[str], current_stage: Optional[str]) -> bool:
+        """按阶段粘滞策略判断本轮能否跳过阶段分析"""
+        if self.policy is None or current_stage is None:
+            return False
+        if self.policy.should_reuse(user_input, self.sticky_turns, self.stage_analyzed):
+            self.sticky_turns += 1
+            self.stats["sticky"] += 1
+            record_cache_hit("stage_sticky")
+            return True
+        self.sticky_turns = 0
+        if user_input:
+            self.stage_analyzed = True
+        return False
+
+    def analyze_stage(self, conversation_history: str, user_input: str = None, current_stage: str = None) -> str:
+        """分析当前应该进入的阶段，传入本轮客户消息和当前阶段时先应用阶段粘滞策略"""
+        if self._reuse_previous_stage(user_input, current_stage):
+            return current_stage
+
+        # 本地分类器足够自信时，不再调用LLM
+        local_stage = self.local_first.classify(conversation_history)
+        if local_stage:
+            return local_stage
+
         try:
-            result = self.analyzer_chain.invoke({"conversation_history": conversation_history})
+            result = self.analyzer_chain.invoke({"conversation_history": conversation_history}, config=usage_config("stage_analysis"))
             stage = result.get("text", "1").strip()
-            
-            # 验证返回的阶段是否有效
-            if stage in SALES_STAGES:
-                return stage
-            else:
-                return "1"  # 默认返回介绍阶段
-                
         except Exception as e:
             print(f"阶段分析错误: {e}")
-            return "1"
+            stage = None
+
+        # 每次LLM调用都计数；无效输出或调用失败时返回介绍阶段
+        self.local_first.record_llm_stage(conversation_history, stage)
+        return stage if stage in SALES_STAGES else "1"
 
 class EnhancedSalesGPT:
     """增强版销售对话代理"""
     
-    def __init__(self, llm, verbose=True):
-        """初始化销售代理"""
+    def __init__(self, llm, verbose=True,
+                 stage_classifier: Optional[LocalStageClassifier] = None, stage_label_log: str = None,
+                 history_token_budget: int = 2000, stage_policy: Optional[StageStickinessPolicy] = None,
+                 token_accountant: Optional[TokenAccountant] = None):
+        """初始化销售代理，传入 token_accountant 时记录每轮的token用量"""
         self.llm = llm
         self.verbose = verbose
-        self.stage_analyzer = StageAnalyzer(llm)
+        self.token_accountant = token_accountant
+        self.stage_analyzer = StageAnalyzer(llm, stage_classifier, stage_label_log, stage_policy)
         self.conversation_history = []
+        # 提示词中的对话历史：最近10轮，且不超过token预算
+        self.history_buffer = TokenBudgetHistory(history_token_budget, max_turns=10)
         self.current_stage = "1"
         
         # 详细的销售人员信息
@@ -177,40 +220,109 @@ class EnhancedSalesGPT:
         
         return LLMChain(prompt=prompt, llm=self.llm, verbose=self.verbose)
     
-    def step(self, user_input: str = None) -> str:
-        """执行一步对话"""
+    def _append_history(self, entry: str):
+        """记录一轮对话：完整记录保存在 conversation_history，提示词使用按token预算维护的历史窗口"""
+        self.conversation_history.append(entry)
+        self.history_buffer.append(entry)
+    
+    def _prepare_turn(self, user_input: str = None) -> Dict[str, Any]:
+        """记录用户输入、分析阶段，并构建本轮提示变量"""
         # 如果有用户输入，添加到历史记录
         if user_input:
-            self.conversation_history.append(f"客户：{user_input}<END_OF_TURN>")
+            self._append_history(f"客户：{user_input}<END_OF_TURN>")
         
         # 构建对话历史字符串
-        history_str = "".join(self.conversation_history[-10:])  # 保留最近10轮对话
+        history_str = self.history_buffer.render()
         if not history_str:
             history_str = "对话开始"
         
         # 分析当前阶段
         if len(self.conversation_history) > 0:  # 有对话历史时才进行阶段分析
-            self.current_stage = self.stage_analyzer.analyze_stage(history_str)
+            self.current_stage = self.stage_analyzer.analyze_stage(history_str, user_input, self.current_stage)
         
-        # 生成回复
-        try:
-            result = self.conversation_chain.invoke({
-                **self.salesperson_info,
-                "current_stage": self.current_stage,
-                "stage_description": SALES_STAGES[self.current_stage],
-                "conversation_history": history_str
-            })
+        return {
+            **self.salesperson_info,
+            "current_stage": self.current_stage,
+            "stage_description": SALES_STAGES[self.current_stage],
+            "conversation_history": history_str
+        }
+    
+    def _usage_turn(self):
+        """本轮LLM调用的token核算范围，未配置核算器时不做记录"""
+        if self.token_accountant is None:
+            return nullcontext()
+        return self.token_accountant.turn()
+    
+    def _usage_stream_turn(self):
+        """流式生成器的核算范围：不在 yield 期间保持当前轮次，由 use_turn() 在准备阶段激活"""
+        if self.token_accountant is None:
+            return nullcontext()
+        return self.token_accountant.stream_turn()
+    
+    def _finish_turn(self, response: str):
+        """把回复添加到历史记录"""
+        self._append_history(f"{self.salesperson_info['name']}：{response}<END_OF_TURN>")
+    
+    def step(self, user_input: str = None) -> str:
+        """执行一步对话"""
+        with self._usage_turn():
+            inputs = self._prepare_turn(user_input)
             
-            response = result.get("text", "").strip()
+            # 生成回复
+            try:
+                result = self.conversation_chain.invoke(inputs, config=usage_config("conversation"))
+                
+                response = result.get("text", "").strip()
+                
+                # 添加到历史记录
+                self._finish_turn(response)
+                
+                return response
+                
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                return "抱歉，我遇到了一些技术问题，请稍后再试。"
+    
+    def stream_step(self, user_input: str = None) -> Iterator[str]:
+        """流式执行一步对话，逐段产出回复，遇到 <END_OF_TURN> 立即停止生成"""
+        with self._usage_stream_turn() as usage, rollback_on_abort(self.conversation_history, self.history_buffer):
+            with use_turn(usage):
+                inputs = self._prepare_turn(user_input)
+                prompt = self.conversation_chain.prompt.format_prompt(**inputs)
+                config = usage_config("conversation")
             
-            # 添加到历史记录
-            self.conversation_history.append(f"{self.salesperson_info['name']}：{response}<END_OF_TURN>")
+            chunks = []
+            try:
+                for text in stream_until_end_of_turn(self.llm, prompt, config=config):
+                    chunks.append(text)
+                    yield text
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield "抱歉，我遇到了一些技术问题，请稍后再试。"
+                return
             
-            return response
+            self._finish_turn("".join(chunks).strip())
+    
+    async def astream_step(self, user_input: str = None) -> AsyncIterator[str]:
+        """异步流式执行一步对话"""
+        with self._usage_stream_turn() as usage, rollback_on_abort(self.conversation_history, self.history_buffer):
+            with use_turn(usage):
+                # 阶段分析是同步调用，放到线程中避免阻塞事件循环
+                inputs = await asyncio.to_thread(self._prepare_turn, user_input)
+                prompt = self.conversation_chain.prompt.format_prompt(**inputs)
+                config = usage_config("conversation")
             
-        except Exception as e:
-            print(f"生成回复时出错: {e}")
-            return "抱歉，我遇到了一些技术问题，请稍后再试。"
+            chunks = []
+            try:
+                async for text in astream_until_end_of_turn(self.llm, prompt, config=config):
+                    chunks.append(text)
+                    yield text
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield "抱歉，我遇到了一些技术问题，请稍后再试。"
+                return
+            
+            self._finish_turn("".join(chunks).strip())
     
     def get_conversation_summary(self) -> Dict[str, Any]:
         """获取对话摘要"""
@@ -219,13 +331,20 @@ class EnhancedSalesGPT:
             "stage_description": SALES_STAGES[self.current_stage],
             "conversation_turns": len(self.conversation_history),
             "salesperson": self.salesperson_info["name"],
-            "company": self.salesperson_info["company"]
+            "company": self.salesperson_info["company"],
+            "stage_analysis": dict(self.stage_analyzer.stats),
+            "token_usage": self.token_accountant.session_summary() if self.token_accountant else None,
+            "history_tokens": self.history_buffer.token_count,
+            "history_token_budget": self.history_buffer.max_tokens
         }
     
     def reset_conversation(self):
         """重置对话状态"""
         self.conversation_history = []
+        self.history_buffer.clear()
         self.current_stage = "1"
+        self.stage_analyzer.sticky_turns = 0
+        self.stage_analyzer.stage_analyzed = False
 
 def demonstrate_enhanced_sales():
     """演示增强版销售对话"""
@@ -11,25 +11,37 @@
 
 功能特点：
 - 无需复杂依赖的知识库
-- 快速关键词匹配
+- 快速关键词匹配（Aho-Corasick 多关键词匹配，结果按命中数和特异度排序）
 - 丰富的产品信息
 - 智能信息推荐
 - 上下文相关回复
+- 流式输出回复，遇到 <END_OF_TURN> 立即停止生成
+- 价格、续航等结构化事实直接从产品摘要索引回答
 
 作者：AI助手
 日期：2024年
 版本：3.0 - 知识库版
 """
 
+import asyncio
 import os
 import warnings
-from typing import Dict, Any
+from contextlib import nullcontext
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
 
 import dotenv
 from langchain.chains.llm import LLMChain
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 
+from keyword_matcher import KeywordMatcher
+from product_facts import ProductFactIndex
+from stage_classifier import LocalFirstStageAnalysis, LocalStageClassifier
+from stage_policy import StageStickinessPolicy
+from token_accounting import TokenAccountant, record_cache_hit, usage_config, use_turn
+from history_buffer import TokenBudgetHistory, rollback_on_abort
+from turn_streaming import astream_until_end_of_turn, stream_until_end_of_turn
+
 # 过滤弃用警告
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -65,9 +77,10 @@ SALES_STAGES = {
 class SimpleKnowledgeBase:
     """简单的基于关键词的知识库"""
     
-    def __init__(self):
-        """初始化知识库"""
-        self.knowledge_data = {
+    def __init__(self, knowledge_data: Dict[str, Any] = None, keyword_mapping: Dict[str, List[str]] = None,
+                 product_keywords: Dict[str, List[str]] = None):
+        """初始化知识库，未传入的数据使用内置示例"""
+        self.knowledge_data = knowledge_data or {
             "产品信息": {
                 "智能办公系统": {
                     "价格": "智能办公系统价格：基础版8万元/年，专业版15万元/年，企业版25万元/年",
@@ -107,7 +120,7 @@ class SimpleKnowledgeBase:
         }
         
         # 关键词映射
-        self.keyword_mapping = {
+        self.keyword_mapping = keyword_mapping or {
             "价格": ["价格", "费用", "成本", "多少钱", "报价"],
             "功能": ["功能", "特性", "能力", "作用", "用途"],
             "优势": ["优势", "好处", "价值", "效果", "收益"],
@@ -125,53 +138,75 @@ class SimpleKnowledgeBase:
         }
         
         # 产品关键词
-        self.product_keywords = {
+        self.product_keywords = product_keywords or {
             "智能办公系统": ["办公", "OA", "协作", "文档", "工作流"],
             "AI数据分析平台": ["数据", "分析", "报表", "BI", "预测"],
             "智能客服机器人": ["客服", "机器人", "聊天", "问答", "服务"]
         }
+        
+        self._build_matchers()
+    
+    def _build_matchers(self):
+        """把关键词表编译成多关键词匹配器，关键词表变化后需要重新调用"""
+        self.product_matcher = KeywordMatcher.from_mapping(self.product_keywords)
+        self.info_type_matcher = KeywordMatcher.from_mapping(self.keyword_mapping)
     
-    def search_knowledge(self, query: str) -> str:
-        """基于关键词搜索知识"""
-        query_lower = query.lower()
-        results = []
+    def search_knowledge(self, query: str, top_k: int = 3) -> str:
+        """基于关键词搜索知识，结果按命中关键词数和特异度排序"""
+        products = self.knowledge_data["产品信息"]
         
-        # 查找相关产品
-        target_products = []
-        for product, keywords in self.product_keywords.items():
-            if any(keyword in query_lower for keyword in keywords):
-                target_products.append(product)
+        # 扫描一遍查询，找出全部命中的产品和信息类型
+        product_hits = self.product_matcher.match(query)
+        info_type_hits = self.info_type_matcher.match(query)
         
+        # 查找相关产品
+        target_products = {
+            product: self.product_matcher.score(keywords)
+            for product, keywords in product_hits.items() if product in products
+        }
         if not target_products:
-            target_products = list(self.knowledge_data["产品信息"].keys())
+            target_products = {product: (0, 0.0) for product in products}
         
-        # 查找相关信息类型
-        for info_type, keywords in self.keyword_mapping.items():
-            if any(keyword in query_lower for keyword in keywords):
-                # 在产品信息中查找
-                for product in target_products:
-                    if product in self.knowledge_data["产品信息"]:
-                        if info_type in self.knowledge_data["产品信息"][product]:
-                            results.append(f"{product} - {self.knowledge_data['产品信息'][product][info_type]}")
-                
-                # 在服务信息中查找
-                if info_type in self.knowledge_data["服务信息"]:
-                    results.append(self.knowledge_data["服务信息"][info_type])
-                
-                # 在公司优势中查找
-                if info_type in self.knowledge_data["公司优势"]:
-                    results.append(self.knowledge_data["公司优势"][info_type])
+        # 收集候选结果及其得分 (命中数, 特异度)
+        candidates = []
+        for info_type, keywords in info_type_hits.items():
+            info_count, info_specificity = self.info_type_matcher.score(keywords)
+            
+            # 在产品信息中查找
+            for product, (product_count, product_specificity) in target_products.items():
+                if info_type in products[product]:
+                    score = (info_count + product_count, info_specificity + product_specificity)
+                    candidates.append((score, f"{product} - {products[product][info_type]}"))
+            
+            # 在服务信息中查找
+            if info_type in self.knowledge_data["服务信息"]:
+                candidates.append(((info_count, info_specificity), self.knowledge_data["服务信息"][info_type]))
+            
+            # 在公司优势中查找
+            if info_type in self.knowledge_data["公司优势"]:
+                candidates.append(((info_count, info_specificity), self.knowledge_data["公司优势"][info_type]))
         
-        if results:
-            return " | ".join(results[:3])  # 返回前3个最相关的结果
+        if candidates:
+            # 得分相同时保持命中的先后顺序
+            candidates.sort(key=lambda item: item[0], reverse=True)
+            return " | ".join(text for _, text in candidates[:top_k])
         else:
             return "我需要更多信息来为您提供准确的回答，请您具体说明想了解什么？"
 
 class StageAnalyzer:
     """智能阶段分析器"""
     
-    def __init__(self, llm):
+    def __init__(self, llm, classifier: Optional[LocalStageClassifier] = None, label_log_path: str = None,
+                 policy: Optional[StageStickinessPolicy] = None):
         self.llm = llm
+        # 本地分类器优先、LLM兜底；可选的样本日志记录LLM给出的阶段，用于训练本地分类器
+        self.local_first = LocalFirstStageAnalysis(SALES_STAGES, classifier, label_log_path)
+        # 可选的阶段粘滞策略，客户消息没有转换信号时沿用上一轮阶段
+        self.policy = policy
+        self.sticky_turns = 0
+        # 是否已经分析过客户轮次，还没有时不沿用初始阶段
+        self.stage_analyzed = False
+        self.stats = self.local_first.stats
         self.analyzer_chain = self._create_analyzer_chain()
     
     def _create_analyzer_chain(self):
@@ -201,26 +236,61 @@ class StageAnalyzer:
         
         return LLMChain(prompt=prompt, llm=self.llm, verbose=False)
     
-    def analyze_stage(self, conversation_history: str) -> str:
-        """分析当前应该进入的阶段"""
+    def _reuse_previous_stage(self, user_input: Optional[str], current_stage: Optional[str]) -> bool:
+        """按阶段粘滞策略判断本轮能否跳过阶段分析"""
+        if self.policy is None or current_stage is None:
+            return False
+        if self.policy.should_reuse(user_input, self.sticky_turns, self.stage_analyzed):
+            self.sticky_turns += 1
+            self.stats["sticky"] += 1
+            record_cache_hit("stage_sticky")
+            return True
+        self.sticky_turns = 0
+        if user_input:
+            self.stage_analyzed = True
+        return False
+
+    def analyze_stage(self, conversation_history: str, user_input: str = None, current_stage: str = None) -> str:
+        """分析当前应该进入的阶段，传入本轮客户消息和当前阶段时先应用阶段粘滞策略"""
+        if self._reuse_previous_stage(user_input, current_stage):
+            return current_stage
+
+        # 本地分类器足够自信时，不再调用LLM
+        local_stage = self.local_first.classify(conversation_history)
+        if local_stage:
+            return local_stage
+
         try:
-            result = self.analyzer_chain.invoke({"conversation_history": conversation_history})
+            result = self.analyzer_chain.invoke({"conversation_history": conversation_history}, config=usage_config("stage_analysis"))
             stage = result.get("text", "1").strip()
-            return stage if stage in SALES_STAGES else "1"
         except Exception as e:
             print(f"阶段分析错误: {e}")
-            return "1"
+            stage = None
+
+        # 每次LLM调用都计数；无效输出或调用失败时返回介绍阶段
+        self.local_first.record_llm_stage(conversation_history, stage)
+        return stage if stage in SALES_STAGES else "1"
 
 class KnowledgeBasedSalesGPT:
     """知识库版销售对话代理"""
     
-    def __init__(self, llm, verbose=True):
-        """初始化销售代理"""
+    def __init__(self, llm, verbose=True,
+                 stage_classifier: Optional[LocalStageClassifier] = None, stage_label_log: str = None,
+                 fact_index: Optional[ProductFactIndex] = None, history_token_budget: int = 2000,
+                 stage_policy: Optional[StageStickinessPolicy] = None,
+                 token_accountant: Optional[TokenAccountant] = None):
+        """初始化销售代理，fact_index 默认从 data/product_summary.json 加载，
+        传入 token_accountant 时记录每轮的token用量"""
         self.llm = llm
         self.verbose = verbose
+        self.token_accountant = token_accountant
         self.knowledge_base = SimpleKnowledgeBase()
-        self.stage_analyzer = StageAnalyzer(llm)
+        self.fact_index = fact_index if fact_index is not None else ProductFactIndex.load()
+        self.fact_hits = 0
+        self.stage_analyzer = StageAnalyzer(llm, stage_classifier, stage_label_log, stage_policy)
         self.conversation_history = []
+        # 提示词中的对话历史：最近10轮，且不超过token预算
+        self.history_buffer = TokenBudgetHistory(history_token_budget, max_turns=10)
         self.current_stage = "1"
         
         # 销售人员信息
@@ -279,43 +349,120 @@ class KnowledgeBasedSalesGPT:
         """获取相关的产品知识"""
         if not user_input:
             return ""
+        
+        # 价格、续航等结构化事实直接回答
+        facts = self.fact_index.answer(user_input)
+        if facts:
+            self.fact_hits += 1
+            record_cache_hit("product_facts")
+            return f"产品参数：{facts}"
+        
         return self.knowledge_base.search_knowledge(user_input)
     
-    def step(self, user_input: str = None) -> str:
-        """执行一步对话"""
+    def _append_history(self, entry: str):
+        """记录一轮对话：完整记录保存在 conversation_history，提示词使用按token预算维护的历史窗口"""
+        self.conversation_history.append(entry)
+        self.history_buffer.append(entry)
+    
+    def _prepare_turn(self, user_input: str = None) -> Dict[str, Any]:
+        """检索知识、记录用户输入、分析阶段，并构建本轮提示变量"""
         # 获取知识上下文
         knowledge_context = ""
         if user_input:
             knowledge_context = self.get_knowledge_context(user_input)
-            self.conversation_history.append(f"客户：{user_input}<END_OF_TURN>")
+            self._append_history(f"客户：{user_input}<END_OF_TURN>")
         
         # 构建对话历史
-        history_str = "".join(self.conversation_history[-10:])
+        history_str = self.history_buffer.render()
         if not history_str:
             history_str = "对话开始"
         
         # 分析当前阶段
         if len(self.conversation_history) > 0:
-            self.current_stage = self.stage_analyzer.analyze_stage(history_str)
+            self.current_stage = self.stage_analyzer.analyze_stage(history_str, user_input, self.current_stage)
         
-        # 生成回复
-        try:
-            result = self.conversation_chain.invoke({
-                **self.salesperson_info,
-                "current_stage": self.current_stage,
-                "stage_description": SALES_STAGES[self.current_stage],
-                "knowledge_context": knowledge_context,
-                "conversation_history": history_str
-            })
+        return {
+            **self.salesperson_info,
+            "current_stage": self.current_stage,
+            "stage_description": SALES_STAGES[self.current_stage],
+            "knowledge_context": knowledge_context,
+            "conversation_history": history_str
+        }
+    
+    def _usage_turn(self):
+        """本轮LLM调用的token核算范围，未配置核算器时不做记录"""
+        if self.token_accountant is None:
+            return nullcontext()
+        return self.token_accountant.turn()
+    
+    def _usage_stream_turn(self):
+        """流式生成器的核算范围：不在 yield 期间保持当前轮次，由 use_turn() 在准备阶段激活"""
+        if self.token_accountant is None:
+            return nullcontext()
+        return self.token_accountant.stream_turn()
+    
+    def _finish_turn(self, response: str):
+        """把回复添加到历史记录"""
+        self._append_history(f"{self.salesperson_info['name']}：{response}<END_OF_TURN>")
+    
+    def step(self, user_input: str = None) -> str:
+        """执行一步对话"""
+        with self._usage_turn():
+            inputs = self._prepare_turn(user_input)
+            
+            # 生成回复
+            try:
+                result = self.conversation_chain.invoke(inputs, config=usage_config("conversation"))
+                
+                response = result.get("text", "").strip()
+                self._finish_turn(response)
+                
+                return response
+                
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                return "抱歉，我遇到了技术问题，请稍后再试。"
+    
+    def stream_step(self, user_input: str = None) -> Iterator[str]:
+        """流式执行一步对话，逐段产出回复，遇到 <END_OF_TURN> 立即停止生成"""
+        with self._usage_stream_turn() as usage, rollback_on_abort(self.conversation_history, self.history_buffer):
+            with use_turn(usage):
+                inputs = self._prepare_turn(user_input)
+                prompt = self.conversation_chain.prompt.format_prompt(**inputs)
+                config = usage_config("conversation")
             
-            response = result.get("text", "").strip()
-            self.conversation_history.append(f"{self.salesperson_info['name']}：{response}<END_OF_TURN>")
+            chunks = []
+            try:
+                for text in stream_until_end_of_turn(self.llm, prompt, config=config):
+                    chunks.append(text)
+                    yield text
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield "抱歉，我遇到了技术问题，请稍后再试。"
+                return
             
-            return response
+            self._finish_turn("".join(chunks).strip())
+    
+    async def astream_step(self, user_input: str = None) -> AsyncIterator[str]:
+        """异步流式执行一步对话"""
+        with self._usage_stream_turn() as usage, rollback_on_abort(self.conversation_history, self.history_buffer):
+            with use_turn(usage):
+                # 阶段分析是同步调用，放到线程中避免阻塞事件循环
+                inputs = await asyncio.to_thread(self._prepare_turn, user_input)
+                prompt = self.conversation_chain.prompt.format_prompt(**inputs)
+                config = usage_config("conversation")
             
-        except Exception as e:
-            print(f"生成回复时出错: {e}")
-            return "抱歉，我遇到了技术问题，请稍后再试。"
+            chunks = []
+            try:
+                async for text in astream_until_end_of_turn(self.llm, prompt, config=config):
+                    chunks.append(text)
+                    yield text
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield "抱歉，我遇到了技术问题，请稍后再试。"
+                return
+            
+            self._finish_turn("".join(chunks).strip())
     
     def get_conversation_summary(self) -> Dict[str, Any]:
         """获取对话摘要"""
@@ -324,7 +471,12 @@ class KnowledgeBasedSalesGPT:
             "stage_description": SALES_STAGES[self.current_stage],
             "conversation_turns": len(self.conversation_history),
             "salesperson": self.salesperson_info["name"],
-            "company": self.salesperson_info["company"]
+            "company": self.salesperson_info["company"],
+            "stage_analysis": dict(self.stage_analyzer.stats),
+            "token_usage": self.token_accountant.session_summary() if self.token_accountant else None,
+            "fact_hits": self.fact_hits,
+            "history_tokens": self.history_buffer.token_count,
+            "history_token_budget": self.history_buffer.max_tokens
         }
 
 def demonstrate_knowledge_search():
@@ -15,16 +15,25 @@ RAG增强版 SalesGPT v4.0 - 集成向量检索系统
 - 多种嵌入模型备选
 - 智能文档分割
 - 上下文相关的知识检索
+- 知识检索与阶段分析并发执行（asyncio），降低每轮延迟
+- 向量索引按内容哈希持久化，知识文件未变化时直接加载
+- 流式输出回复，遇到 <END_OF_TURN> 立即停止生成
+- 可选仅检索模式：直接注入知识片段，省去RetrievalQA内部的LLM调用
+- 价格、续航等结构化事实直接从产品摘要索引回答，未命中时才进行向量检索
+- 可选合并模式：一次LLM调用同时给出阶段和回复
+- 可选的知识问答语义缓存：措辞不同的相同问题直接复用已有答案
 
 作者：AI助手
 日期：2024年
 版本：4.0 - RAG增强版
 """
 
+import asyncio
 import os
+import time
 import warnings
-import json
-from typing import Dict, Any, List
+from contextlib import nullcontext
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional
 
 import dotenv
 from langchain.chains.llm import LLMChain
@@ -32,9 +41,18 @@ from langchain.chains import RetrievalQA
 from langchain_core.language_models import BaseLLM
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
-from langchain_community.document_loaders import TextLoader
-from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import CharacterTextSplitter
+
+from product_facts import ProductFactIndex
+from semantic_cache import SemanticAnswerCache
+from stage_classifier import LocalFirstStageAnalysis, LocalStageClassifier
+from stage_policy import StageStickinessPolicy
+from token_accounting import TokenAccountant, record_cache_hit, usage_config, use_turn
+from token_utils import estimate_tokens, truncate_to_tokens
+from combined_reply import (COMBINED_OUTPUT_INSTRUCTIONS, CombinedReplyParser, format_stage_options,
+                            parse_combined_output)
+from history_buffer import TokenBudgetHistory, rollback_on_abort
+from turn_streaming import astream_until_end_of_turn, stream_until_end_of_turn
+from vector_index import load_or_build_vectorstore
 
 # 尝试导入不同的嵌入模型
 try:
@@ -84,9 +102,21 @@ SALES_STAGES = {
 class RAGKnowledgeBase:
     """基于RAG的知识库系统"""
     
-    def __init__(self, knowledge_file_path: str = None):
-        """初始化RAG知识库"""
+    def __init__(self, knowledge_file_path: str = None, qa_llm=None, embeddings=None,
+                 answer_cache: Optional[SemanticAnswerCache] = None):
+        """初始化RAG知识库
+
+        qa_llm 和 embeddings 用于替换默认的问答模型和嵌入模型（例如离线基准中的桩模型）。
+        answer_cache 为 query() 前面的语义缓存，默认不启用（启用后每个产品问题多一次嵌入调用）。
+        多个会话应共享同一个知识库及其缓存，缓存只在 setup_knowledge_base() 重建索引时按索引键失效。
+        """
         self.knowledge_file_path = knowledge_file_path or "chapter07/data/car_knowledge_base.txt"
+        self.qa_llm = qa_llm or llm
+        self.embeddings = embeddings
+        self.splitter_settings = {"chunk_size": 1000, "chunk_overlap": 200, "separator": "\n"}
+        self.index_key = None
+        # 语义缓存绑定索引键，知识文件变化后重新设置知识库时自动清空；未传入时使用禁用的缓存
+        self.answer_cache = answer_cache if answer_cache is not None else SemanticAnswerCache(max_entries=0)
         self.vectorstore = None
         self.qa_chain = None
         self.setup_knowledge_base()
@@ -101,30 +131,20 @@ class RAGKnowledgeBase:
                 print(f"知识库文件不存在: {self.knowledge_file_path}")
                 self._create_default_knowledge_file()
             
-            # 加载文档
-            loader = TextLoader(self.knowledge_file_path, encoding='utf-8')
-            documents = loader.load()
-            
-            # 分割文档
-            text_splitter = CharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                separator="\n"
-            )
-            texts = text_splitter.split_documents(documents)
-            
             # 创建嵌入模型
             embeddings = self._get_embeddings()
             if not embeddings:
                 print("无法创建嵌入模型，RAG功能将被禁用")
                 return
             
-            # 创建向量存储
-            self.vectorstore = FAISS.from_documents(texts, embeddings)
+            # 加载或创建向量存储
+            self.vectorstore, self.index_key = load_or_build_vectorstore(
+                self.knowledge_file_path, self.splitter_settings, embeddings)
+            self.answer_cache.bind(embeddings, self.index_key)
             
             # 创建检索问答链
             self.qa_chain = RetrievalQA.from_chain_type(
-                llm=llm,
+                llm=self.qa_llm,
                 chain_type="stuff",
                 retriever=self.vectorstore.as_retriever(search_kwargs={"k": 3}),
                 return_source_documents=True
@@ -139,6 +159,9 @@ class RAGKnowledgeBase:
     
     def _get_embeddings(self):
         """获取嵌入模型"""
+        if self.embeddings is not None:
+            return self.embeddings
+
         embeddings = None
         
         # 尝试使用HuggingFace嵌入模型
@@ -296,22 +319,111 @@ AI数据分析平台是一款企业级的数据分析和商业智能解决方案
         print(f"✅ 已创建默认知识库文件: {self.knowledge_file_path}")
     
     def query(self, question: str) -> str:
-        """查询知识库"""
+        """查询知识库，语义相近的问题直接返回缓存的答案"""
         if not self.qa_chain:
             return "抱歉，知识库暂时不可用。"
 
+        vector = self.answer_cache.embed(question)
+        cached = self.answer_cache.get(vector)
+        if cached is not None:
+            record_cache_hit("answer_cache")
+            return cached
+
+        try:
+            result = self.qa_chain.invoke({"query": question}, config=usage_config("retrieval_qa"))
+            answer = result["result"]
+            self.answer_cache.put(question, vector, answer)
+            return answer
+        except Exception as e:
+            print(f"知识库查询错误: {e}")
+            return "抱歉，查询过程中出现了问题。"
+
+    async def aquery(self, question: str) -> str:
+        """异步查询知识库，语义相近的问题直接返回缓存的答案"""
+        if not self.qa_chain:
+            return "抱歉，知识库暂时不可用。"
+
+        vector = await self.answer_cache.aembed(question)
+        cached = self.answer_cache.get(vector)
+        if cached is not None:
+            record_cache_hit("answer_cache")
+            return cached
+
         try:
-            result = self.qa_chain.invoke({"query": question})
-            return result["result"]
+            result = await self.qa_chain.ainvoke({"query": question}, config=usage_config("retrieval_qa"))
+            answer = result["result"]
+            self.answer_cache.put(question, vector, answer)
+            return answer
         except Exception as e:
             print(f"知识库查询错误: {e}")
             return "抱歉，查询过程中出现了问题。"
 
+    def retrieve_context(self, question: str, k: int = 4, max_tokens: int = 800) -> str:
+        """只检索不生成：取出最相关的知识片段，去重、按相似度排序并截断到token预算"""
+        if not self.vectorstore:
+            return ""
+
+        try:
+            results = self.vectorstore.similarity_search_with_score(question, k=k)
+        except Exception as e:
+            print(f"知识库检索错误: {e}")
+            return ""
+        return self._format_retrieved_chunks(results, max_tokens)
+
+    async def aretrieve_context(self, question: str, k: int = 4, max_tokens: int = 800) -> str:
+        """异步检索知识片段"""
+        if not self.vectorstore:
+            return ""
+
+        try:
+            results = await self.vectorstore.asimilarity_search_with_score(question, k=k)
+        except Exception as e:
+            print(f"知识库检索错误: {e}")
+            return ""
+        return self._format_retrieved_chunks(results, max_tokens)
+
+    @staticmethod
+    def _format_retrieved_chunks(results, max_tokens: int) -> str:
+        """按相似度排序、去掉重复片段，并截断到token预算"""
+        chunks = []
+        seen = set()
+        used_tokens = 0
+
+        # FAISS 返回L2距离，数值越小越相似
+        for document, _ in sorted(results, key=lambda item: item[1]):
+            text = document.page_content.strip()
+            fingerprint = " ".join(text.split())
+            if not fingerprint or fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+
+            remaining = max_tokens - used_tokens
+            if remaining <= 0:
+                break
+            if estimate_tokens(text) > remaining:
+                text = truncate_to_tokens(text, remaining).rstrip()
+                if not text:
+                    break
+
+            chunks.append(text)
+            used_tokens += estimate_tokens(text)
+
+        return "\n\n".join(chunks)
+
 class StageAnalyzer:
     """智能阶段分析器"""
 
-    def __init__(self, llm):
+    def __init__(self, llm, classifier: Optional[LocalStageClassifier] = None, label_log_path: str = None,
+                 policy: Optional[StageStickinessPolicy] = None):
         self.llm = llm
+        # 本地分类器优先、LLM兜底；可选的样本日志记录LLM给出的阶段，用于训练本地分类器
+        self.local_first = LocalFirstStageAnalysis(SALES_STAGES, classifier, label_log_path)
+        # 可选的阶段粘滞策略，客户消息没有转换信号时沿用上一轮阶段
+        self.policy = policy
+        self.sticky_turns = 0
+        # 是否已经分析过客户轮次，还没有时不沿用初始阶段
+        self.stage_analyzed = False
+        self.stats = self.local_first.stats
         self.analyzer_chain = self._create_analyzer_chain()
 
     def _create_analyzer_chain(self):
@@ -341,27 +453,108 @@ class StageAnalyzer:
 
         return LLMChain(prompt=prompt, llm=self.llm, verbose=False)
 
-    def analyze_stage(self, conversation_history: str) -> str:
-        """分析当前应该进入的阶段"""
+    def _reuse_previous_stage(self, user_input: Optional[str], current_stage: Optional[str]) -> bool:
+        """按阶段粘滞策略判断本轮能否跳过阶段分析"""
+        if self.policy is None or current_stage is None:
+            return False
+        if self.policy.should_reuse(user_input, self.sticky_turns, self.stage_analyzed):
+            self.sticky_turns += 1
+            self.stats["sticky"] += 1
+            record_cache_hit("stage_sticky")
+            return True
+        self.sticky_turns = 0
+        if user_input:
+            self.stage_analyzed = True
+        return False
+
+    def analyze_stage(self, conversation_history: str, user_input: str = None, current_stage: str = None) -> str:
+        """分析当前应该进入的阶段，传入本轮客户消息和当前阶段时先应用阶段粘滞策略"""
+        if self._reuse_previous_stage(user_input, current_stage):
+            return current_stage
+
+        # 本地分类器足够自信时，不再调用LLM
+        local_stage = self.local_first.classify(conversation_history)
+        if local_stage:
+            return local_stage
+
         try:
-            result = self.analyzer_chain.invoke({"conversation_history": conversation_history})
+            result = self.analyzer_chain.invoke({"conversation_history": conversation_history}, config=usage_config("stage_analysis"))
             stage = result.get("text", "1").strip()
-            return stage if stage in SALES_STAGES else "1"
         except Exception as e:
             print(f"阶段分析错误: {e}")
-            return "1"
+            stage = None
+
+        # 每次LLM调用都计数；无效输出或调用失败时返回介绍阶段
+        self.local_first.record_llm_stage(conversation_history, stage)
+        return stage if stage in SALES_STAGES else "1"
+
+    async def aanalyze_stage(self, conversation_history: str, user_input: str = None,
+                             current_stage: str = None) -> str:
+        """异步分析当前应该进入的阶段"""
+        if self._reuse_previous_stage(user_input, current_stage):
+            return current_stage
+
+        local_stage = self.local_first.classify(conversation_history)
+        if local_stage:
+            return local_stage
+
+        try:
+            result = await self.analyzer_chain.ainvoke({"conversation_history": conversation_history}, config=usage_config("stage_analysis"))
+            stage = result.get("text", "1").strip()
+        except Exception as e:
+            print(f"阶段分析错误: {e}")
+            stage = None
+
+        # 每次LLM调用都计数；无效输出或调用失败时返回介绍阶段
+        self.local_first.record_llm_stage(conversation_history, stage)
+        return stage if stage in SALES_STAGES else "1"
 
 class RAGEnhancedSalesGPT:
     """RAG增强版销售对话代理"""
 
-    def __init__(self, llm, knowledge_file_path: str = None, verbose=True):
-        """初始化销售代理"""
+    def __init__(self, llm, knowledge_file_path: str = None, verbose=True,
+                 stage_classifier: Optional[LocalStageClassifier] = None, stage_label_log: str = None,
+                 knowledge_mode: str = "qa", knowledge_token_budget: int = 800, embeddings=None,
+                 fact_index: Optional[ProductFactIndex] = None, history_token_budget: int = 2000,
+                 stage_mode: str = "separate", stage_policy: Optional[StageStickinessPolicy] = None,
+                 knowledge_base: Optional[RAGKnowledgeBase] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None,
+                 token_accountant: Optional[TokenAccountant] = None):
+        """初始化销售代理
+
+        knowledge_mode 为 "qa" 时用 RetrievalQA 生成知识摘要；为 "retrieval" 时
+        直接注入检索到的片段（不超过 knowledge_token_budget 个token），每轮少一次LLM调用。
+        fact_index 默认从 data/product_summary.json 加载。
+        stage_mode 为 "separate" 时阶段分析和回复生成分别调用LLM；为 "combined" 时
+        一次调用同时输出阶段和回复。
+        传入 knowledge_base 时多个代理共享同一知识库（向量索引和语义缓存只加载一次），
+        此时忽略 knowledge_file_path、embeddings 和 answer_cache。
+        answer_cache 为知识问答语义缓存，默认不启用。
+        token_accountant 记录每轮各次LLM调用（对话、阶段分析、RetrievalQA）的token用量和缓存命中。
+        """
+        if knowledge_mode not in ("qa", "retrieval"):
+            raise ValueError(f"不支持的知识检索模式: {knowledge_mode}")
+        if stage_mode not in ("separate", "combined"):
+            raise ValueError(f"不支持的阶段分析模式: {stage_mode}")
         self.llm = llm
         self.verbose = verbose
-        self.knowledge_base = RAGKnowledgeBase(knowledge_file_path)
-        self.stage_analyzer = StageAnalyzer(llm)
+        self.token_accountant = token_accountant
+        self.stage_mode = stage_mode
+        self.knowledge_mode = knowledge_mode
+        self.knowledge_token_budget = knowledge_token_budget
+        if knowledge_base is None:
+            knowledge_base = RAGKnowledgeBase(knowledge_file_path, qa_llm=llm, embeddings=embeddings,
+                                              answer_cache=answer_cache)
+        self.knowledge_base = knowledge_base
+        self.fact_index = fact_index if fact_index is not None else ProductFactIndex.load()
+        self.fact_hits = 0
+        self.stage_analyzer = StageAnalyzer(llm, stage_classifier, stage_label_log, stage_policy)
         self.conversation_history = []
+        # 提示词中的对话历史：最近10轮，且不超过token预算
+        self.history_buffer = TokenBudgetHistory(history_token_budget, max_turns=10)
         self.current_stage = "1"
+        self.last_turn_timings: Dict[str, float] = {}
+        self._loop = None
 
         # 销售人员信息
         self.salesperson_info = {
@@ -375,6 +568,7 @@ class RAGEnhancedSalesGPT:
 
         # 创建对话链
         self.conversation_chain = self._create_conversation_chain()
+        self.combined_chain = self._create_combined_chain()
 
     def _create_conversation_chain(self):
         """创建RAG增强的对话链"""
@@ -416,55 +610,327 @@ class RAGEnhancedSalesGPT:
 
         return LLMChain(prompt=prompt, llm=self.llm, verbose=self.verbose)
 
+    def _create_combined_chain(self):
+        """创建阶段判断与回复合并输出的对话链"""
+        prompt_template = """
+你是{name}，{role}，在{company}工作。
+
+公司业务：{company_business}
+公司价值观：{company_values}
+联系目的：{contact_purpose}
+
+上一轮销售阶段：{current_stage}（{stage_description}）
+
+销售阶段选项：
+{stage_options}
+
+基于知识库的相关信息：
+{knowledge_context}
+
+对话历史：
+{conversation_history}
+
+先根据对话历史判断现在应该进入的销售阶段，再按该阶段生成专业回复：
+- 充分利用知识库提供的准确信息
+- 根据客户问题提供详细和专业的回答
+- 保持专业、友好和有帮助的语调
+- 适时推进销售进程
+- 如果知识库中没有相关信息，诚实说明并提供一般性建议
+
+{output_instructions}
+        """
+
+        prompt = PromptTemplate(
+            template=prompt_template,
+            input_variables=[
+                "name", "role", "company", "company_business", "company_values",
+                "contact_purpose", "current_stage", "stage_description",
+                "knowledge_context", "conversation_history"
+            ],
+            partial_variables={
+                "stage_options": format_stage_options(SALES_STAGES),
+                "output_instructions": COMBINED_OUTPUT_INSTRUCTIONS
+            }
+        )
+
+        return LLMChain(prompt=prompt, llm=self.llm, verbose=self.verbose)
+
+    def _is_product_question(self, user_input: str) -> bool:
+        """检查用户输入是否包含产品相关关键词"""
+        product_keywords = ["产品", "价格", "功能", "服务", "技术", "解决方案", "系统", "平台", "机器人"]
+        return any(keyword in user_input for keyword in product_keywords)
+
     def get_knowledge_context(self, user_input: str) -> str:
         """获取相关的产品知识"""
         if not user_input:
             return ""
 
-        # 检查用户输入是否包含产品相关关键词
-        product_keywords = ["产品", "价格", "功能", "服务", "技术", "解决方案", "系统", "平台", "机器人"]
-
-        if any(keyword in user_input for keyword in product_keywords):
+        # 价格、续航等结构化事实直接回答，不再进行向量检索
+        facts = self.fact_index.answer(user_input)
+        if facts:
+            self.fact_hits += 1
+            record_cache_hit("product_facts")
+            return f"产品参数：{facts}"
+
+        if self._is_product_question(user_input):
+            if self.knowledge_mode == "retrieval":
+                # 直接注入检索到的片段，省去RetrievalQA内部的一次LLM生成
+                knowledge = self.knowledge_base.retrieve_context(user_input, max_tokens=self.knowledge_token_budget)
+                return f"相关产品信息：\n{knowledge}" if knowledge else ""
             knowledge = self.knowledge_base.query(user_input)
             return f"相关产品信息：{knowledge}"
 
         return ""
 
+    async def aget_knowledge_context(self, user_input: str) -> str:
+        """异步获取相关的产品知识"""
+        if not user_input:
+            return ""
+
+        # 价格、续航等结构化事实直接回答，不再进行向量检索
+        facts = self.fact_index.answer(user_input)
+        if facts:
+            self.fact_hits += 1
+            record_cache_hit("product_facts")
+            return f"产品参数：{facts}"
+
+        if self._is_product_question(user_input):
+            if self.knowledge_mode == "retrieval":
+                knowledge = await self.knowledge_base.aretrieve_context(
+                    user_input, max_tokens=self.knowledge_token_budget)
+                return f"相关产品信息：\n{knowledge}" if knowledge else ""
+            knowledge = await self.knowledge_base.aquery(user_input)
+            return f"相关产品信息：{knowledge}"
+
+        return ""
+
+    async def _aanalyze_current_stage(self, history_str: str, user_input: str = None) -> str:
+        """异步分析当前阶段，尚无对话历史时保持当前阶段"""
+        if len(self.conversation_history) > 0:
+            return await self.stage_analyzer.aanalyze_stage(history_str, user_input, self.current_stage)
+        return self.current_stage
+
+    def _run_sync(self, coro):
+        """在同步接口专用的事件循环中运行协程
+
+        复用同一个事件循环，避免异步HTTP客户端绑定到已关闭的循环；不再使用时调用 close() 释放。
+        同步接口不能在正在运行的事件循环中调用（例如 async 函数或 Jupyter 中），此时请使用 astep / astream_step。
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            coro.close()
+            raise RuntimeError("step() / stream_step() 不能在正在运行的事件循环中调用，请改用 astep() / astream_step()")
+
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    def close(self):
+        """关闭同步接口使用的事件循环"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+        self._loop = None
+
     def step(self, user_input: str = None) -> str:
-        """执行一步对话"""
-        # 获取知识上下文
-        knowledge_context = ""
+        """执行一步对话（同步封装，内部调用 astep；不能在正在运行的事件循环中调用）"""
+        return self._run_sync(self.astep(user_input))
+
+    def _append_history(self, entry: str):
+        """记录一轮对话：完整记录保存在 conversation_history，提示词使用按token预算维护的历史窗口"""
+        self.conversation_history.append(entry)
+        self.history_buffer.append(entry)
+
+    async def _aprepare_turn(self, user_input: str, timings: Dict[str, float]) -> Dict[str, Any]:
+        """记录用户输入，并发执行知识检索和阶段分析，构建本轮提示变量
+
+        合并模式下阶段由回复生成时一并给出，这里只做知识检索。
+        """
+        async def timed(phase: str, coro):
+            phase_start = time.perf_counter()
+            try:
+                return await coro
+            finally:
+                timings[phase] = time.perf_counter() - phase_start
+
         if user_input:
-            knowledge_context = self.get_knowledge_context(user_input)
-            self.conversation_history.append(f"客户：{user_input}<END_OF_TURN>")
+            self._append_history(f"客户：{user_input}<END_OF_TURN>")
 
         # 构建对话历史
-        history_str = "".join(self.conversation_history[-10:])
+        history_str = self.history_buffer.render()
         if not history_str:
             history_str = "对话开始"
 
-        # 分析当前阶段
-        if len(self.conversation_history) > 0:
-            self.current_stage = self.stage_analyzer.analyze_stage(history_str)
+        # 并发执行知识检索和阶段分析
+        parallel_start = time.perf_counter()
+        if self.stage_mode == "combined":
+            knowledge_context = await timed("knowledge_retrieval", self.aget_knowledge_context(user_input))
+        else:
+            knowledge_context, self.current_stage = await asyncio.gather(
+                timed("knowledge_retrieval", self.aget_knowledge_context(user_input)),
+                timed("stage_analysis", self._aanalyze_current_stage(history_str, user_input))
+            )
+        timings["retrieval_and_analysis"] = time.perf_counter() - parallel_start
 
-        # 生成回复
-        try:
-            result = self.conversation_chain.invoke({
-                **self.salesperson_info,
-                "current_stage": self.current_stage,
-                "stage_description": SALES_STAGES[self.current_stage],
-                "knowledge_context": knowledge_context,
-                "conversation_history": history_str
-            })
+        return {
+            **self.salesperson_info,
+            "current_stage": self.current_stage,
+            "stage_description": SALES_STAGES[self.current_stage],
+            "knowledge_context": knowledge_context,
+            "conversation_history": history_str
+        }
+
+    def _usage_turn(self):
+        """本轮LLM调用的token核算范围，未配置核算器时不做记录"""
+        if self.token_accountant is None:
+            return nullcontext()
+        return self.token_accountant.turn()
+
+    def _usage_stream_turn(self):
+        """流式生成器的核算范围：不在 yield 期间保持当前轮次，由 use_turn() 在准备阶段激活"""
+        if self.token_accountant is None:
+            return nullcontext()
+        return self.token_accountant.stream_turn()
+
+    def _finish_turn(self, response: str):
+        """把回复添加到历史记录"""
+        self._append_history(f"{self.salesperson_info['name']}：{response}<END_OF_TURN>")
+
+    def _reply_chain(self):
+        """当前模式使用的回复生成链"""
+        return self.combined_chain if self.stage_mode == "combined" else self.conversation_chain
+
+    def _new_reply_parser(self) -> Optional[CombinedReplyParser]:
+        """合并模式下用于流式解析阶段行的解析器"""
+        if self.stage_mode != "combined":
+            return None
+        return CombinedReplyParser(SALES_STAGES, self.current_stage)
+
+    def _apply_stage(self, stage: str, from_model: bool, history_str: str):
+        """采用合并输出中的阶段；阶段无效时保持上一轮阶段（仍计为一次LLM阶段判断）"""
+        self.current_stage = stage
+        self.stage_analyzer.local_first.record_llm_stage(history_str, stage if from_model else None)
+
+    def _record_timings(self, timings: Dict[str, float], turn_start: float):
+        """以毫秒记录本轮各阶段耗时"""
+        timings["total"] = time.perf_counter() - turn_start
+        self.last_turn_timings = {phase: round(seconds * 1000, 1) for phase, seconds in timings.items()}
+
+    async def astep(self, user_input: str = None) -> str:
+        """异步执行一步对话
+
+        知识检索和阶段分析互不依赖，两者并发执行，
+        每轮对话可节省约一次LLM往返的延迟。
+        """
+        with self._usage_turn():
+            timings = {}
+            turn_start = time.perf_counter()
+            inputs = await self._aprepare_turn(user_input, timings)
+
+            # 生成回复
+            generation_start = time.perf_counter()
+            try:
+                result = await self._reply_chain().ainvoke(inputs, config=usage_config("conversation"))
+
+                response = result.get("text", "").strip()
+                if self.stage_mode == "combined":
+                    stage, response, from_model = parse_combined_output(response, SALES_STAGES, self.current_stage)
+                    self._apply_stage(stage, from_model, inputs["conversation_history"])
+                self._finish_turn(response)
+
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                response = "抱歉，我遇到了技术问题，请稍后再试。"
 
-            response = result.get("text", "").strip()
-            self.conversation_history.append(f"{self.salesperson_info['name']}：{response}<END_OF_TURN>")
+            finally:
+                timings["response_generation"] = time.perf_counter() - generation_start
+                self._record_timings(timings, turn_start)
 
             return response
 
-        except Exception as e:
-            print(f"生成回复时出错: {e}")
-            return "抱歉，我遇到了技术问题，请稍后再试。"
+    def stream_step(self, user_input: str = None) -> Iterator[str]:
+        """流式执行一步对话，逐段产出回复，遇到 <END_OF_TURN> 立即停止生成
+
+        额外记录首个片段的延迟（first_token）。与 step() 一样不能在正在运行的事件循环中调用。
+        """
+        with self._usage_stream_turn() as usage, rollback_on_abort(self.conversation_history, self.history_buffer):
+            with use_turn(usage):
+                timings = {}
+                turn_start = time.perf_counter()
+                inputs = self._run_sync(self._aprepare_turn(user_input, timings))
+                prompt = self._reply_chain().prompt.format_prompt(**inputs)
+                parser = self._new_reply_parser()
+                config = usage_config("conversation")
+
+            generation_start = time.perf_counter()
+            chunks = []
+            try:
+                for text in stream_until_end_of_turn(self.llm, prompt, config=config):
+                    if parser:
+                        text = parser.feed(text)
+                    if not text:
+                        continue
+                    if not chunks:
+                        timings["first_token"] = time.perf_counter() - generation_start
+                    chunks.append(text)
+                    yield text
+                if parser:
+                    text = parser.flush()
+                    if text:
+                        chunks.append(text)
+                        yield text
+                    self._apply_stage(parser.stage, parser.stage_from_model, inputs["conversation_history"])
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield "抱歉，我遇到了技术问题，请稍后再试。"
+                return
+            finally:
+                timings["response_generation"] = time.perf_counter() - generation_start
+                self._record_timings(timings, turn_start)
+
+            self._finish_turn("".join(chunks).strip())
+
+    async def astream_step(self, user_input: str = None) -> AsyncIterator[str]:
+        """异步流式执行一步对话"""
+        with self._usage_stream_turn() as usage, rollback_on_abort(self.conversation_history, self.history_buffer):
+            with use_turn(usage):
+                timings = {}
+                turn_start = time.perf_counter()
+                inputs = await self._aprepare_turn(user_input, timings)
+                prompt = self._reply_chain().prompt.format_prompt(**inputs)
+                parser = self._new_reply_parser()
+                config = usage_config("conversation")
+
+            generation_start = time.perf_counter()
+            chunks = []
+            try:
+                async for text in astream_until_end_of_turn(self.llm, prompt, config=config):
+                    if parser:
+                        text = parser.feed(text)
+                    if not text:
+                        continue
+                    if not chunks:
+                        timings["first_token"] = time.perf_counter() - generation_start
+                    chunks.append(text)
+                    yield text
+                if parser:
+                    text = parser.flush()
+                    if text:
+                        chunks.append(text)
+                        yield text
+                    self._apply_stage(parser.stage, parser.stage_from_model, inputs["conversation_history"])
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield "抱歉，我遇到了技术问题，请稍后再试。"
+                return
+            finally:
+                timings["response_generation"] = time.perf_counter() - generation_start
+                self._record_timings(timings, turn_start)
+
+            self._finish_turn("".join(chunks).strip())
 
     def get_conversation_summary(self) -> Dict[str, Any]:
         """获取对话摘要"""
@@ -474,7 +940,16 @@ class RAGEnhancedSalesGPT:
             "conversation_turns": len(self.conversation_history),
             "salesperson": self.salesperson_info["name"],
             "company": self.salesperson_info["company"],
-            "rag_enabled": self.knowledge_base.qa_chain is not None
+            "rag_enabled": self.knowledge_base.qa_chain is not None,
+            "knowledge_mode": self.knowledge_mode,
+            "stage_mode": self.stage_mode,
+            "fact_hits": self.fact_hits,
+            "answer_cache": self.knowledge_base.answer_cache.stats(),
+            "history_tokens": self.history_buffer.token_count,
+            "history_token_budget": self.history_buffer.max_tokens,
+            "stage_analysis": dict(self.stage_analyzer.stats),
+            "token_usage": self.token_accountant.session_summary() if self.token_accountant else None,
+            "turn_timings_ms": self.last_turn_timings
         }
 
 def demonstrate_rag_knowledge():
@@ -535,6 +1010,8 @@ def demonstrate_rag_sales():
         summary = sales_agent.get_conversation_summary()
         print(f"[阶段 {summary['current_stage']}: {summary['stage_description']} | RAG: {'✅' if summary['rag_enabled'] else '❌'}]")
 
+    sales_agent.close()
+
 def interactive_rag_demo():
     """交互式RAG演示"""
     print("\n" + "=" * 60)
@@ -564,6 +1041,9 @@ def interactive_rag_demo():
                 print(f"- 对话轮数: {summary['conversation_turns']}")
                 print(f"- 销售专家: {summary['salesperson']} ({summary['company']})")
                 print(f"- RAG状态: {'✅ 已启用' if summary['rag_enabled'] else '❌ 未启用'}")
+                if summary['turn_timings_ms']:
+                    timings = ", ".join(f"{phase}={ms}ms" for phase, ms in summary['turn_timings_ms'].items())
+                    print(f"- 上一轮耗时: {timings}")
                 continue
 
             if user_input.lower().startswith('knowledge '):
@@ -587,6 +1067,8 @@ def interactive_rag_demo():
         except Exception as e:
             print(f"\n出现错误: {e}")
 
+    sales_agent.close()
+
 def main():
     """主函数"""
     print("RAG增强版 SalesGPT v4.0")
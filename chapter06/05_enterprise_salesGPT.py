@@ -17,28 +17,55 @@
 - 自动化销售流程
 - 实时性能监控
 - 详细的销售报告
+- 向量索引按内容哈希持久化，知识文件未变化时直接加载
+- 多会话共享知识库、LLM链和客户库，新会话只创建轻量级对话状态
+- 交互记录存储可插拔：内存（默认）或 SQLite（WAL模式，按客户和时间索引）
+- 客户变更事件驱动的增量统计，销售摘要无需重新扫描全部数据
+- 列式（NumPy）客户与交互数据，向量化分组统计和全量客户参与度批量评分
+- 提示词静态片段（销售人员信息、阶段表）只渲染一次，客户档案按版本号缓存
+- 流式输出回复，遇到 <END_OF_TURN> 立即停止生成
+- 可选仅检索模式：直接注入知识片段，省去RetrievalQA内部的LLM调用
+- 价格、续航等结构化事实直接从产品摘要索引回答，未命中时才进行向量检索
+- 可选合并模式：一次LLM调用同时给出阶段和回复
+- 可选的知识问答语义缓存：措辞不同的相同问题直接复用已有答案（多会话共享）
 
 作者：AI助手
 日期：2024年
 版本：5.0 - 企业版
 """
 
+import asyncio
+import bisect
 import datetime
 import os
+import sqlite3
+import threading
+import uuid
 import warnings
+from contextlib import nullcontext
 from dataclasses import dataclass, asdict
 from enum import Enum
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple
 
 import dotenv
 from langchain.chains import RetrievalQA
 from langchain.chains.llm import LLMChain
-from langchain_community.document_loaders import TextLoader
 from langchain_community.embeddings import OllamaEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
-from langchain_text_splitters import CharacterTextSplitter
+
+from columnar_analytics import ColumnarSalesData
+from combined_reply import COMBINED_OUTPUT_INSTRUCTIONS, CombinedReplyParser, parse_combined_output
+from prompt_assembly import PromptAssembler
+from product_facts import ProductFactIndex
+from semantic_cache import SemanticAnswerCache
+from stage_classifier import LocalFirstStageAnalysis, LocalStageClassifier
+from stage_policy import StageStickinessPolicy
+from token_accounting import TokenAccountant, record_cache_hit, usage_config, use_turn
+from token_utils import estimate_tokens, truncate_to_tokens
+from history_buffer import TokenBudgetHistory, rollback_on_abort
+from turn_streaming import astream_until_end_of_turn, stream_until_end_of_turn
+from vector_index import load_or_build_vectorstore
 
 # 过滤弃用警告
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -72,6 +99,9 @@ SALES_STAGES = {
     "7": "成交推进：推进销售进程，提出具体的下一步行动"
 }
 
+# 生成回复出错时返回给客户的提示
+FALLBACK_REPLY = "抱歉，我遇到了技术问题，请稍后再试。"
+
 
 class CustomerStatus(Enum):
     """客户状态枚举"""
@@ -127,15 +157,243 @@ class SalesInteraction:
     salesperson: str
 
 
+class InMemoryInteractionStore:
+    """内存交互记录存储（默认）"""
+
+    def __init__(self):
+        """初始化存储"""
+        self._interactions: List[SalesInteraction] = []
+        # 按客户分组并按时间戳排序（时间戳相同时保持插入顺序，与 SQLite 的 ORDER BY timestamp, id 一致），
+        # 单个客户的查询不需要扫描全部记录，时间范围用二分查找定位
+        self._by_customer: Dict[str, List[SalesInteraction]] = {}
+        self._timestamps: Dict[str, List[str]] = {}
+
+    def add(self, interaction: SalesInteraction):
+        """添加交互记录，按时间戳插入到客户记录中的有序位置"""
+        self._interactions.append(interaction)
+        interactions = self._by_customer.setdefault(interaction.customer_id, [])
+        timestamps = self._timestamps.setdefault(interaction.customer_id, [])
+        position = bisect.bisect_right(timestamps, interaction.timestamp)
+        timestamps.insert(position, interaction.timestamp)
+        interactions.insert(position, interaction)
+
+    def get_customer_interactions(self, customer_id: str, start: str = None, end: str = None,
+                                  limit: int = None, offset: int = 0) -> List[SalesInteraction]:
+        """按时间顺序获取客户的交互记录，支持时间范围 [start, end) 和分页"""
+        interactions = self._by_customer.get(customer_id, [])
+        timestamps = self._timestamps.get(customer_id, [])
+        low = 0 if start is None else bisect.bisect_left(timestamps, start)
+        high = len(timestamps) if end is None else bisect.bisect_left(timestamps, end)
+        low += offset
+        if limit is not None:
+            high = min(high, low + limit)
+        return interactions[low:high]
+
+    def count(self) -> int:
+        """交互记录总数"""
+        return len(self._interactions)
+
+    def count_by_channel_and_stage(self, bucket_length: int = None) -> List[Tuple[str, str, Optional[str], int]]:
+        """按渠道、阶段分组计数，给出 bucket_length 时再按时间戳前缀（时间桶）分组
+
+        Returns:
+            List[tuple]: (渠道, 阶段, 时间桶或None, 数量)
+        """
+        counts: Dict[Tuple[str, str, Optional[str]], int] = {}
+        for i in self._interactions:
+            key = (i.channel.value, i.stage, i.timestamp[:bucket_length] if bucket_length else None)
+            counts[key] = counts.get(key, 0) + 1
+        return [(*key, count) for key, count in counts.items()]
+
+    def iter_interaction_rows(self, batch_size: int = 10000) -> Iterator[Tuple[str, str, str, str]]:
+        """按插入顺序逐条产出 (客户ID, 渠道, 阶段, 时间戳)"""
+        for i in self._interactions:
+            yield i.customer_id, i.channel.value, i.stage, i.timestamp
+
+    def all(self) -> List[SalesInteraction]:
+        """获取全部交互记录"""
+        return self._interactions
+
+    def flush(self):
+        """内存存储无需落盘"""
+
+    def close(self):
+        """内存存储无需关闭"""
+
+
+class SQLiteInteractionStore:
+    """基于SQLite的交互记录存储
+
+    - WAL模式，读写互不阻塞
+    - (customer_id, timestamp) 复合索引，单个客户的查询为 O(log n)
+    - 写入先进入缓冲区，达到批量大小后一次性插入
+    """
+
+    COLUMNS = ("interaction_id", "customer_id", "timestamp", "channel", "stage",
+               "content", "outcome", "next_action", "salesperson")
+
+    def __init__(self, db_path: str = "data/interactions.db", batch_size: int = 100):
+        """初始化存储
+
+        Args:
+            db_path: 数据库文件路径
+            batch_size: 批量插入的记录数
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._pending: List[SalesInteraction] = []
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS interactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                interaction_id TEXT,
+                customer_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                channel TEXT,
+                stage TEXT,
+                content TEXT,
+                outcome TEXT,
+                next_action TEXT,
+                salesperson TEXT
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_interactions_customer_time ON interactions (customer_id, timestamp)")
+        self._conn.commit()
+
+    def add(self, interaction: SalesInteraction):
+        """添加交互记录，缓冲区满时批量写入"""
+        with self._lock:
+            self._pending.append(interaction)
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        """写入缓冲区中的记录（调用方需持有锁）"""
+        if not self._pending:
+            return
+        rows = [
+            (i.interaction_id, i.customer_id, i.timestamp, i.channel.value, i.stage,
+             i.content, i.outcome, i.next_action, i.salesperson)
+            for i in self._pending
+        ]
+        placeholders = ", ".join("?" for _ in self.COLUMNS)
+        self._conn.executemany(
+            f"INSERT INTO interactions ({', '.join(self.COLUMNS)}) VALUES ({placeholders})", rows)
+        self._conn.commit()
+        self._pending = []
+
+    def flush(self):
+        """写入缓冲区中的记录"""
+        with self._lock:
+            self._flush_locked()
+
+    def _to_interaction(self, row) -> SalesInteraction:
+        """数据库行转换为交互记录"""
+        record = dict(zip(self.COLUMNS, row))
+        record["channel"] = InteractionChannel(record["channel"])
+        return SalesInteraction(**record)
+
+    def get_customer_interactions(self, customer_id: str, start: str = None, end: str = None,
+                                  limit: int = None, offset: int = 0) -> List[SalesInteraction]:
+        """按时间顺序获取客户的交互记录，支持时间范围 [start, end) 和分页"""
+        sql = f"SELECT {', '.join(self.COLUMNS)} FROM interactions WHERE customer_id = ?"
+        params: List[Any] = [customer_id]
+        if start is not None:
+            sql += " AND timestamp >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND timestamp < ?"
+            params.append(end)
+        sql += " ORDER BY timestamp, id LIMIT ? OFFSET ?"
+        params.extend([-1 if limit is None else limit, offset])
+
+        with self._lock:
+            # 先写入缓冲区，保证能读到刚添加的记录
+            self._flush_locked()
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._to_interaction(row) for row in rows]
+
+    def count(self) -> int:
+        """交互记录总数"""
+        with self._lock:
+            self._flush_locked()
+            return self._conn.execute("SELECT COUNT(*) FROM interactions").fetchone()[0]
+
+    def count_by_channel_and_stage(self, bucket_length: int = None) -> List[Tuple[str, str, Optional[str], int]]:
+        """按渠道、阶段分组计数（GROUP BY），给出 bucket_length 时再按时间戳前缀（时间桶）分组
+
+        Returns:
+            List[tuple]: (渠道, 阶段, 时间桶或None, 数量)
+        """
+        bucket = "substr(timestamp, 1, ?)" if bucket_length else "NULL"
+        sql = (f"SELECT channel, stage, {bucket} AS bucket, COUNT(*) FROM interactions "
+               f"GROUP BY channel, stage, bucket")
+        with self._lock:
+            self._flush_locked()
+            return self._conn.execute(sql, [bucket_length] if bucket_length else []).fetchall()
+
+    def iter_interaction_rows(self, batch_size: int = 10000) -> Iterator[Tuple[str, str, str, str]]:
+        """按插入顺序分批读取 (客户ID, 渠道, 阶段, 时间戳)，不构造交互记录对象，内存占用与批大小相关"""
+        with self._lock:
+            self._flush_locked()
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, customer_id, channel, stage, timestamp FROM interactions "
+                    "WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            for _, customer_id, channel, stage, timestamp in rows:
+                yield customer_id, channel, stage, timestamp
+
+    def all(self) -> List[SalesInteraction]:
+        """获取全部交互记录（数据量大时应改用分页查询）"""
+        with self._lock:
+            self._flush_locked()
+            rows = self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM interactions ORDER BY id").fetchall()
+        return [self._to_interaction(row) for row in rows]
+
+    def close(self):
+        """写入剩余记录并关闭数据库"""
+        with self._lock:
+            self._flush_locked()
+            self._conn.close()
+
+
 class CustomerManager:
     """客户管理系统"""
 
-    def __init__(self):
-        """初始化客户管理器"""
+    def __init__(self, interaction_store=None):
+        """初始化客户管理器
+
+        Args:
+            interaction_store: 交互记录存储，默认使用 InMemoryInteractionStore，
+                需要持久化时可传入 SQLiteInteractionStore
+        """
         self.customers: Dict[str, CustomerProfile] = {}
-        self.interactions: List[SalesInteraction] = []
+        self.interaction_store = interaction_store or InMemoryInteractionStore()
+        # 变更事件监听器，回调参数为 (事件名, 事件数据)
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        # 客户ID -> 档案版本号，档案变化时递增，供提示词缓存判断是否需要重新渲染
+        self._profile_versions: Dict[str, int] = {}
         self.load_customer_data()
 
+    @property
+    def interactions(self) -> List[SalesInteraction]:
+        """全部交互记录"""
+        return self.interaction_store.all()
+
     def load_customer_data(self):
         """初始化客户数据"""
         # 直接创建示例客户数据，不从文件加载
@@ -181,7 +439,34 @@ class CustomerManager:
         ]
 
         for customer in sample_customers:
-            self.customers[customer.customer_id] = customer
+            self.add_customer(customer)
+
+    def subscribe(self, listener: Callable[[str, Dict[str, Any]], None]):
+        """订阅变更事件：customer_added、customer_status_changed、interaction_added
+
+        只有通过本类方法进行的修改才会触发事件，直接修改客户档案字段不会通知监听器。
+        """
+        self._listeners.append(listener)
+
+    def profile_version(self, customer_id: str) -> int:
+        """客户档案版本号"""
+        return self._profile_versions.get(customer_id, 0)
+
+    def mark_profile_changed(self, customer_id: str):
+        """直接修改客户档案字段后调用，使缓存的档案片段失效"""
+        self._profile_versions[customer_id] = self._profile_versions.get(customer_id, 0) + 1
+
+    def _emit(self, event: str, **payload):
+        """通知所有监听器"""
+        for listener in self._listeners:
+            listener(event, payload)
+
+    def add_customer(self, customer: CustomerProfile):
+        """添加或替换客户档案"""
+        previous = self.customers.get(customer.customer_id)
+        self.customers[customer.customer_id] = customer
+        self.mark_profile_changed(customer.customer_id)
+        self._emit("customer_added", customer=customer, previous=previous)
 
     def get_customer(self, customer_id: str) -> Optional[CustomerProfile]:
         """获取客户信息"""
@@ -190,72 +475,196 @@ class CustomerManager:
     def update_customer_status(self, customer_id: str, status: CustomerStatus):
         """更新客户状态"""
         if customer_id in self.customers:
+            old_status = self.customers[customer_id].status
             self.customers[customer_id].status = status
             self.customers[customer_id].last_contact = datetime.datetime.now().isoformat()
+            self.mark_profile_changed(customer_id)
+            self._emit("customer_status_changed", customer_id=customer_id,
+                       old_status=old_status, new_status=status)
 
     def add_interaction(self, interaction: SalesInteraction):
         """添加交互记录"""
-        self.interactions.append(interaction)
+        self.interaction_store.add(interaction)
         # 更新客户最后联系时间
         if interaction.customer_id in self.customers:
             self.customers[interaction.customer_id].last_contact = interaction.timestamp
+        self._emit("interaction_added", interaction=interaction)
 
-    def get_customer_interactions(self, customer_id: str) -> List[SalesInteraction]:
-        """获取客户的所有交互记录"""
-        return [i for i in self.interactions if i.customer_id == customer_id]
+    def get_customer_interactions(self, customer_id: str, start: str = None, end: str = None,
+                                  limit: int = None, offset: int = 0) -> List[SalesInteraction]:
+        """获取客户的交互记录，支持时间范围和分页"""
+        return self.interaction_store.get_customer_interactions(customer_id, start, end, limit, offset)
 
     def save_data(self):
-        """保存客户数据（内存中保存，不写入文件）"""
-        # 数据已在内存中，无需保存到文件
-        print("✅ 客户数据已在内存中保存")
+        """保存客户数据"""
+        # 客户档案保存在内存中，交互记录由存储后端负责落盘
+        self.interaction_store.flush()
+        print("✅ 客户数据已保存")
 
 
 class SalesAnalytics:
-    """销售数据分析系统"""
+    """销售数据分析系统
+
+    订阅 CustomerManager 的变更事件，增量维护状态、渠道、阶段分布等计数器，
+    获取销售摘要为 O(1)。可选按小时/天汇总交互数据，供看板读取时间窗口统计。
+    全量客户的参与度评分和分组统计使用列式存储（columns）向量化计算；列式存储在第一次
+    向量化查询时才从存储载入，之后随变更事件增量更新，只用计数器的部署不会在内存中镜像交互记录。
+    """
+
+    # 时间粒度 -> ISO时间戳前缀长度
+    ROLLUP_KEY_LENGTHS = {"hour": 13, "day": 10}
+
+    def __init__(self, customer_manager: CustomerManager, rollup_granularities: Tuple[str, ...] = ()):
+        """初始化分析系统
+
+        Args:
+            customer_manager: 客户管理器
+            rollup_granularities: 需要维护的时间汇总粒度，可选 "hour"、"day"
+        """
+        for granularity in rollup_granularities:
+            if granularity not in self.ROLLUP_KEY_LENGTHS:
+                raise ValueError(f"不支持的汇总粒度: {granularity}")
 
-    def __init__(self, customer_manager: CustomerManager):
-        """初始化分析系统"""
         self.customer_manager = customer_manager
+        self.rollup_granularities = tuple(rollup_granularities)
+
+        self._status_count: Dict[str, int] = {}
+        self._channel_count: Dict[str, int] = {}
+        self._stage_count: Dict[str, int] = {}
+        self._total_interactions = 0
+        # 粒度 -> 时间桶 -> 该时间桶内的统计
+        self._rollups: Dict[str, Dict[str, Dict[str, Any]]] = {g: {} for g in self.rollup_granularities}
+        # 列式存储，第一次访问 columns 时创建
+        self._columns: Optional[ColumnarSalesData] = None
+
+        # 一次性统计已有数据，之后只处理变更事件。
+        # 计数器和时间汇总由存储分组计数得到（SQLite 为 GROUP BY），不需要把全部交互记录加载成对象
+        for customer in customer_manager.customers.values():
+            self._increment(self._status_count, customer.status.value)
+        store = customer_manager.interaction_store
+        for channel, stage, _, count in store.count_by_channel_and_stage():
+            self._total_interactions += count
+            self._increment(self._channel_count, channel, count)
+            self._increment(self._stage_count, stage, count)
+        for granularity in self.rollup_granularities:
+            key_length = self.ROLLUP_KEY_LENGTHS[granularity]
+            for channel, stage, bucket_key, count in store.count_by_channel_and_stage(key_length):
+                self._add_to_rollup(granularity, bucket_key, channel, stage, count)
+
+        customer_manager.subscribe(self._on_change)
+
+    @property
+    def columns(self) -> ColumnarSalesData:
+        """列式存储：第一次访问时载入客户状态并从存储逐行流式载入交互记录"""
+        if self._columns is None:
+            columns = ColumnarSalesData(
+                statuses=[status.value for status in CustomerStatus],
+                channels=[channel.value for channel in InteractionChannel],
+                stages=list(SALES_STAGES),
+                won_status=CustomerStatus.CLOSED_WON.value
+            )
+            for customer in self.customer_manager.customers.values():
+                columns.upsert_customer(customer.customer_id, customer.status.value)
+            for customer_id, channel, stage, timestamp in self.customer_manager.interaction_store.iter_interaction_rows():
+                columns.add_interaction(customer_id, channel, stage, timestamp)
+            self._columns = columns
+        return self._columns
+
+    @staticmethod
+    def _increment(counter: Dict[str, int], key: str, delta: int = 1):
+        """更新计数，计数归零时移除该项"""
+        value = counter.get(key, 0) + delta
+        if value:
+            counter[key] = value
+        else:
+            counter.pop(key, None)
+
+    def _count_interaction(self, interaction: SalesInteraction):
+        """把一条交互记录计入计数器和时间汇总"""
+        self._total_interactions += 1
+        self._increment(self._channel_count, interaction.channel.value)
+        self._increment(self._stage_count, interaction.stage)
+        if self._columns is not None:
+            self._columns.add_interaction(interaction.customer_id, interaction.channel.value,
+                                          interaction.stage, interaction.timestamp)
+
+        for granularity in self.rollup_granularities:
+            bucket_key = interaction.timestamp[:self.ROLLUP_KEY_LENGTHS[granularity]]
+            self._add_to_rollup(granularity, bucket_key, interaction.channel.value, interaction.stage)
+
+    def _add_to_rollup(self, granularity: str, bucket_key: str, channel: str, stage: str, count: int = 1):
+        """把 count 条同渠道、同阶段的交互计入时间桶"""
+        bucket = self._rollups[granularity].setdefault(
+            bucket_key, {"interactions": 0, "channel_distribution": {}, "stage_distribution": {}})
+        bucket["interactions"] += count
+        self._increment(bucket["channel_distribution"], channel, count)
+        self._increment(bucket["stage_distribution"], stage, count)
+
+    def _on_change(self, event: str, payload: Dict[str, Any]):
+        """处理客户管理器的变更事件"""
+        if event == "interaction_added":
+            self._count_interaction(payload["interaction"])
+        elif event == "customer_status_changed":
+            self._increment(self._status_count, payload["old_status"].value, -1)
+            self._increment(self._status_count, payload["new_status"].value)
+            if self._columns is not None:
+                self._columns.upsert_customer(payload["customer_id"], payload["new_status"].value)
+        elif event == "customer_added":
+            if payload["previous"] is not None:
+                self._increment(self._status_count, payload["previous"].status.value, -1)
+            self._increment(self._status_count, payload["customer"].status.value)
+            if self._columns is not None:
+                self._columns.upsert_customer(payload["customer"].customer_id, payload["customer"].status.value)
 
     def get_sales_summary(self) -> Dict[str, Any]:
         """获取销售摘要"""
-        customers = list(self.customer_manager.customers.values())
-        interactions = self.customer_manager.interactions
-
-        # 统计客户状态分布
-        status_count = {}
-        for customer in customers:
-            status = customer.status.value
-            status_count[status] = status_count.get(status, 0) + 1
-
-        # 统计交互渠道分布
-        channel_count = {}
-        for interaction in interactions:
-            channel = interaction.channel.value
-            channel_count[channel] = channel_count.get(channel, 0) + 1
-
-        # 统计阶段分布
-        stage_count = {}
-        for interaction in interactions:
-            stage = interaction.stage
-            stage_count[stage] = stage_count.get(stage, 0) + 1
+        total_customers = len(self.customer_manager.customers)
+        closed_won = self._status_count.get(CustomerStatus.CLOSED_WON.value, 0)
 
         return {
-            "total_customers": len(customers),
-            "total_interactions": len(interactions),
-            "status_distribution": status_count,
-            "channel_distribution": channel_count,
-            "stage_distribution": stage_count,
-            "conversion_rate": self._calculate_conversion_rate(customers)
+            "total_customers": total_customers,
+            "total_interactions": self._total_interactions,
+            "status_distribution": dict(self._status_count),
+            "channel_distribution": dict(self._channel_count),
+            "stage_distribution": dict(self._stage_count),
+            "conversion_rate": (closed_won / total_customers) * 100 if total_customers else 0.0
         }
 
-    def _calculate_conversion_rate(self, customers: List[CustomerProfile]) -> float:
-        """计算转化率"""
-        if not customers:
-            return 0.0
+    def get_windowed_stats(self, granularity: str = "day", start: str = None, end: str = None) -> Dict[str, Any]:
+        """读取时间窗口 [start, end) 内的交互统计
+
+        start/end 为ISO格式时间字符串（可只写到小时或日期），按时间桶汇总，无需扫描交互记录。
+        """
+        if granularity not in self._rollups:
+            raise ValueError(f"未启用的汇总粒度: {granularity}")
+
+        key_length = self.ROLLUP_KEY_LENGTHS[granularity]
+        start_key = start[:key_length] if start else None
+        end_key = end[:key_length] if end else None
+
+        summary = {"interactions": 0, "channel_distribution": {}, "stage_distribution": {}, "buckets": 0}
+        for bucket_key, bucket in self._rollups[granularity].items():
+            if (start_key and bucket_key < start_key) or (end_key and bucket_key >= end_key):
+                continue
+            summary["buckets"] += 1
+            summary["interactions"] += bucket["interactions"]
+            for channel, count in bucket["channel_distribution"].items():
+                self._increment(summary["channel_distribution"], channel, count)
+            for stage, count in bucket["stage_distribution"].items():
+                self._increment(summary["stage_distribution"], stage, count)
+        return summary
+
+    def get_engagement_scores(self) -> Dict[str, int]:
+        """批量计算所有客户的参与度评分 {客户ID: 评分}"""
+        return self.columns.engagement_score_map()
+
+    def get_top_engaged_customers(self, n: int = 10) -> List[Dict[str, Any]]:
+        """参与度最高的 n 个客户"""
+        return self.columns.top_engaged(n)
 
-        closed_won = sum(1 for c in customers if c.status == CustomerStatus.CLOSED_WON)
-        return (closed_won / len(customers)) * 100
+    def get_stage_distribution_by_status(self) -> Dict[str, Dict[str, int]]:
+        """按客户状态分组的交互阶段分布"""
+        return self.columns.stage_distribution_by_status()
 
     def get_customer_insights(self, customer_id: str) -> Dict[str, Any]:
         """获取客户洞察"""
@@ -307,9 +716,21 @@ class SalesAnalytics:
 class EnterpriseKnowledgeBase:
     """企业级知识库系统"""
 
-    def __init__(self, knowledge_file_path: str = None):
-        """初始化企业知识库"""
+    def __init__(self, knowledge_file_path: str = None, qa_llm=None, embeddings=None,
+                 answer_cache: Optional[SemanticAnswerCache] = None):
+        """初始化企业知识库
+
+        qa_llm 和 embeddings 用于替换默认的问答模型和嵌入模型（例如离线基准中的桩模型）。
+        answer_cache 为 query() 前面的语义缓存，默认不启用（启用后每个产品问题多一次嵌入调用）。
+        多个会话应共享同一个知识库及其缓存，缓存只在 setup_knowledge_base() 重建索引时按索引键失效。
+        """
         self.knowledge_file_path = knowledge_file_path or "data/enterprise_knowledge_base.txt"
+        self.qa_llm = qa_llm or llm
+        self.embeddings = embeddings
+        self.splitter_settings = {"chunk_size": 1000, "chunk_overlap": 200, "separator": "\n"}
+        self.index_key = None
+        # 语义缓存绑定索引键，知识文件变化后重新设置知识库时自动清空；未传入时使用禁用的缓存
+        self.answer_cache = answer_cache if answer_cache is not None else SemanticAnswerCache(max_entries=0)
         self.vectorstore = None
         self.qa_chain = None
         self.setup_knowledge_base()
@@ -322,37 +743,30 @@ class EnterpriseKnowledgeBase:
             if not os.path.exists(self.knowledge_file_path):
                 self._create_enterprise_knowledge_file()
 
-            loader = TextLoader(self.knowledge_file_path, encoding='utf-8')
-            documents = loader.load()
-
-            text_splitter = CharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                separator="\n"
-            )
-            texts = text_splitter.split_documents(documents)
-
-            # 优先使用本地Ollama嵌入模型
-            embeddings = None
-
-            try:
-                embeddings = OllamaEmbeddings(
-                    model="quentinz/bge-large-zh-v1.5:latest"
-                )
-                print("✅ 使用 Ollama 嵌入模型")
-            except Exception as e:
-                print(f"❌ Ollama 嵌入模型不可用: {e}")
-                print("请确保:")
-                print("1. Ollama 服务正在运行")
-                print("2. 模型 'quentinz/bge-large-zh-v1.5:latest' 已下载")
-                print("3. 可以通过以下命令下载模型:")
-                print("   ollama pull quentinz/bge-large-zh-v1.5:latest")
+            # 优先使用传入的嵌入模型，其次是本地Ollama嵌入模型
+            embeddings = self.embeddings
+
+            if embeddings is None:
+                try:
+                    embeddings = OllamaEmbeddings(
+                        model="quentinz/bge-large-zh-v1.5:latest"
+                    )
+                    print("✅ 使用 Ollama 嵌入模型")
+                except Exception as e:
+                    print(f"❌ Ollama 嵌入模型不可用: {e}")
+                    print("请确保:")
+                    print("1. Ollama 服务正在运行")
+                    print("2. 模型 'quentinz/bge-large-zh-v1.5:latest' 已下载")
+                    print("3. 可以通过以下命令下载模型:")
+                    print("   ollama pull quentinz/bge-large-zh-v1.5:latest")
 
             if embeddings:
-                self.vectorstore = FAISS.from_documents(texts, embeddings)
+                self.vectorstore, self.index_key = load_or_build_vectorstore(
+                    self.knowledge_file_path, self.splitter_settings, embeddings)
+                self.answer_cache.bind(embeddings, self.index_key)
 
                 self.qa_chain = RetrievalQA.from_chain_type(
-                    llm=llm,
+                    llm=self.qa_llm,
                     chain_type="stuff",
                     retriever=self.vectorstore.as_retriever(search_kwargs={"k": 3}),
                     return_source_documents=True
@@ -482,36 +896,148 @@ class EnterpriseKnowledgeBase:
         print(f"✅ 已创建企业级知识库文件: {self.knowledge_file_path}")
 
     def query(self, question: str) -> str:
-        """查询知识库"""
+        """查询知识库，语义相近的问题直接返回缓存的答案"""
         if not self.qa_chain:
             return "抱歉，知识库暂时不可用。"
 
+        vector = self.answer_cache.embed(question)
+        cached = self.answer_cache.get(vector)
+        if cached is not None:
+            record_cache_hit("answer_cache")
+            return cached
+
         try:
-            result = self.qa_chain.invoke({"query": question})
-            return result["result"]
+            result = self.qa_chain.invoke({"query": question}, config=usage_config("retrieval_qa"))
+            answer = result["result"]
+            self.answer_cache.put(question, vector, answer)
+            return answer
         except Exception as e:
             print(f"知识库查询错误: {e}")
             return "抱歉，查询过程中出现了问题。"
 
+    async def aquery(self, question: str) -> str:
+        """异步查询知识库，语义相近的问题直接返回缓存的答案"""
+        if not self.qa_chain:
+            return "抱歉，知识库暂时不可用。"
+
+        vector = await self.answer_cache.aembed(question)
+        cached = self.answer_cache.get(vector)
+        if cached is not None:
+            record_cache_hit("answer_cache")
+            return cached
 
-class EnterpriseSalesGPT:
-    """企业级销售代理系统"""
+        try:
+            result = await self.qa_chain.ainvoke({"query": question}, config=usage_config("retrieval_qa"))
+            answer = result["result"]
+            self.answer_cache.put(question, vector, answer)
+            return answer
+        except Exception as e:
+            print(f"知识库查询错误: {e}")
+            return "抱歉，查询过程中出现了问题。"
+
+    def retrieve_context(self, question: str, k: int = 4, max_tokens: int = 800) -> str:
+        """只检索不生成：取出最相关的知识片段，去重、按相似度排序并截断到token预算"""
+        if not self.vectorstore:
+            return ""
+
+        try:
+            results = self.vectorstore.similarity_search_with_score(question, k=k)
+        except Exception as e:
+            print(f"知识库检索错误: {e}")
+            return ""
+        return self._format_retrieved_chunks(results, max_tokens)
+
+    async def aretrieve_context(self, question: str, k: int = 4, max_tokens: int = 800) -> str:
+        """异步检索知识片段"""
+        if not self.vectorstore:
+            return ""
 
-    def __init__(self, llm, customer_id: str = None, verbose=True):
-        """初始化企业级销售代理"""
+        try:
+            results = await self.vectorstore.asimilarity_search_with_score(question, k=k)
+        except Exception as e:
+            print(f"知识库检索错误: {e}")
+            return ""
+        return self._format_retrieved_chunks(results, max_tokens)
+
+    @staticmethod
+    def _format_retrieved_chunks(results, max_tokens: int) -> str:
+        """按相似度排序、去掉重复片段，并截断到token预算"""
+        chunks = []
+        seen = set()
+        used_tokens = 0
+
+        # FAISS 返回L2距离，数值越小越相似
+        for document, _ in sorted(results, key=lambda item: item[1]):
+            text = document.page_content.strip()
+            fingerprint = " ".join(text.split())
+            if not fingerprint or fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+
+            remaining = max_tokens - used_tokens
+            if remaining <= 0:
+                break
+            if estimate_tokens(text) > remaining:
+                text = truncate_to_tokens(text, remaining).rstrip()
+                if not text:
+                    break
+
+            chunks.append(text)
+            used_tokens += estimate_tokens(text)
+
+        return "\n\n".join(chunks)
+
+
+class EnterpriseSalesHost:
+    """多会话共享资源宿主
+
+    持有一份知识库、一组LLM链和一个客户库，为每个客户会话分发轻量级的
+    EnterpriseSalesGPT 实例。会话只保存对话状态，创建新会话不需要重新嵌入
+    知识库或重新创建LLM链。
+    """
+
+    def __init__(self, llm, verbose=True, knowledge_file_path: str = None,
+                 stage_classifier: Optional[LocalStageClassifier] = None, stage_label_log: str = None,
+                 interaction_store=None, rollup_granularities: Tuple[str, ...] = (),
+                 knowledge_mode: str = "qa", knowledge_token_budget: int = 800, embeddings=None,
+                 fact_index: Optional[ProductFactIndex] = None, history_token_budget: int = 2000,
+                 stage_mode: str = "separate", stage_policy: Optional[StageStickinessPolicy] = None,
+                 token_accountant: Optional[TokenAccountant] = None,
+                 answer_cache: Optional[SemanticAnswerCache] = None):
+        """初始化共享资源
+
+        knowledge_mode 为 "qa" 时用 RetrievalQA 生成知识摘要；为 "retrieval" 时
+        直接注入检索到的片段（不超过 knowledge_token_budget 个token），每轮少一次LLM调用。
+        fact_index 默认从 data/product_summary.json 加载。
+        history_token_budget 为每个会话提示词中对话历史的token预算。
+        stage_mode 为 "combined" 时一次LLM调用同时输出阶段和回复，省去单独的阶段分析调用。
+        stage_policy 为所有会话共享的阶段粘滞策略，客户消息没有转换信号时跳过阶段分析。
+        token_accountant 记录所有会话每轮的token用量和缓存命中，按会话和客户汇总。
+        answer_cache 为知识问答语义缓存（默认不启用），由共享知识库持有，所有会话共用。
+        """
+        if knowledge_mode not in ("qa", "retrieval"):
+            raise ValueError(f"不支持的知识检索模式: {knowledge_mode}")
+        if stage_mode not in ("separate", "combined"):
+            raise ValueError(f"不支持的阶段分析模式: {stage_mode}")
         self.llm = llm
         self.verbose = verbose
-        self.customer_id = customer_id
+        self.knowledge_mode = knowledge_mode
+        self.stage_mode = stage_mode
+        self.knowledge_token_budget = knowledge_token_budget
+        self.history_token_budget = history_token_budget
 
-        # 初始化各个组件
-        self.customer_manager = CustomerManager()
-        self.analytics = SalesAnalytics(self.customer_manager)
-        self.knowledge_base = EnterpriseKnowledgeBase()
+        # 可选的本地阶段分类器及LLM阶段样本日志
+        self.stage_classifier = stage_classifier
+        self.stage_label_log = stage_label_log
+        self.stage_policy = stage_policy
+        self.token_accountant = token_accountant
 
-        # 对话状态
-        self.conversation_history = []
-        self.current_stage = "1"
-        self.current_channel = InteractionChannel.CHAT
+        # 初始化各个组件
+        self.customer_manager = CustomerManager(interaction_store)
+        self.analytics = SalesAnalytics(self.customer_manager, rollup_granularities)
+        self.knowledge_base = EnterpriseKnowledgeBase(knowledge_file_path, qa_llm=llm, embeddings=embeddings,
+                                                     answer_cache=answer_cache)
+        self.fact_index = fact_index if fact_index is not None else ProductFactIndex.load()
 
         # 销售人员信息
         self.salesperson_info = {
@@ -523,17 +1049,21 @@ class EnterpriseSalesGPT:
             "specialization": "制造业、金融、零售行业数字化转型"
         }
 
+        # 提示词静态片段在这里渲染一次，之后修改 salesperson_info 不会生效
+        self.prompt_assembler = PromptAssembler(self.salesperson_info, SALES_STAGES)
+
         # 创建对话链
         self.conversation_chain = self._create_conversation_chain()
         self.stage_analyzer_chain = self._create_stage_analyzer_chain()
+        self.combined_chain = self._create_combined_chain()
+
+        # 会话ID -> 会话
+        self.sessions: Dict[str, "EnterpriseSalesGPT"] = {}
 
     def _create_conversation_chain(self):
         """创建企业级对话链"""
         prompt_template = """
-你是{name}，{role}，在{company}工作，拥有{experience}。
-专业领域：{specialization}
-
-公司业务：{company_business}
+{salesperson_block}
 
 当前客户信息：
 {customer_context}
@@ -555,16 +1085,19 @@ class EnterpriseSalesGPT:
 - 适时推进销售进程
 - 以 <END_OF_TURN> 结尾
 
-{name}：
+{salesperson_name}：
         """
 
         prompt = PromptTemplate(
             template=prompt_template,
             input_variables=[
-                "name", "role", "company", "company_business", "experience",
-                "specialization", "customer_context", "current_stage",
-                "stage_description", "knowledge_context", "conversation_history"
-            ]
+                "customer_context", "current_stage", "stage_description",
+                "knowledge_context", "conversation_history"
+            ],
+            partial_variables={
+                "salesperson_block": self.prompt_assembler.salesperson_block,
+                "salesperson_name": self.prompt_assembler.salesperson_name
+            }
         )
 
         return LLMChain(prompt=prompt, llm=self.llm, verbose=self.verbose)
@@ -578,130 +1111,493 @@ class EnterpriseSalesGPT:
 对话历史：{conversation_history}
 
 销售阶段选项：
-1. 介绍：通过介绍自己和公司来开始对话，建立信任关系
-2. 资格确认：确认客户是否是合适的潜在客户，了解决策权限
-3. 需求分析：深入了解客户的具体需求、痛点和期望
-4. 价值主张：展示产品/服务的独特价值和竞争优势
-5. 解决方案展示：根据客户需求展示具体的解决方案
-6. 异议处理：处理客户的疑虑、反对意见和担忧
-7. 成交推进：推进销售进程，提出具体的下一步行动
+{stage_options}
 
 只回答数字1-7：
         """
 
         prompt = PromptTemplate(
             template=prompt_template,
-            input_variables=["customer_context", "conversation_history"]
+            input_variables=["customer_context", "conversation_history"],
+            partial_variables={"stage_options": self.prompt_assembler.stage_table}
         )
 
         return LLMChain(prompt=prompt, llm=self.llm, verbose=False)
 
-    def get_customer_context(self) -> str:
-        """获取客户上下文信息"""
-        if not self.customer_id:
-            return "新客户，暂无档案信息"
+    def _create_combined_chain(self):
+        """创建阶段判断与回复合并输出的对话链"""
+        prompt_template = """
+{salesperson_block}
 
-        customer = self.customer_manager.get_customer(self.customer_id)
-        if not customer:
-            return "客户信息不存在"
-
-        context = f"""
-客户姓名：{customer.name}
-公司：{customer.company}
-职位：{customer.position}
-行业：{customer.industry}
-公司规模：{customer.company_size}
-预算范围：{customer.budget_range}
-痛点：{', '.join(customer.pain_points)}
-兴趣点：{', '.join(customer.interests)}
-当前状态：{customer.status.value}
+当前客户信息：
+{customer_context}
+
+上一轮销售阶段：{current_stage}
+阶段说明：{stage_description}
+
+销售阶段选项：
+{stage_options}
+
+相关产品知识：
+{knowledge_context}
+
+对话历史：
+{conversation_history}
+
+先根据客户信息和对话历史判断现在应该进入的销售阶段，再按该阶段生成专业回复：
+- 充分利用客户档案信息进行个性化沟通
+- 基于客户的行业和需求提供针对性建议
+- 利用知识库提供准确的产品信息
+- 保持专业、友好和有帮助的语调
+- 适时推进销售进程
+
+{output_instructions}
         """
-        return context.strip()
+
+        prompt = PromptTemplate(
+            template=prompt_template,
+            input_variables=[
+                "customer_context", "current_stage", "stage_description",
+                "knowledge_context", "conversation_history"
+            ],
+            partial_variables={
+                "salesperson_block": self.prompt_assembler.salesperson_block,
+                "stage_options": self.prompt_assembler.stage_table,
+                "output_instructions": COMBINED_OUTPUT_INSTRUCTIONS
+            }
+        )
+
+        return LLMChain(prompt=prompt, llm=self.llm, verbose=self.verbose)
+
+    def open_session(self, session_id: str = None, customer_id: str = None) -> "EnterpriseSalesGPT":
+        """创建会话，会话ID已存在时返回已有会话"""
+        session_id = session_id or uuid.uuid4().hex
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = EnterpriseSalesGPT(self.llm, customer_id=customer_id, host=self, session_id=session_id)
+            self.sessions[session_id] = session
+        return session
+
+    def get_session(self, session_id: str) -> Optional["EnterpriseSalesGPT"]:
+        """获取会话"""
+        return self.sessions.get(session_id)
+
+    def close_session(self, session_id: str):
+        """关闭会话，释放会话状态和该客户的档案片段缓存"""
+        session = self.sessions.pop(session_id, None)
+        if session is not None and session.customer_id:
+            self.prompt_assembler.forget_customer(session.customer_id)
+
+    def step(self, session_id: str, user_input: str = None,
+             channel: InteractionChannel = InteractionChannel.CHAT) -> str:
+        """在指定会话中执行一步对话"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"会话不存在: {session_id}")
+        return session.step(user_input, channel)
+
+    async def astep(self, session_id: str, user_input: str = None,
+                    channel: InteractionChannel = InteractionChannel.CHAT) -> str:
+        """在指定会话中异步执行一步对话"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"会话不存在: {session_id}")
+        return await session.astep(user_input, channel)
+
+    def stream_step(self, session_id: str, user_input: str = None,
+                    channel: InteractionChannel = InteractionChannel.CHAT) -> Iterator[str]:
+        """在指定会话中流式执行一步对话"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"会话不存在: {session_id}")
+        return session.stream_step(user_input, channel)
+
+
+class EnterpriseSalesGPT:
+    """企业级销售代理系统"""
+
+    def __init__(self, llm, customer_id: str = None, verbose=True,
+                 stage_classifier: Optional[LocalStageClassifier] = None, stage_label_log: str = None,
+                 host: Optional[EnterpriseSalesHost] = None, session_id: str = None,
+                 knowledge_mode: str = "qa", history_token_budget: int = 2000, stage_mode: str = "separate",
+                 stage_policy: Optional[StageStickinessPolicy] = None,
+                 token_accountant: Optional[TokenAccountant] = None):
+        """初始化企业级销售代理
+
+        传入 host 时共享宿主的知识库、LLM链、客户库、知识检索模式、历史预算、阶段分析模式、
+        阶段粘滞策略和token核算器，
+        只创建会话状态；否则创建一个仅供本代理使用的宿主。
+        """
+        if host is None:
+            host = EnterpriseSalesHost(llm, verbose, stage_classifier=stage_classifier,
+                                       stage_label_log=stage_label_log, knowledge_mode=knowledge_mode,
+                                       history_token_budget=history_token_budget, stage_mode=stage_mode,
+                                       stage_policy=stage_policy, token_accountant=token_accountant)
+        self.host = host
+        self.llm = host.llm
+        self.verbose = host.verbose
+        self.session_id = session_id
+        self.customer_id = customer_id
+
+        # 共享组件
+        self.customer_manager = host.customer_manager
+        self.analytics = host.analytics
+        self.knowledge_base = host.knowledge_base
+        self.fact_index = host.fact_index
+        self.salesperson_info = host.salesperson_info
+        self.prompt_assembler = host.prompt_assembler
+        self.conversation_chain = host.conversation_chain
+        self.stage_analyzer_chain = host.stage_analyzer_chain
+        self.combined_chain = host.combined_chain
+        self.stage_mode = host.stage_mode
+        self.stage_classifier = host.stage_classifier
+        self.stage_label_log = host.stage_label_log
+        self.stage_policy = host.stage_policy
+        self.token_accountant = host.token_accountant
+        self.knowledge_mode = host.knowledge_mode
+        self.knowledge_token_budget = host.knowledge_token_budget
+
+        # 对话状态
+        self.conversation_history = []
+        self.history_buffer = TokenBudgetHistory(host.history_token_budget, max_turns=10)
+        self.current_stage = "1"
+        self.current_channel = InteractionChannel.CHAT
+        # 本地分类器优先、LLM兜底的阶段判断和统计（每个会话独立统计）
+        self.local_first = LocalFirstStageAnalysis(SALES_STAGES, self.stage_classifier, self.stage_label_log)
+        self.stage_analysis_stats = self.local_first.stats
+        # 连续沿用上一轮阶段的轮数，以及是否已经分析过客户轮次（还没有时不沿用初始阶段）
+        self.sticky_turns = 0
+        self.stage_analyzed = False
+        self.fact_hits = 0
+
+    def get_customer_context(self) -> str:
+        """获取客户上下文信息，档案未变化时使用缓存的渲染结果"""
+        return self.prompt_assembler.customer_block(self.customer_manager, self.customer_id)
+
+    def _is_product_question(self, user_input: str) -> bool:
+        """检查用户输入是否包含产品相关关键词"""
+        product_keywords = ["产品", "解决方案", "价格", "功能", "服务", "技术", "系统", "平台"]
+        return any(keyword in user_input for keyword in product_keywords)
 
     def get_knowledge_context(self, user_input: str) -> str:
         """获取相关的产品知识"""
         if not user_input:
             return ""
 
-        # 检查用户输入是否包含产品相关关键词
-        product_keywords = ["产品", "解决方案", "价格", "功能", "服务", "技术", "系统", "平台"]
-
-        if any(keyword in user_input for keyword in product_keywords):
+        # 价格、续航等结构化事实直接回答，不再进行向量检索
+        facts = self.fact_index.answer(user_input)
+        if facts:
+            self.fact_hits += 1
+            record_cache_hit("product_facts")
+            return f"产品参数：{facts}"
+
+        if self._is_product_question(user_input):
+            if self.knowledge_mode == "retrieval":
+                # 直接注入检索到的片段，省去RetrievalQA内部的一次LLM生成
+                knowledge = self.knowledge_base.retrieve_context(user_input, max_tokens=self.knowledge_token_budget)
+                return f"相关产品信息：\n{knowledge}" if knowledge else ""
             knowledge = self.knowledge_base.query(user_input)
             return f"相关产品信息：{knowledge}"
 
         return ""
 
-    def analyze_stage(self, conversation_history: str) -> str:
-        """分析当前对话阶段"""
+    async def aget_knowledge_context(self, user_input: str) -> str:
+        """异步获取相关的产品知识"""
+        if not user_input:
+            return ""
+
+        # 价格、续航等结构化事实直接回答，不再进行向量检索
+        facts = self.fact_index.answer(user_input)
+        if facts:
+            self.fact_hits += 1
+            record_cache_hit("product_facts")
+            return f"产品参数：{facts}"
+
+        if self._is_product_question(user_input):
+            if self.knowledge_mode == "retrieval":
+                knowledge = await self.knowledge_base.aretrieve_context(
+                    user_input, max_tokens=self.knowledge_token_budget)
+                return f"相关产品信息：\n{knowledge}" if knowledge else ""
+            knowledge = await self.knowledge_base.aquery(user_input)
+            return f"相关产品信息：{knowledge}"
+
+        return ""
+
+    def _reuse_previous_stage(self, user_input: Optional[str]) -> bool:
+        """按阶段粘滞策略判断本轮能否沿用当前阶段、跳过阶段分析"""
+        if self.stage_policy is None:
+            return False
+        if self.stage_policy.should_reuse(user_input, self.sticky_turns, self.stage_analyzed):
+            self.sticky_turns += 1
+            self.stage_analysis_stats["sticky"] += 1
+            record_cache_hit("stage_sticky")
+            return True
+        self.sticky_turns = 0
+        if user_input:
+            self.stage_analyzed = True
+        return False
+
+    def analyze_stage(self, conversation_history: str, customer_context: str = None, user_input: str = None) -> str:
+        """分析当前对话阶段，customer_context 为本轮已渲染的客户档案，user_input 用于阶段粘滞判断"""
+        if self._reuse_previous_stage(user_input):
+            return self.current_stage
+
+        # 本地分类器足够自信时，不再调用LLM
+        local_stage = self.local_first.classify(conversation_history)
+        if local_stage:
+            return local_stage
+
         try:
-            customer_context = self.get_customer_context()
+            customer_context = customer_context or self.get_customer_context()
             result = self.stage_analyzer_chain.invoke({
                 "customer_context": customer_context,
                 "conversation_history": conversation_history
-            })
+            }, config=usage_config("stage_analysis"))
             stage = result.get("text", "1").strip()
-            return stage if stage in SALES_STAGES else "1"
         except Exception as e:
             print(f"阶段分析错误: {e}")
-            return "1"
+            stage = None
 
-    def step(self, user_input: str = None, channel: InteractionChannel = InteractionChannel.CHAT) -> str:
-        """执行一步对话"""
+        # 每次LLM调用都计数；无效输出或调用失败时返回介绍阶段
+        self.local_first.record_llm_stage(conversation_history, stage)
+        return stage if stage in SALES_STAGES else "1"
+
+    async def aanalyze_stage(self, conversation_history: str, customer_context: str = None,
+                             user_input: str = None) -> str:
+        """异步分析当前对话阶段，customer_context 为本轮已渲染的客户档案，user_input 用于阶段粘滞判断"""
+        if self._reuse_previous_stage(user_input):
+            return self.current_stage
+
+        local_stage = self.local_first.classify(conversation_history)
+        if local_stage:
+            return local_stage
+
+        try:
+            customer_context = customer_context or self.get_customer_context()
+            result = await self.stage_analyzer_chain.ainvoke({
+                "customer_context": customer_context,
+                "conversation_history": conversation_history
+            }, config=usage_config("stage_analysis"))
+            stage = result.get("text", "1").strip()
+        except Exception as e:
+            print(f"阶段分析错误: {e}")
+            stage = None
+
+        # 每次LLM调用都计数；无效输出或调用失败时返回介绍阶段
+        self.local_first.record_llm_stage(conversation_history, stage)
+        return stage if stage in SALES_STAGES else "1"
+
+    async def _aanalyze_current_stage(self, history_str: str, customer_context: str = None,
+                                      user_input: str = None) -> str:
+        """异步分析当前阶段，尚无对话历史时保持当前阶段"""
+        if len(self.conversation_history) > 0:
+            return await self.aanalyze_stage(history_str, customer_context, user_input)
+        return self.current_stage
+
+    def _append_history(self, entry: str):
+        """记录一轮对话：完整记录保存在 conversation_history，提示词使用按token预算维护的历史窗口"""
+        self.conversation_history.append(entry)
+        self.history_buffer.append(entry)
+
+    def _record_user_input(self, user_input: str, channel: InteractionChannel) -> str:
+        """记录用户输入，返回本轮使用的对话历史"""
         self.current_channel = channel
 
-        # 获取知识上下文
-        knowledge_context = ""
         if user_input:
-            knowledge_context = self.get_knowledge_context(user_input)
-            self.conversation_history.append(f"客户：{user_input}<END_OF_TURN>")
+            self._append_history(f"客户：{user_input}<END_OF_TURN>")
 
         # 构建对话历史
-        history_str = "".join(self.conversation_history[-10:])
+        history_str = self.history_buffer.render()
         if not history_str:
             history_str = "对话开始"
+        return history_str
 
-        # 分析当前阶段
-        if len(self.conversation_history) > 0:
-            self.current_stage = self.analyze_stage(history_str)
+    def _build_turn_inputs(self, knowledge_context: str, history_str: str, customer_context: str) -> Dict[str, Any]:
+        """构建本轮提示变量（销售人员信息等静态片段已作为提示模板的 partial_variables）"""
+        return {
+            "customer_context": customer_context,
+            "current_stage": self.current_stage,
+            "stage_description": SALES_STAGES[self.current_stage],
+            "knowledge_context": knowledge_context,
+            "conversation_history": history_str
+        }
 
-        # 获取客户上下文
+    def _prepare_turn(self, user_input: str, channel: InteractionChannel) -> Dict[str, Any]:
+        """检索知识、记录用户输入、分析阶段，并构建本轮提示变量"""
+        knowledge_context = self.get_knowledge_context(user_input)
+        history_str = self._record_user_input(user_input, channel)
+        # 客户档案每轮只取一次，阶段分析和回复生成共用
         customer_context = self.get_customer_context()
 
-        # 生成回复
-        try:
-            result = self.conversation_chain.invoke({
-                **self.salesperson_info,
-                "customer_context": customer_context,
-                "current_stage": self.current_stage,
-                "stage_description": SALES_STAGES[self.current_stage],
-                "knowledge_context": knowledge_context,
-                "conversation_history": history_str
-            })
-
-            response = result.get("text", "").strip()
-            self.conversation_history.append(f"{self.salesperson_info['name']}：{response}<END_OF_TURN>")
-
-            # 记录交互
-            if self.customer_id and user_input:
-                interaction = SalesInteraction(
-                    interaction_id=f"INT_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                    customer_id=self.customer_id,
-                    timestamp=datetime.datetime.now().isoformat(),
-                    channel=channel,
-                    stage=self.current_stage,
-                    content=user_input,
-                    outcome=response,
-                    next_action="继续跟进",
-                    salesperson=self.salesperson_info["name"]
-                )
-                self.customer_manager.add_interaction(interaction)
+        # 分析当前阶段（合并模式下阶段随回复一起生成）
+        if len(self.conversation_history) > 0 and self.stage_mode != "combined":
+            self.current_stage = self.analyze_stage(history_str, customer_context, user_input)
 
-            return response
+        return self._build_turn_inputs(knowledge_context, history_str, customer_context)
 
-        except Exception as e:
-            print(f"生成回复时出错: {e}")
-            return "抱歉，我遇到了技术问题，请稍后再试。"
+    async def _aprepare_turn(self, user_input: str, channel: InteractionChannel) -> Dict[str, Any]:
+        """异步准备本轮对话，知识检索和阶段分析并发执行"""
+        history_str = self._record_user_input(user_input, channel)
+        customer_context = self.get_customer_context()
+        if self.stage_mode == "combined":
+            knowledge_context = await self.aget_knowledge_context(user_input)
+        else:
+            knowledge_context, self.current_stage = await asyncio.gather(
+                self.aget_knowledge_context(user_input),
+                self._aanalyze_current_stage(history_str, customer_context, user_input)
+            )
+        return self._build_turn_inputs(knowledge_context, history_str, customer_context)
+
+    def _reply_chain(self):
+        """当前模式使用的回复生成链"""
+        return self.combined_chain if self.stage_mode == "combined" else self.conversation_chain
+
+    def _new_reply_parser(self) -> Optional[CombinedReplyParser]:
+        """合并模式下用于流式解析阶段行的解析器"""
+        if self.stage_mode != "combined":
+            return None
+        return CombinedReplyParser(SALES_STAGES, self.current_stage)
+
+    def _apply_stage(self, stage: str, from_model: bool, history_str: str):
+        """采用合并输出中的阶段；阶段无效时保持上一轮阶段（仍计为一次LLM阶段判断）"""
+        self.current_stage = stage
+        self.local_first.record_llm_stage(history_str, stage if from_model else None)
+
+    def _usage_turn(self):
+        """本轮LLM调用的token核算范围，按会话和客户归属，未配置核算器时不做记录"""
+        if self.token_accountant is None:
+            return nullcontext()
+        return self.token_accountant.turn(self.session_id, self.customer_id)
+
+    def _usage_stream_turn(self):
+        """流式生成器的核算范围：不在 yield 期间保持当前轮次，由 use_turn() 在准备阶段激活"""
+        if self.token_accountant is None:
+            return nullcontext()
+        return self.token_accountant.stream_turn(self.session_id, self.customer_id)
+
+    def _finish_turn(self, user_input: str, response: str, channel: InteractionChannel):
+        """把回复添加到历史记录，并记录交互"""
+        self._append_history(f"{self.salesperson_info['name']}：{response}<END_OF_TURN>")
+
+        # 记录交互
+        if self.customer_id and user_input:
+            interaction = SalesInteraction(
+                interaction_id=f"INT_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                customer_id=self.customer_id,
+                timestamp=datetime.datetime.now().isoformat(),
+                channel=channel,
+                stage=self.current_stage,
+                content=user_input,
+                outcome=response,
+                next_action="继续跟进",
+                salesperson=self.salesperson_info["name"]
+            )
+            self.customer_manager.add_interaction(interaction)
+
+    def step(self, user_input: str = None, channel: InteractionChannel = InteractionChannel.CHAT) -> str:
+        """执行一步对话"""
+        with self._usage_turn():
+            inputs = self._prepare_turn(user_input, channel)
+
+            # 生成回复
+            try:
+                result = self._reply_chain().invoke(inputs, config=usage_config("conversation"))
+
+                response = result.get("text", "").strip()
+                if self.stage_mode == "combined":
+                    stage, response, from_model = parse_combined_output(response, SALES_STAGES, self.current_stage)
+                    self._apply_stage(stage, from_model, inputs["conversation_history"])
+                self._finish_turn(user_input, response, channel)
+
+                return response
+
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                return FALLBACK_REPLY
+
+    async def astep(self, user_input: str = None, channel: InteractionChannel = InteractionChannel.CHAT) -> str:
+        """异步执行一步对话，知识检索和阶段分析并发执行"""
+        with self._usage_turn():
+            inputs = await self._aprepare_turn(user_input, channel)
+
+            try:
+                result = await self._reply_chain().ainvoke(inputs, config=usage_config("conversation"))
+
+                response = result.get("text", "").strip()
+                if self.stage_mode == "combined":
+                    stage, response, from_model = parse_combined_output(response, SALES_STAGES, self.current_stage)
+                    self._apply_stage(stage, from_model, inputs["conversation_history"])
+                self._finish_turn(user_input, response, channel)
+
+                return response
+
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                return FALLBACK_REPLY
+
+    def stream_step(self, user_input: str = None,
+                    channel: InteractionChannel = InteractionChannel.CHAT) -> Iterator[str]:
+        """流式执行一步对话，逐段产出回复，遇到 <END_OF_TURN> 立即停止生成"""
+        with self._usage_stream_turn() as usage, rollback_on_abort(self.conversation_history, self.history_buffer):
+            with use_turn(usage):
+                inputs = self._prepare_turn(user_input, channel)
+                prompt = self._reply_chain().prompt.format_prompt(**inputs)
+                parser = self._new_reply_parser()
+                config = usage_config("conversation")
+
+            chunks = []
+            try:
+                for text in stream_until_end_of_turn(self.llm, prompt, config=config):
+                    if parser:
+                        text = parser.feed(text)
+                    if not text:
+                        continue
+                    chunks.append(text)
+                    yield text
+                if parser:
+                    text = parser.flush()
+                    if text:
+                        chunks.append(text)
+                        yield text
+                    self._apply_stage(parser.stage, parser.stage_from_model, inputs["conversation_history"])
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield FALLBACK_REPLY
+                return
+
+            self._finish_turn(user_input, "".join(chunks).strip(), channel)
+
+    async def astream_step(self, user_input: str = None,
+                           channel: InteractionChannel = InteractionChannel.CHAT) -> AsyncIterator[str]:
+        """异步流式执行一步对话，知识检索和阶段分析并发执行"""
+        with self._usage_stream_turn() as usage, rollback_on_abort(self.conversation_history, self.history_buffer):
+            with use_turn(usage):
+                inputs = await self._aprepare_turn(user_input, channel)
+                prompt = self._reply_chain().prompt.format_prompt(**inputs)
+                parser = self._new_reply_parser()
+                config = usage_config("conversation")
+
+            chunks = []
+            try:
+                async for text in astream_until_end_of_turn(self.llm, prompt, config=config):
+                    if parser:
+                        text = parser.feed(text)
+                    if not text:
+                        continue
+                    chunks.append(text)
+                    yield text
+                if parser:
+                    text = parser.flush()
+                    if text:
+                        chunks.append(text)
+                        yield text
+                    self._apply_stage(parser.stage, parser.stage_from_model, inputs["conversation_history"])
+            except Exception as e:
+                print(f"生成回复时出错: {e}")
+                yield FALLBACK_REPLY
+                return
+
+            self._finish_turn(user_input, "".join(chunks).strip(), channel)
 
     def get_comprehensive_summary(self) -> Dict[str, Any]:
         """获取全面的对话摘要"""
@@ -710,8 +1606,18 @@ class EnterpriseSalesGPT:
                 "current_stage": self.current_stage,
                 "stage_description": SALES_STAGES[self.current_stage],
                 "conversation_turns": len(self.conversation_history),
-                "channel": self.current_channel.value
+                "channel": self.current_channel.value,
+                "knowledge_mode": self.knowledge_mode,
+                "stage_mode": self.stage_mode,
+                "fact_hits": self.fact_hits,
+                "answer_cache": self.knowledge_base.answer_cache.stats(),
+                "history_tokens": self.history_buffer.token_count,
+                "history_token_budget": self.history_buffer.max_tokens,
+                "stage_analysis": dict(self.stage_analysis_stats),
+                "stage_policy": self.stage_policy.summary() if self.stage_policy else None,
+                "prompt_cache": dict(self.prompt_assembler.stats)
             },
+            "token_usage": {},
             "salesperson_info": self.salesperson_info,
             "customer_info": {},
             "analytics": {}
@@ -724,6 +1630,11 @@ class EnterpriseSalesGPT:
         sales_summary = self.analytics.get_sales_summary()
         summary["analytics"] = sales_summary
 
+        if self.token_accountant:
+            summary["token_usage"]["session"] = self.token_accountant.session_summary(self.session_id or "default")
+            if self.customer_id:
+                summary["token_usage"]["customer"] = self.token_accountant.customer_summary(self.customer_id)
+
         return summary
 
     def save_session(self):
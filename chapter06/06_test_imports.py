@@ -102,6 +102,113 @@ def test_version_5():
         print(f"❌ v5.0 企业版 - 导入失败: {e}")
         return False
 
+def load_enterprise_module():
+    """按文件路径加载 v5.0 企业版模块（只创建客户端，所有调用都由桩模型完成）"""
+    import importlib.util
+
+    os.environ.setdefault("OPENAI_API_KEY", "stub-placeholder")
+    spec = importlib.util.spec_from_file_location("enterprise_salesGPT", "05_enterprise_salesGPT.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_token_attribution():
+    """检查流式回复暂停期间，其他会话的LLM调用不会记到暂停的轮次上（使用桩模型，不发起网络请求）"""
+    try:
+        import asyncio
+        import tempfile
+
+        from stub_llm import StubChatModel, create_stub_embeddings
+        from token_accounting import TokenAccountant
+
+        enterprise_module = load_enterprise_module()
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            accountant = TokenAccountant()
+            host = enterprise_module.EnterpriseSalesHost(
+                StubChatModel(latency=0), verbose=False, embeddings=create_stub_embeddings(),
+                knowledge_file_path=os.path.join(work_dir, "knowledge_base.txt"), token_accountant=accountant)
+            message = "你们的产品价格是多少？"
+
+            # 同步：A 的流式回复停在第一个片段时，B 完成一整轮
+            session_a, session_b = host.open_session("A"), host.open_session("B")
+            replies = session_a.stream_step(message)
+            next(replies)
+            session_b.step(message)
+            for _ in replies:
+                pass
+
+            # 异步：同一个任务中交错执行 C 的流式回复和 D 的一轮
+            async def interleave():
+                replies = host.open_session("C").astream_step(message)
+                await replies.__anext__()
+                await host.open_session("D").astep(message)
+                async for _ in replies:
+                    pass
+            asyncio.run(interleave())
+
+            usage = {session_id: accountant.session_summary(session_id) for session_id in "ABCD"}
+
+        for first, second in (("A", "B"), ("C", "D")):
+            if usage[first]["turns"] != 1 or usage[second]["turns"] != 1:
+                raise AssertionError(f"轮次数不正确: {first}={usage[first]['turns']}, {second}={usage[second]['turns']}")
+            if usage[first]["llm_calls"] != usage[second]["llm_calls"]:
+                raise AssertionError(f"LLM调用归属错误: {first}={usage[first]['by_label']}, "
+                                     f"{second}={usage[second]['by_label']}")
+        print("✅ token核算 - 交错的会话各自记账")
+        return True
+    except Exception as e:
+        print(f"❌ token核算 - 检查失败: {e}")
+        return False
+
+def test_stream_rollback():
+    """检查流式回复被提前关闭时撤销本轮客户输入，不留下没有回复的客户发言（使用桩模型）"""
+    try:
+        import asyncio
+        import tempfile
+
+        from stub_llm import StubChatModel, create_stub_embeddings
+
+        enterprise_module = load_enterprise_module()
+        with tempfile.TemporaryDirectory() as work_dir:
+            host = enterprise_module.EnterpriseSalesHost(
+                StubChatModel(latency=0), verbose=False, embeddings=create_stub_embeddings(),
+                knowledge_file_path=os.path.join(work_dir, "knowledge_base.txt"))
+            session = host.open_session("A", customer_id="CUST001")
+            session.step("你好，我想了解一下你们的产品")
+
+            def snapshot():
+                return (list(session.conversation_history), session.history_buffer.render(),
+                        len(host.customer_manager.get_customer_interactions("CUST001")))
+            before = snapshot()
+
+            # 同步：取到第一个片段后关闭生成器
+            replies = session.stream_step("你们的产品价格是多少？")
+            next(replies)
+            replies.close()
+            if snapshot() != before:
+                raise AssertionError("stream_step 提前关闭后对话历史或交互记录发生变化")
+
+            # 异步：与 sales_service.py 的 aclosing 相同，取到第一个片段后 aclose()
+            async def abort():
+                replies = session.astream_step("你们的产品价格是多少？")
+                await replies.__anext__()
+                await replies.aclose()
+            asyncio.run(abort())
+            if snapshot() != before:
+                raise AssertionError("astream_step 提前关闭后对话历史或交互记录发生变化")
+
+            # 完整消费时正常记录客户输入和回复
+            for _ in session.stream_step("你们的产品价格是多少？"):
+                pass
+            if len(session.conversation_history) != len(before[0]) + 2:
+                raise AssertionError("完整的流式回复没有记录到对话历史")
+        print("✅ 流式回复 - 提前关闭时撤销本轮客户输入")
+        return True
+    except Exception as e:
+        print(f"❌ 流式回复 - 检查失败: {e}")
+        return False
+
 def check_dependencies():
     """检查依赖"""
     print("🔍 检查依赖包...")
@@ -172,6 +279,8 @@ def main():
     results.append(("v3.0 知识库版", test_version_3()))
     results.append(("v4.0 RAG增强版", test_version_4()))
     results.append(("v5.0 企业版", test_version_5()))
+    results.append(("token核算会话归属", test_token_attribution()))
+    results.append(("流式回复提前关闭", test_stream_rollback()))
     
     # 汇总结果
     print("\n📊 测试结果汇总:")
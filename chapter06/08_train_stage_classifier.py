@@ -0,0 +1,150 @@
+"""
+本地阶段分类器训练脚本
+====================
+
+为 SalesGPT v2.0 - v5.0 训练本地阶段分类器（见 stage_classifier.py），
+用它替代每轮对话中专门用于判断阶段的LLM调用：
+
+1. harvest：用现有的LLM阶段分析器回放脚本化对话，
+   把每轮的 (对话历史, 阶段) 追加到JSONL样本日志
+2. train：读取样本日志，训练字符 n-gram TF-IDF + 逻辑回归模型，
+   在留出集上评估不同置信度阈值的覆盖率和准确率，然后导出模型
+
+线上运行时也可以给各版本的SalesGPT传入 stage_label_log 参数持续积累样本。
+
+运行方式：
+python 08_train_stage_classifier.py harvest --version 02 --rounds 3
+python 08_train_stage_classifier.py train --threshold 0.6
+
+使用导出的模型：
+classifier = LocalStageClassifier.load("data/stage_classifier.pkl")
+sales_agent = EnhancedSalesGPT(llm, stage_classifier=classifier)
+
+依赖要求：
+pip install scikit-learn
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import warnings
+
+# 添加当前目录到Python路径
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from sales_scenarios import load_scripted_conversations
+from stage_classifier import LocalStageClassifier, load_training_samples
+
+# 过滤警告
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+DEFAULT_LOG_PATH = os.path.join(SCRIPT_DIR, "data", "stage_samples.jsonl")
+DEFAULT_MODEL_PATH = os.path.join(SCRIPT_DIR, "data", "stage_classifier.pkl")
+
+# 版本号 -> (文件名, 代理类名)
+VERSIONS = {
+    "02": ("02_enhanced_conversation_salesGPT.py", "EnhancedSalesGPT"),
+    "03": ("03_knowledge_based_salesGPT.py", "KnowledgeBasedSalesGPT"),
+    "04": ("04_rag_enhanced_salesGPT.py", "RAGEnhancedSalesGPT"),
+    "05": ("05_enterprise_salesGPT.py", "EnterpriseSalesGPT")
+}
+
+
+def load_version_module(version: str):
+    """按文件路径加载指定版本的SalesGPT模块"""
+    file_name, _ = VERSIONS[version]
+    spec = importlib.util.spec_from_file_location(f"salesgpt_v{version}", os.path.join(SCRIPT_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def harvest(version: str, log_path: str, rounds: int):
+    """用LLM阶段分析器回放脚本化对话，采集阶段样本"""
+    module = load_version_module(version)
+    _, class_name = VERSIONS[version]
+    agent_class = getattr(module, class_name)
+    conversations = load_scripted_conversations()
+
+    print(f"使用 v{version} 的LLM阶段分析器采集样本，共 {len(conversations)} 个场景 × {rounds} 轮")
+
+    for round_index in range(rounds):
+        for conversation in conversations:
+            if version == "05":
+                agent = agent_class(module.llm, customer_id="CUST001", verbose=False, stage_label_log=log_path)
+            else:
+                agent = agent_class(module.llm, verbose=False, stage_label_log=log_path)
+
+            agent.step()
+            for customer_input in conversation["turns"]:
+                agent.step(customer_input)
+
+            print(f"  第{round_index + 1}轮 - {conversation['scenario_id']} ✅")
+
+    print(f"\n✅ 样本已追加到: {log_path}")
+
+
+def train(log_path: str, model_path: str, threshold: float, test_ratio: float):
+    """训练、评估并导出本地阶段分类器"""
+    samples = load_training_samples(log_path)
+    print(f"读取样本 {len(samples)} 条")
+
+    # 留出一部分样本评估置信度阈值的效果
+    shuffled = samples[:]
+    random.Random(42).shuffle(shuffled)
+    test_size = int(len(shuffled) * test_ratio)
+    if test_size > 0 and len(shuffled) - test_size >= 2:
+        train_samples, test_samples = shuffled[test_size:], shuffled[:test_size]
+        classifier = LocalStageClassifier(confidence_threshold=threshold).train(train_samples)
+
+        print("\n留出集评估:")
+        print(f"{'阈值':>6} | {'覆盖率':>8} | {'覆盖部分准确率':>12}")
+        for candidate in (0.4, 0.5, 0.6, 0.7, 0.8, 0.9):
+            covered = correct = 0
+            for history, stage in test_samples:
+                predicted, confidence = classifier.predict(history)
+                if confidence >= candidate:
+                    covered += 1
+                    correct += predicted == stage
+            coverage = covered / len(test_samples)
+            accuracy = correct / covered if covered else 0.0
+            print(f"{candidate:>6.1f} | {coverage:>8.1%} | {accuracy:>12.1%}")
+
+    # 使用全部样本训练最终模型
+    classifier = LocalStageClassifier(confidence_threshold=threshold).train(samples)
+    classifier.save(model_path)
+    print(f"\n✅ 模型已导出: {model_path}（置信度阈值 {threshold}）")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="训练本地销售阶段分类器")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    harvest_parser = subparsers.add_parser("harvest", help="用LLM阶段分析器采集样本")
+    harvest_parser.add_argument("--version", choices=sorted(VERSIONS), default="02")
+    harvest_parser.add_argument("--log", default=DEFAULT_LOG_PATH)
+    harvest_parser.add_argument("--rounds", type=int, default=1)
+
+    train_parser = subparsers.add_parser("train", help="训练并导出分类器")
+    train_parser.add_argument("--log", default=DEFAULT_LOG_PATH)
+    train_parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    train_parser.add_argument("--threshold", type=float, default=0.6)
+    train_parser.add_argument("--test-ratio", type=float, default=0.2)
+
+    args = parser.parse_args()
+
+    if args.command == "harvest":
+        harvest(args.version, args.log, args.rounds)
+    else:
+        train(args.log, args.model, args.threshold, args.test_ratio)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n训练被用户中断")
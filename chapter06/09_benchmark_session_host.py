@@ -0,0 +1,104 @@
+"""
+企业版多会话宿主基准测试
+======================
+
+对比两种为新客户开启会话的方式：
+1. 每个会话单独创建 EnterpriseSalesGPT（各自创建客户库、知识库和LLM链）
+2. 通过 EnterpriseSalesHost 共享资源，每个会话只创建对话状态
+
+统计每个会话的创建耗时和空闲会话的内存占用。基准不发起任何LLM调用。
+
+运行方式：
+python 09_benchmark_session_host.py --sessions 10000
+
+作者：AI助手
+日期：2024年
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+from contextlib import redirect_stdout
+from io import StringIO
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+# 过滤警告
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+# 基准不调用LLM，没有配置API密钥时使用占位值即可加载模块
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-placeholder")
+
+
+def load_enterprise_module():
+    """按文件路径加载企业版模块"""
+    spec = importlib.util.spec_from_file_location(
+        "enterprise_salesGPT", os.path.join(SCRIPT_DIR, "05_enterprise_salesGPT.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def benchmark_standalone(module, count: int) -> float:
+    """每个会话单独创建代理，返回平均耗时（秒）"""
+    start = time.perf_counter()
+    with redirect_stdout(StringIO()):
+        for _ in range(count):
+            module.EnterpriseSalesGPT(module.llm, customer_id="CUST001", verbose=False)
+    return (time.perf_counter() - start) / count
+
+
+def benchmark_host(module, host, count: int):
+    """通过宿主开启会话，返回 (平均耗时秒, 每会话内存字节)"""
+    customer_ids = ["CUST001", "CUST002", None]
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    for i in range(count):
+        host.open_session(f"session_{i}", customer_ids[i % len(customer_ids)])
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed / count, (current - baseline) / count
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="企业版多会话宿主基准测试")
+    parser.add_argument("--sessions", type=int, default=10000, help="通过宿主开启的会话数")
+    parser.add_argument("--standalone", type=int, default=3, help="单独创建代理的次数")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("企业版多会话宿主基准测试")
+    print("=" * 60)
+
+    with redirect_stdout(StringIO()):
+        module = load_enterprise_module()
+
+    standalone_seconds = benchmark_standalone(module, args.standalone)
+    print(f"\n单独创建代理: {standalone_seconds * 1000:.1f} ms/会话（{args.standalone} 次平均）")
+
+    host_start = time.perf_counter()
+    with redirect_stdout(StringIO()):
+        host = module.EnterpriseSalesHost(module.llm, verbose=False)
+    print(f"创建共享宿主: {(time.perf_counter() - host_start) * 1000:.1f} ms（一次性）")
+
+    per_session_seconds, per_session_bytes = benchmark_host(module, host, args.sessions)
+    print(f"宿主开启会话: {per_session_seconds * 1e6:.1f} µs/会话（{args.sessions} 个会话）")
+    print(f"空闲会话内存: {per_session_bytes / 1024:.2f} KB/会话")
+    print(f"当前会话数: {len(host.sessions)}")
+
+    if per_session_seconds > 0:
+        print(f"\n🎯 会话创建加速: {standalone_seconds / per_session_seconds:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
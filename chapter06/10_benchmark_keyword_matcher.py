@@ -0,0 +1,159 @@
+"""
+知识库关键词匹配基准测试
+======================
+
+对比 SimpleKnowledgeBase（v3.0）的两种关键词匹配方式：
+1. 原始实现：对每个产品、每个信息类型逐一执行 any(keyword in query ...)
+2. 关键词匹配器：关键词表编译成 Aho-Corasick 自动机，每次查询只扫描一遍
+
+使用随机生成的数千个关键词和产品模拟大规模产品目录，并校验两种方式命中的
+产品和信息类型完全一致。基准不发起任何LLM调用。
+
+运行方式：
+python 10_benchmark_keyword_matcher.py --products 2000 --info-types 300 --queries 2000
+
+作者：AI助手
+日期：2024年
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+import warnings
+from contextlib import redirect_stdout
+from io import StringIO
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+# 过滤警告
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+# 基准不调用LLM，没有配置API密钥时使用占位值即可加载模块
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-placeholder")
+
+# 合成关键词使用的字符
+CHAR_POOL = "智能数据分析平台系统服务客户管理办公自动化流程报表预测机器人问答营销销售财务人力供应链仓储物流安全云端边缘设备"
+
+
+def load_knowledge_module():
+    """按文件路径加载知识库版模块"""
+    spec = importlib.util.spec_from_file_location(
+        "knowledge_based_salesGPT", os.path.join(SCRIPT_DIR, "03_knowledge_based_salesGPT.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_keyword(rng: random.Random) -> str:
+    """生成2-4个字的随机关键词"""
+    return "".join(rng.choice(CHAR_POOL) for _ in range(rng.randint(2, 4)))
+
+
+def build_synthetic_catalogue(rng: random.Random, product_count: int, info_type_count: int, keywords_per_entry: int):
+    """生成合成的知识数据、信息类型关键词和产品关键词"""
+    info_types = [f"信息类型{i}" for i in range(info_type_count)]
+    keyword_mapping = {info_type: [random_keyword(rng) for _ in range(keywords_per_entry)] for info_type in info_types}
+
+    product_keywords = {}
+    product_info = {}
+    for i in range(product_count):
+        product = f"产品{i}"
+        product_keywords[product] = [random_keyword(rng) for _ in range(keywords_per_entry)]
+        # 每个产品只提供部分信息类型
+        product_info[product] = {info_type: f"{product}的{info_type}说明" for info_type in rng.sample(info_types, 5)}
+
+    knowledge_data = {
+        "产品信息": product_info,
+        "服务信息": {info_type: f"{info_type}服务说明" for info_type in info_types[:info_type_count // 4]},
+        "公司优势": {info_type: f"{info_type}优势说明" for info_type in info_types[-(info_type_count // 4):]}
+    }
+    return knowledge_data, keyword_mapping, product_keywords
+
+
+def build_queries(rng: random.Random, keyword_mapping, product_keywords, count: int):
+    """生成包含若干关键词和随机字符的查询"""
+    all_keywords = [keyword for keywords in keyword_mapping.values() for keyword in keywords]
+    all_keywords += [keyword for keywords in product_keywords.values() for keyword in keywords]
+    queries = []
+    for _ in range(count):
+        parts = [random_keyword(rng) for _ in range(rng.randint(3, 8))]
+        parts += rng.sample(all_keywords, rng.randint(0, 3))
+        rng.shuffle(parts)
+        queries.append("，".join(parts))
+    return queries
+
+
+def naive_hits(knowledge_base, query: str):
+    """原始实现的匹配方式，返回 (命中产品集合, 命中信息类型集合)"""
+    query_lower = query.lower()
+    products = {product for product, keywords in knowledge_base.product_keywords.items()
+                if any(keyword.lower() in query_lower for keyword in keywords)}
+    info_types = {info_type for info_type, keywords in knowledge_base.keyword_mapping.items()
+                  if any(keyword.lower() in query_lower for keyword in keywords)}
+    return products, info_types
+
+
+def matcher_hits(knowledge_base, query: str):
+    """关键词匹配器的匹配方式，返回 (命中产品集合, 命中信息类型集合)"""
+    return set(knowledge_base.product_matcher.match(query)), set(knowledge_base.info_type_matcher.match(query))
+
+
+def time_per_query(function, knowledge_base, queries) -> float:
+    """返回每次查询的平均耗时（秒）"""
+    start = time.perf_counter()
+    for query in queries:
+        function(knowledge_base, query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="知识库关键词匹配基准测试")
+    parser.add_argument("--products", type=int, default=2000, help="合成产品数")
+    parser.add_argument("--info-types", type=int, default=300, help="合成信息类型数")
+    parser.add_argument("--keywords", type=int, default=5, help="每个产品/信息类型的关键词数")
+    parser.add_argument("--queries", type=int, default=2000, help="查询数")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("知识库关键词匹配基准测试")
+    print("=" * 60)
+
+    with redirect_stdout(StringIO()):
+        module = load_knowledge_module()
+
+    rng = random.Random(args.seed)
+    knowledge_data, keyword_mapping, product_keywords = build_synthetic_catalogue(
+        rng, args.products, args.info_types, args.keywords)
+    queries = build_queries(rng, keyword_mapping, product_keywords, args.queries)
+
+    build_start = time.perf_counter()
+    knowledge_base = module.SimpleKnowledgeBase(knowledge_data, keyword_mapping, product_keywords)
+    build_seconds = time.perf_counter() - build_start
+    keyword_count = len(knowledge_base.product_matcher) + len(knowledge_base.info_type_matcher)
+    print(f"\n产品 {args.products} 个，信息类型 {args.info_types} 个，去重后关键词 {keyword_count} 个")
+    print(f"编译匹配器: {build_seconds * 1000:.1f} ms（一次性）")
+
+    # 校验两种方式命中结果一致
+    mismatches = sum(naive_hits(knowledge_base, query) != matcher_hits(knowledge_base, query) for query in queries)
+    print(f"命中结果校验: {'✅ 一致' if mismatches == 0 else f'❌ {mismatches} 条查询不一致'}")
+
+    naive_seconds = time_per_query(naive_hits, knowledge_base, queries)
+    matcher_seconds = time_per_query(matcher_hits, knowledge_base, queries)
+    search_seconds = time_per_query(lambda kb, query: kb.search_knowledge(query), knowledge_base, queries)
+
+    print(f"\n原始匹配:       {naive_seconds * 1e6:>10.1f} µs/查询")
+    print(f"关键词匹配器:   {matcher_seconds * 1e6:>10.1f} µs/查询")
+    print(f"完整检索+排序:  {search_seconds * 1e6:>10.1f} µs/查询")
+
+    if matcher_seconds > 0:
+        print(f"\n🎯 匹配加速: {naive_seconds / matcher_seconds:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+SalesGPT 多版本离线回放基准
+=========================
+
+用离线桩模型（见 stub_llm.py）把脚本化的客户对话同时回放给 v1.0 - v5.0，
+记录每轮对话的耗时、LLM调用次数和 prompt/completion token 数，
+输出对比表格和JSON报告，用于跟踪各版本的性能回归。不需要网络和API密钥。
+
+对话来自 data/comprehensive_sales_data.json 中的场景（v5.0 使用对应的客户画像）
+以及各版本演示中的客户输入（见 sales_scenarios.py）。
+
+运行方式：
+python 11_benchmark_replay_versions.py
+python 11_benchmark_replay_versions.py --versions 02 04 --latency 0.05 --output data/replay_benchmark.json
+python 11_benchmark_replay_versions.py --versions 04 05 --stage-mode combined
+python 11_benchmark_replay_versions.py --versions 02 05 --max-sticky-turns 2
+
+作者：AI助手
+日期：2024年
+"""
+
+import argparse
+import datetime
+import importlib.util
+import json
+import math
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Any, Dict, List
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+# 过滤警告
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+# 回放只使用桩模型，没有配置API密钥时使用占位值即可加载模块
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-placeholder")
+
+from sales_scenarios import load_customer_profiles, load_scripted_conversations, register_profile_customer
+from stage_policy import StageStickinessPolicy
+from stub_llm import StubChatModel, create_stub_embeddings
+
+DEFAULT_OUTPUT = os.path.join(SCRIPT_DIR, "data", "replay_benchmark.json")
+
+# 版本号 -> (文件名, 版本名称)
+VERSIONS = {
+    "01": ("01_basic_salesGPT.py", "v1.0 基础版"),
+    "02": ("02_enhanced_conversation_salesGPT.py", "v2.0 增强对话版"),
+    "03": ("03_knowledge_based_salesGPT.py", "v3.0 知识库版"),
+    "04": ("04_rag_enhanced_salesGPT.py", "v4.0 RAG增强版"),
+    "05": ("05_enterprise_salesGPT.py", "v5.0 企业版")
+}
+
+
+def load_version_module(version: str):
+    """按文件路径加载指定版本的SalesGPT模块"""
+    file_name, _ = VERSIONS[version]
+    spec = importlib.util.spec_from_file_location(f"salesgpt_v{version}", os.path.join(SCRIPT_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def register_customer(module, host, conversation: Dict[str, Any], profiles: Dict[str, Dict[str, Any]]) -> str:
+    """把场景的客户画像登记到企业版客户库，返回客户ID"""
+    profile = profiles.get(conversation.get("customer_profile"))
+    if not profile:
+        return "CUST001"
+    return register_profile_customer(module, host.customer_manager, profile)
+
+
+def create_agent_factory(version: str, module, stub: StubChatModel, work_dir: str, stage_mode: str = "separate",
+                         stage_policy: StageStickinessPolicy = None):
+    """返回为每个场景创建新代理的函数（stage_mode 只对 v4.0 和 v5.0 生效，stage_policy 对 v2.0 - v5.0 生效）"""
+    if version == "01":
+        return lambda conversation: module.BasicSalesGPT(stub)
+    if version == "02":
+        return lambda conversation: module.EnhancedSalesGPT(stub, verbose=False, stage_policy=stage_policy)
+    if version == "03":
+        return lambda conversation: module.KnowledgeBasedSalesGPT(stub, verbose=False, stage_policy=stage_policy)
+
+    embeddings = create_stub_embeddings()
+    if version == "04":
+        # 知识库文件放在临时目录，避免覆盖真实知识库的向量索引缓存
+        knowledge_file = os.path.join(work_dir, "v04_knowledge_base.txt")
+        return lambda conversation: module.RAGEnhancedSalesGPT(stub, knowledge_file, verbose=False,
+                                                               embeddings=embeddings, stage_mode=stage_mode,
+                                                               stage_policy=stage_policy)
+
+    # v5.0 所有场景共享一个宿主，每个场景开启一个会话
+    profiles = load_customer_profiles()
+    host = module.EnterpriseSalesHost(stub, verbose=False, embeddings=embeddings, stage_mode=stage_mode,
+                                      stage_policy=stage_policy,
+                                      knowledge_file_path=os.path.join(work_dir, "v05_knowledge_base.txt"))
+
+    def create_enterprise_session(conversation):
+        customer_id = register_customer(module, host, conversation, profiles)
+        return host.open_session(customer_id=customer_id)
+    return create_enterprise_session
+
+
+def replay_version(version: str, conversations: List[Dict[str, Any]], latency: float, work_dir: str,
+                   stage_mode: str = "separate", max_sticky_turns: int = 0) -> List[Dict[str, Any]]:
+    """在一个版本上回放全部对话，返回每轮记录（max_sticky_turns 大于0时启用阶段粘滞策略）"""
+    stub = StubChatModel(latency=latency)
+    records = []
+
+    module = load_version_module(version)
+    stage_policy = StageStickinessPolicy(max_sticky_turns) if max_sticky_turns > 0 else None
+    create_agent = create_agent_factory(version, module, stub, work_dir, stage_mode, stage_policy)
+
+    for conversation in conversations:
+        agent = create_agent(conversation)
+        # 第0轮为销售的开场白
+        turns = [None] + conversation["turns"]
+        for turn_index, customer_input in enumerate(turns):
+            usage_before = stub.usage()
+            start = time.perf_counter()
+            agent.step(customer_input)
+            elapsed = time.perf_counter() - start
+            usage_after = stub.usage()
+
+            records.append({
+                "version": version,
+                "scenario_id": conversation["scenario_id"],
+                "turn": turn_index,
+                "wall_ms": round(elapsed * 1000, 3),
+                "llm_calls": usage_after["calls"] - usage_before["calls"],
+                "prompt_tokens": usage_after["prompt_tokens"] - usage_before["prompt_tokens"],
+                "completion_tokens": usage_after["completion_tokens"] - usage_before["completion_tokens"]
+            })
+        if hasattr(agent, "close"):
+            agent.close()  # v4.0 释放同步接口使用的事件循环
+
+    return records
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """最近秩法计算分位数"""
+    ordered = sorted(values)
+    # 秩为 ceil(p·n)；先舍去浮点误差，避免 0.07 * 100 = 7.000000000000001 这类乘积多进一位
+    index = min(len(ordered) - 1, max(0, math.ceil(round(fraction * len(ordered), 9)) - 1))
+    return ordered[index]
+
+
+def summarize(version: str, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """汇总一个版本的每轮记录"""
+    wall = [record["wall_ms"] for record in records]
+    turns = len(records)
+    return {
+        "version": version,
+        "name": VERSIONS[version][1],
+        "turns": turns,
+        "wall_ms_mean": round(statistics.mean(wall), 3),
+        "wall_ms_p50": round(percentile(wall, 0.50), 3),
+        "wall_ms_p95": round(percentile(wall, 0.95), 3),
+        "llm_calls_per_turn": round(sum(record["llm_calls"] for record in records) / turns, 3),
+        "prompt_tokens_per_turn": round(sum(record["prompt_tokens"] for record in records) / turns, 1),
+        "completion_tokens_per_turn": round(sum(record["completion_tokens"] for record in records) / turns, 1),
+        "total_llm_calls": sum(record["llm_calls"] for record in records),
+        "total_prompt_tokens": sum(record["prompt_tokens"] for record in records),
+        "total_completion_tokens": sum(record["completion_tokens"] for record in records)
+    }
+
+
+def print_table(summaries: List[Dict[str, Any]]):
+    """打印对比表格"""
+    header = f"{'版本':<16} | {'轮数':>4} | {'平均ms':>8} | {'p50 ms':>8} | {'p95 ms':>8} | {'调用/轮':>7} | {'prompt/轮':>9} | {'completion/轮':>13}"
+    print(header)
+    print("-" * len(header))
+    for summary in summaries:
+        print(f"{summary['name']:<16} | {summary['turns']:>4} | {summary['wall_ms_mean']:>8.2f} | "
+              f"{summary['wall_ms_p50']:>8.2f} | {summary['wall_ms_p95']:>8.2f} | "
+              f"{summary['llm_calls_per_turn']:>7.2f} | {summary['prompt_tokens_per_turn']:>9.1f} | "
+              f"{summary['completion_tokens_per_turn']:>13.1f}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="SalesGPT 多版本离线回放基准")
+    parser.add_argument("--versions", nargs="+", choices=sorted(VERSIONS), default=sorted(VERSIONS))
+    parser.add_argument("--latency", type=float, default=0.0, help="桩模型每次调用的模拟延迟（秒）")
+    parser.add_argument("--rounds", type=int, default=1, help="对话集重复回放的次数")
+    parser.add_argument("--stage-mode", choices=["separate", "combined"], default="separate",
+                        help="v4.0/v5.0 的阶段分析模式：separate 单独调用，combined 与回复合并为一次调用")
+    parser.add_argument("--max-sticky-turns", type=int, default=0,
+                        help="阶段粘滞策略最多连续沿用的轮数，0 表示每轮都做阶段分析")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON报告路径")
+    args = parser.parse_args()
+
+    conversations = load_scripted_conversations() * args.rounds
+    total_turns = sum(len(conversation["turns"]) + 1 for conversation in conversations)
+
+    print("=" * 60)
+    print("SalesGPT 多版本离线回放基准")
+    print("=" * 60)
+    print(f"版本: {', '.join(args.versions)}；场景 {len(conversations)} 个，每个版本 {total_turns} 轮；"
+          f"桩模型延迟 {args.latency * 1000:.0f} ms；阶段分析模式 {args.stage_mode}；"
+          f"最多沿用阶段 {args.max_sticky_turns} 轮\n")
+
+    work_dir = tempfile.mkdtemp(prefix="salesgpt_replay_")
+    try:
+        start = time.perf_counter()
+        # 各版本在独立线程中并发回放，每个版本使用自己的桩模型统计用量；
+        # 各版本的演示输出对基准没有意义，统一屏蔽
+        with redirect_stdout(StringIO()), ThreadPoolExecutor(max_workers=len(args.versions)) as executor:
+            futures = {version: executor.submit(replay_version, version, conversations, args.latency, work_dir,
+                                                args.stage_mode, args.max_sticky_turns)
+                       for version in args.versions}
+            results = {version: future.result() for version, future in futures.items()}
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    summaries = [summarize(version, results[version]) for version in args.versions]
+    print_table(summaries)
+    print(f"\n总耗时: {elapsed:.2f} s")
+
+    report = {
+        "generated_at": datetime.datetime.now().isoformat(),
+        "config": {
+            "versions": args.versions,
+            "latency_seconds": args.latency,
+            "rounds": args.rounds,
+            "stage_mode": args.stage_mode,
+            "max_sticky_turns": args.max_sticky_turns,
+            "scenarios": [conversation["scenario_id"] for conversation in conversations]
+        },
+        "summary": summaries,
+        "turns": [record for version in args.versions for record in results[version]]
+    }
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 报告已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+企业版并发压测
+============
+
+用 asyncio 模拟 N 个并发客户，每个客户按 data/comprehensive_sales_data.json 中的
+客户画像登记到客户库，并通过 EnterpriseSalesHost 的独立会话进行多轮对话。
+LLM和嵌入请求发往本地 OpenAI 兼容桩服务（见 stub_openai_server.py），
+真实的 ChatOpenAI / OpenAIEmbeddings 客户端照常建立HTTP连接、序列化请求、解析响应，
+桩服务的延迟可配置。桩服务默认在子进程中运行，不与被测进程争用GIL。
+不访问网络、不需要API密钥。
+
+报告内容：
+- 吞吐量（轮/秒、LLM请求/秒）
+- 每轮延迟 p50/p95/p99（流式模式下另有首个片段延迟）
+- 事件循环延迟（定时器实际唤醒时间与预期时间之差，反映同步代码阻塞事件循环的程度）
+- 每个会话的内存（压测前后进程RSS之差 / 会话数）
+
+运行方式：
+python 13_load_test_enterprise.py --customers 1000 --latency 0.3 --think-time 1.0
+python 13_load_test_enterprise.py --customers 200 --stream --stage-mode combined --output data/load_test_report.json
+
+作者：AI助手
+日期：2024年
+"""
+
+import argparse
+import asyncio
+import datetime
+import importlib.util
+import json
+import math
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Any, Dict, List
+
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+# 过滤警告
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+# 请求全部发往本地桩服务，没有配置API密钥时使用占位值即可加载模块
+os.environ.setdefault("OPENAI_API_KEY", "load-test-placeholder")
+
+from sales_scenarios import load_customer_profiles, load_scripted_conversations, register_profile_customer
+from stub_openai_server import StubOpenAIServer
+
+
+class StubServerProcess:
+    """在子进程中运行桩服务，接口与 StubOpenAIServer 一致（base_url、counters()）"""
+
+    def __init__(self, latency: float):
+        self._process = subprocess.Popen(
+            [sys.executable, os.path.join(SCRIPT_DIR, "stub_openai_server.py"), "--latency", str(latency)],
+            stdout=subprocess.PIPE, text=True)
+        self.base_url = self._process.stdout.readline().strip()
+        if not self.base_url:
+            raise RuntimeError("桩服务启动失败")
+
+    def counters(self) -> Dict[str, int]:
+        return httpx.get(f"{self.base_url}/stats").json()
+
+    def __enter__(self) -> "StubServerProcess":
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        self._process.wait()
+
+
+def load_enterprise_module():
+    """按文件路径加载企业版模块"""
+    spec = importlib.util.spec_from_file_location(
+        "enterprise_salesGPT", os.path.join(SCRIPT_DIR, "05_enterprise_salesGPT.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def current_rss_bytes() -> int:
+    """当前进程的常驻内存；无法读取 /proc 时退回到峰值常驻内存"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为KB
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # 秩为 ceil(p·n)；先舍去浮点误差，避免 0.07 * 100 = 7.000000000000001 这类乘积多进一位
+    index = min(len(ordered) - 1, max(0, math.ceil(round(fraction * len(ordered), 9)) - 1))
+    return ordered[index]
+
+
+class LoopLagMonitor:
+    """周期性休眠并记录实际唤醒时间比预期晚了多少"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def simulate_customer(index: int, host, module, conversation: Dict[str, Any], customer_id: str,
+                            args, records: List[Dict[str, Any]]):
+    """一个模拟客户：按启动间隔进入，逐轮发送消息，轮次之间随机停顿"""
+    rng = random.Random(args.seed + index)
+    await asyncio.sleep(args.ramp_up * index / args.customers)
+    session = host.open_session(customer_id=customer_id)
+
+    # 第0轮为销售的开场白
+    for turn_index, customer_input in enumerate([None] + conversation["turns"]):
+        start = time.perf_counter()
+        first_chunk = None
+        if args.stream:
+            chunks = []
+            async for text in session.astream_step(customer_input):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                chunks.append(text)
+            response = "".join(chunks)
+        else:
+            response = await session.astep(customer_input)
+        elapsed = time.perf_counter() - start
+
+        records.append({
+            "customer": index,
+            "turn": turn_index,
+            "latency": elapsed,
+            "first_chunk": first_chunk,
+            "error": response == module.FALLBACK_REPLY
+        })
+
+        if args.think_time:
+            await asyncio.sleep(rng.expovariate(1.0 / args.think_time))
+
+
+async def run_load_test(args, module, host, conversations, profiles) -> Dict[str, Any]:
+    """启动全部模拟客户并等待对话结束"""
+    profile_list = list(profiles.values())
+    customer_ids = []
+    for index in range(args.customers):
+        if profile_list:
+            profile = profile_list[index % len(profile_list)]
+            customer_ids.append(register_profile_customer(module, host.customer_manager, profile,
+                                                          customer_id=f"LOAD{index:06d}"))
+        else:
+            customer_ids.append("CUST001")
+
+    records: List[Dict[str, Any]] = []
+    monitor = LoopLagMonitor(args.lag_interval)
+    rss_before = current_rss_bytes()
+
+    monitor.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        simulate_customer(index, host, module, conversations[index % len(conversations)],
+                          customer_ids[index], args, records)
+        for index in range(args.customers)
+    ))
+    elapsed = time.perf_counter() - start
+    await monitor.stop()
+
+    return {
+        "records": records,
+        "elapsed": elapsed,
+        "loop_lag": monitor.samples,
+        "rss_delta": current_rss_bytes() - rss_before
+    }
+
+
+def summarize(args, result: Dict[str, Any], server_counters: Dict[str, int]) -> Dict[str, Any]:
+    """汇总压测结果（时间单位为毫秒）"""
+    records = result["records"]
+    latencies = [record["latency"] * 1000 for record in records]
+    first_chunks = [record["first_chunk"] * 1000 for record in records if record["first_chunk"] is not None]
+    lag = [sample * 1000 for sample in result["loop_lag"]]
+    elapsed = result["elapsed"]
+    llm_requests = server_counters["chat_requests"] + server_counters["embedding_requests"]
+
+    summary = {
+        "customers": args.customers,
+        "turns": len(records),
+        "errors": sum(record["error"] for record in records),
+        "elapsed_seconds": round(elapsed, 3),
+        "turns_per_second": round(len(records) / elapsed, 2),
+        "requests_per_second": round(llm_requests / elapsed, 2),
+        "server_requests": server_counters,
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies), 1) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50), 1),
+            "p95": round(percentile(latencies, 0.95), 1),
+            "p99": round(percentile(latencies, 0.99), 1),
+            "max": round(max(latencies, default=0.0), 1)
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(lag, 0.50), 2),
+            "p99": round(percentile(lag, 0.99), 2),
+            "max": round(max(lag, default=0.0), 2)
+        },
+        "memory_per_session_kb": round(result["rss_delta"] / args.customers / 1024, 1)
+    }
+    if first_chunks:
+        summary["first_chunk_ms"] = {
+            "p50": round(percentile(first_chunks, 0.50), 1),
+            "p95": round(percentile(first_chunks, 0.95), 1),
+            "p99": round(percentile(first_chunks, 0.99), 1)
+        }
+    return summary
+
+
+def print_summary(summary: Dict[str, Any]):
+    """打印压测报告"""
+    latency = summary["latency_ms"]
+    lag = summary["loop_lag_ms"]
+    print(f"客户数:         {summary['customers']}")
+    print(f"完成轮数:       {summary['turns']}（出错 {summary['errors']}）")
+    print(f"总耗时:         {summary['elapsed_seconds']:.2f} s")
+    print(f"吞吐量:         {summary['turns_per_second']:.1f} 轮/秒，{summary['requests_per_second']:.1f} 请求/秒")
+    print(f"每轮延迟:       p50 {latency['p50']:.0f} ms | p95 {latency['p95']:.0f} ms | "
+          f"p99 {latency['p99']:.0f} ms | max {latency['max']:.0f} ms")
+    if "first_chunk_ms" in summary:
+        first_chunk = summary["first_chunk_ms"]
+        print(f"首个片段延迟:   p50 {first_chunk['p50']:.0f} ms | p95 {first_chunk['p95']:.0f} ms | "
+              f"p99 {first_chunk['p99']:.0f} ms")
+    print(f"事件循环延迟:   p50 {lag['p50']:.1f} ms | p99 {lag['p99']:.1f} ms | max {lag['max']:.1f} ms")
+    print(f"每会话内存:     {summary['memory_per_session_kb']:.1f} KB（进程RSS增量 / 会话数）")
+    print(f"桩服务请求:     {summary['server_requests']}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="企业版并发压测")
+    parser.add_argument("--customers", type=int, default=500, help="并发模拟客户数")
+    parser.add_argument("--latency", type=float, default=0.2, help="桩服务每次请求的模拟延迟（秒）")
+    parser.add_argument("--think-time", type=float, default=0.5, help="客户两轮之间的平均停顿（秒），0 表示不停顿")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="全部客户进入所用的时间（秒）")
+    parser.add_argument("--stream", action="store_true", help="使用 astream_step 并统计首个片段延迟")
+    parser.add_argument("--knowledge-mode", choices=["qa", "retrieval"], default="qa")
+    parser.add_argument("--stage-mode", choices=["separate", "combined"], default="separate")
+    parser.add_argument("--max-connections", type=int, default=1000, help="HTTP连接池上限")
+    parser.add_argument("--in-process-server", action="store_true",
+                        help="在本进程的线程中运行桩服务（与被测客户端共享GIL，延迟会偏高）")
+    parser.add_argument("--lag-interval", type=float, default=0.05, help="事件循环延迟采样间隔（秒）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON报告路径（可选）")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("企业版并发压测")
+    print("=" * 60)
+    print(f"客户 {args.customers} 个；桩服务延迟 {args.latency * 1000:.0f} ms；平均停顿 {args.think_time:.1f} s；"
+          f"{'流式' if args.stream else '非流式'}；知识模式 {args.knowledge_mode}；阶段模式 {args.stage_mode}\n")
+
+    conversations = load_scripted_conversations()
+    profiles = load_customer_profiles()
+    work_dir = tempfile.mkdtemp(prefix="salesgpt_load_")
+
+    try:
+        server_context = (StubOpenAIServer(latency=args.latency) if args.in_process_server
+                          else StubServerProcess(args.latency))
+        with server_context as server:
+            limits = httpx.Limits(max_connections=args.max_connections,
+                                  max_keepalive_connections=args.max_connections)
+            http_async_client = httpx.AsyncClient(limits=limits, timeout=120)
+            llm = ChatOpenAI(model="stub-chat", base_url=server.base_url, api_key="stub", temperature=0.7,
+                             max_retries=0, http_async_client=http_async_client)
+            embeddings = OpenAIEmbeddings(model="stub-embedding", base_url=server.base_url, api_key="stub",
+                                          check_embedding_ctx_length=False, max_retries=0,
+                                          http_async_client=http_async_client)
+
+            with redirect_stdout(StringIO()):
+                module = load_enterprise_module()
+                # 初始化时构建的向量索引请求不计入压测
+                host = module.EnterpriseSalesHost(
+                    llm, verbose=False, embeddings=embeddings,
+                    knowledge_file_path=os.path.join(work_dir, "enterprise_knowledge_base.txt"),
+                    knowledge_mode=args.knowledge_mode, stage_mode=args.stage_mode)
+            counters_before = server.counters()
+
+            async def run():
+                try:
+                    # 各轮的错误提示会打印到标准输出，只在报告中统计数量
+                    with redirect_stdout(StringIO()):
+                        return await run_load_test(args, module, host, conversations, profiles)
+                finally:
+                    await http_async_client.aclose()
+
+            result = asyncio.run(run())
+            counters = {key: value - counters_before[key] for key, value in server.counters().items()}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = summarize(args, result, counters)
+    print_summary(summary)
+
+    if args.output:
+        report = {
+            "generated_at": datetime.datetime.now().isoformat(),
+            "config": {key: value for key, value in vars(args).items() if key != "output"},
+            "summary": summary
+        }
+        output_dir = os.path.dirname(os.path.abspath(args.output))
+        os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 报告已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
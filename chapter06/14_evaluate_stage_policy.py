@@ -0,0 +1,217 @@
+"""
+阶段粘滞策略评估
+==============
+
+离线回放客户对话，统计 StageStickinessPolicy（见 stage_policy.py）在不同
+max_sticky_turns 下会跳过多少次阶段分析，以及被跳过的轮次中沿用的上一轮阶段
+与实际阶段不一致的比例。
+
+每一轮都需要一个实际阶段（即不跳过时阶段分析会给出的阶段），来自两种数据源：
+- 默认：用 v2.0 的阶段分析器（不启用粘滞策略）和真实模型（需要API密钥）回放
+  data/comprehensive_sales_data.json 场景和演示对话，记录每轮分析出的阶段
+- --samples：StageAnalyzer 的 stage_label_log 记录的 LLM 阶段样本（JSONL）。
+  相邻样本按对话历史的包含关系拼接成对话，本轮客户消息取历史中最后一条客户发言；
+  由本地分类器给出的轮次不会写入日志，因此这些轮次不在评估范围内。
+
+--analyzer stub 使用离线桩模型回放，只用于检查跳过率：桩模型按客户发言次数推进阶段，
+每个沿用的阶段都必然不一致，因此这时不报告不一致率。
+
+回放策略时与代理一致：对话从阶段1开始，第一个客户轮次总是分析，执行分析的轮次采用实际阶段，
+跳过的轮次沿用上一轮阶段。
+
+运行方式：
+python 14_evaluate_stage_policy.py --max-sticky-turns 1 2 3
+python 14_evaluate_stage_policy.py --samples data/stage_samples.jsonl
+python 14_evaluate_stage_policy.py --analyzer stub   # 离线，只统计跳过率
+
+作者：AI助手
+日期：2024年
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Any, Dict, List, Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from sales_scenarios import load_scripted_conversations
+from stage_classifier import load_training_samples
+from stage_policy import StageStickinessPolicy
+from stub_llm import StubChatModel
+
+CUSTOMER_PREFIX = "客户："
+END_OF_TURN = "<END_OF_TURN>"
+
+
+def load_enhanced_module(analyzer: str = "llm"):
+    """按文件路径加载 v2.0 增强对话版模块（只有桩模型模式使用占位API密钥，真实模型模式需要配置密钥）"""
+    if analyzer == "stub":
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark-placeholder")
+    spec = importlib.util.spec_from_file_location(
+        "enhanced_salesGPT", os.path.join(SCRIPT_DIR, "02_enhanced_conversation_salesGPT.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def conversations_from_scenarios(analyzer: str = "llm") -> List[Dict[str, Any]]:
+    """用阶段分析器回放脚本化对话，stages 为每轮分析出的阶段
+
+    代理不启用粘滞策略，每个客户轮次都执行阶段分析，因此每轮都有实际阶段。
+    """
+    module = load_enhanced_module(analyzer)
+    llm = module.llm if analyzer == "llm" else StubChatModel()
+
+    conversations = []
+    for conversation in load_scripted_conversations():
+        agent = module.EnhancedSalesGPT(llm, verbose=False)
+        stages = []
+        with redirect_stdout(StringIO()):
+            agent.step()  # 销售开场白
+            for user_input in conversation["turns"]:
+                agent.step(user_input)
+                stages.append(agent.current_stage)
+        conversations.append({"scenario_id": conversation["scenario_id"],
+                              "turns": conversation["turns"], "stages": stages})
+    return conversations
+
+
+def last_customer_message(conversation_history: str) -> Optional[str]:
+    """对话历史中最后一条客户发言"""
+    for line in reversed(conversation_history.splitlines()):
+        line = line.strip()
+        if line.startswith(CUSTOMER_PREFIX):
+            return line[len(CUSTOMER_PREFIX):].replace(END_OF_TURN, "").strip()
+    return None
+
+
+def conversations_from_samples(log_path: str) -> List[Dict[str, Any]]:
+    """把 stage_label_log 中的样本拼接成对话
+
+    同一对话中，上一条样本的最后一条客户发言仍然出现在本条样本的历史中
+    （历史窗口只会从前面截断）；不满足时视为新对话开始。
+    """
+    conversations = []
+    previous_message = None
+    for conversation_history, stage in load_training_samples(log_path):
+        message = last_customer_message(conversation_history)
+        if message is None:
+            continue
+        if previous_message is None or f"{CUSTOMER_PREFIX}{previous_message}" not in conversation_history:
+            conversations.append({"scenario_id": f"sample_{len(conversations) + 1:04d}", "turns": [], "stages": []})
+        conversations[-1]["turns"].append(message)
+        conversations[-1]["stages"].append(stage)
+        previous_message = message
+    return conversations
+
+
+def evaluate(conversations: List[Dict[str, Any]], policy: StageStickinessPolicy,
+             compare_stages: bool = True) -> Dict[str, Any]:
+    """按策略回放全部对话，返回跳过次数和沿用阶段的不一致情况（compare_stages 为 False 时只统计跳过）"""
+    turns = skipped = mismatches = 0
+    examples = []
+
+    for conversation in conversations:
+        # 与代理一致：对话从阶段1开始，第一个客户轮次总是分析，每个对话单独计算连续沿用轮数
+        current_stage, sticky_turns, stage_analyzed = "1", 0, False
+        for turn_index, (user_input, actual_stage) in enumerate(zip(conversation["turns"], conversation["stages"])):
+            turns += 1
+            if policy.should_reuse(user_input, sticky_turns, stage_analyzed):
+                # 跳过分析：沿用上一轮阶段，与本轮分析会给出的阶段比较
+                skipped += 1
+                sticky_turns += 1
+                if actual_stage != current_stage:
+                    mismatches += 1
+                    examples.append({"scenario_id": conversation["scenario_id"], "turn": turn_index + 1,
+                                     "user_input": user_input, "reused_stage": current_stage,
+                                     "actual_stage": actual_stage})
+                continue
+
+            # 执行了阶段分析，本轮阶段为实际阶段
+            sticky_turns, stage_analyzed = 0, True
+            current_stage = actual_stage
+
+    return {
+        "max_sticky_turns": policy.max_sticky_turns,
+        "turns": turns,
+        "skipped": skipped,
+        "skip_rate": round(skipped / turns, 3) if turns else 0.0,
+        "mismatches": mismatches if compare_stages else None,
+        "mismatch_rate": (round(mismatches / skipped, 3) if skipped else 0.0) if compare_stages else None,
+        "decisions": policy.summary(),
+        "mismatch_examples": examples if compare_stages else []
+    }
+
+
+def print_table(results: List[Dict[str, Any]]):
+    """打印各配置的对比表格（不一致率 = 沿用阶段与实际阶段不同的跳过轮次 / 跳过轮次）"""
+    header = f"{'最多沿用':>8} {'轮数':>6} {'跳过':>6} {'跳过率':>8} {'不一致':>6} {'不一致率':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        if result["mismatch_rate"] is None:
+            mismatches, mismatch_rate = f"{'-':>6}", f"{'-':>8}"
+        else:
+            mismatches, mismatch_rate = f"{result['mismatches']:>6}", f"{result['mismatch_rate']:>8.1%}"
+        print(f"{result['max_sticky_turns']:>8} {result['turns']:>6} {result['skipped']:>6} "
+              f"{result['skip_rate']:>8.1%} {mismatches} {mismatch_rate}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="阶段粘滞策略评估")
+    parser.add_argument("--max-sticky-turns", type=int, nargs="+", default=[1, 2, 3, 5],
+                        help="要比较的最多连续沿用轮数")
+    parser.add_argument("--long-message-chars", type=int, default=30, help="视为有转换信号的消息长度")
+    parser.add_argument("--samples", help="stage_label_log 样本文件（JSONL），不指定时用阶段分析器回放场景")
+    parser.add_argument("--analyzer", choices=["stub", "llm"], default="llm",
+                        help="回放场景时使用的阶段分析模型：llm 为真实模型（需要API密钥），"
+                             "stub 为离线桩模型（只统计跳过率，不报告不一致率）")
+    parser.add_argument("--output", help="JSON报告路径（可选）")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("阶段粘滞策略评估")
+    print("=" * 60)
+
+    if args.samples:
+        conversations = conversations_from_samples(args.samples)
+        source = f"阶段样本日志 {args.samples}"
+    else:
+        conversations = conversations_from_scenarios(args.analyzer)
+        source = f"场景和演示对话（{'桩模型' if args.analyzer == 'stub' else 'LLM'}阶段分析）"
+    turns = sum(len(conversation["turns"]) for conversation in conversations)
+    print(f"\n数据源: {source}，{len(conversations)} 个对话，{turns} 个轮次（每轮都有实际阶段）")
+    # 桩模型的阶段随客户发言次数递增，沿用的阶段必然不一致，比较没有意义
+    compare_stages = bool(args.samples) or args.analyzer == "llm"
+    if not compare_stages:
+        print("⚠️  桩模型的阶段随客户发言次数递增，不报告不一致率；使用 --analyzer llm 或 --samples 评估准确性")
+    print()
+
+    results = [evaluate(conversations, StageStickinessPolicy(max_sticky_turns, args.long_message_chars),
+                        compare_stages)
+               for max_sticky_turns in args.max_sticky_turns]
+    print_table(results)
+
+    for result in results:
+        decisions = result["decisions"]
+        print(f"\nmax_sticky_turns={result['max_sticky_turns']}: 首轮分析 {decisions['initial']}，"
+              f"关键词触发 {decisions['keyword']}，长消息触发 {decisions['length']}，强制分析 {decisions['forced']}")
+        for example in result["mismatch_examples"][:5]:
+            print(f"  ❌ {example['scenario_id']} 第{example['turn']}轮 \"{example['user_input']}\"："
+                  f"沿用阶段{example['reused_stage']}，实际阶段{example['actual_stage']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"source": source, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 报告已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+SalesGPT 异步Web服务
+==================
+
+用 sales_service.py 的 ASGI 应用对外提供 v4.0 / v5.0 销售对话：
+创建会话、发送消息（SSE 或 WebSocket 流式返回）、查看会话摘要。
+v5.0 的会话由同一个 EnterpriseSalesHost 分发；v4.0 的各个会话共享同一个知识库。
+
+运行服务（需要 pip install uvicorn[standard]）：
+python 15_sales_web_service.py --version 05 --port 8000
+python 15_sales_web_service.py --version 04 --stub --latency 0.2     # 使用离线桩模型，不需要API密钥
+
+不启动服务器，在进程内用桩模型自检全部接口和背压行为：
+python 15_sales_web_service.py --self-test
+
+调用示例：
+curl -X POST localhost:8000/sessions -d '{"customer_id": "CUST001"}'
+curl -N -X POST localhost:8000/sessions/<session_id>/messages -d '{"message": "你们有什么产品？"}'
+curl localhost:8000/sessions/<session_id>
+
+作者：AI助手
+日期：2024年
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from contextlib import redirect_stdout
+from io import StringIO
+from typing import Any, Dict, List, Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+# 过滤警告
+warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+try:
+    import uvicorn
+    UVICORN_AVAILABLE = True
+except ImportError:
+    UVICORN_AVAILABLE = False
+
+from sales_service import SalesChatService, create_asgi_app
+from stub_llm import StubChatModel, create_stub_embeddings
+
+# 版本号 -> 文件名
+VERSIONS = {
+    "04": "04_rag_enhanced_salesGPT.py",
+    "05": "05_enterprise_salesGPT.py"
+}
+
+
+def load_version_module(version: str):
+    """按文件路径加载指定版本的SalesGPT模块"""
+    spec = importlib.util.spec_from_file_location(
+        f"salesgpt_v{version}", os.path.join(SCRIPT_DIR, VERSIONS[version]))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_service(version: str, stub: bool, latency: float = 0.0, work_dir: str = None,
+                  knowledge_mode: str = "qa", stage_mode: str = "separate", **service_options) -> SalesChatService:
+    """创建指定版本的对话服务
+
+    stub 为 True 时使用离线桩模型和确定性嵌入，知识库索引写入 work_dir，避免覆盖真实的索引缓存。
+    """
+    if stub:
+        # 桩模型不需要API密钥，使用占位值即可加载模块
+        os.environ.setdefault("OPENAI_API_KEY", "stub-placeholder")
+    module = load_version_module(version)
+    llm = StubChatModel(latency=latency) if stub else module.llm
+    embeddings = create_stub_embeddings() if stub else None
+    knowledge_file = None
+    if work_dir:
+        knowledge_file = os.path.join(work_dir, f"v{version}_knowledge_base.txt")
+
+    if version == "05":
+        host = module.EnterpriseSalesHost(llm, verbose=False, knowledge_file_path=knowledge_file,
+                                          embeddings=embeddings, knowledge_mode=knowledge_mode,
+                                          stage_mode=stage_mode)
+        return SalesChatService(
+            create_agent=lambda session_id, customer_id: host.open_session(session_id, customer_id),
+            close_agent=host.close_session,
+            **service_options)
+
+    # v4.0 代理本身就是一个会话，知识库和产品事实索引在会话之间共享
+    knowledge_base = module.RAGKnowledgeBase(knowledge_file, qa_llm=llm, embeddings=embeddings)
+    fact_index = module.ProductFactIndex.load()
+    return SalesChatService(
+        create_agent=lambda session_id, customer_id: module.RAGEnhancedSalesGPT(
+            llm, verbose=False, knowledge_mode=knowledge_mode, stage_mode=stage_mode,
+            fact_index=fact_index, knowledge_base=knowledge_base),
+        **service_options)
+
+
+# ---- 进程内 ASGI 调用（自检用） ----
+
+async def asgi_http(app, method: str, path: str, payload: Dict[str, Any] = None) -> Dict[str, Any]:
+    """在进程内调用一次HTTP接口，返回 {"status", "headers", "body"}"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"", "headers": []}
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # 连接保持打开，直到服务端读完响应后取消等待
+        await asyncio.Event().wait()
+
+    response = {"status": None, "headers": {}, "body": b""}
+
+    async def send(event):
+        if event["type"] == "http.response.start":
+            response["status"] = event["status"]
+            response["headers"] = {key.decode(): value.decode() for key, value in event.get("headers", [])}
+        elif event["type"] == "http.response.body":
+            response["body"] += event.get("body", b"")
+
+    await app(scope, receive, send)
+    return response
+
+
+def parse_sse(body: bytes) -> List[Dict[str, Any]]:
+    """把SSE响应体解析为 [{"event", "data"}, ...]"""
+    events = []
+    for block in body.decode("utf-8").split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        if "data" in fields:
+            events.append({"event": fields.get("event", "message"), "data": json.loads(fields["data"])})
+    return events
+
+
+async def asgi_websocket(app, path: str, messages: List[Optional[str]]) -> List[Dict[str, Any]]:
+    """在进程内建立一次WebSocket对话，依次发送消息，返回每条消息的最终事件（done 或 error）"""
+    incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+    scope = {"type": "websocket", "path": path, "query_string": b"", "headers": []}
+    await incoming.put({"type": "websocket.connect"})
+    task = asyncio.create_task(app(scope, incoming.get, outgoing.put))
+
+    if (await outgoing.get())["type"] != "websocket.accept":
+        await task
+        return []
+
+    results = []
+    for message in messages:
+        await incoming.put({"type": "websocket.receive", "text": json.dumps({"message": message})})
+        while True:
+            event = json.loads((await outgoing.get())["text"])
+            if event["type"] in ("done", "error"):
+                results.append(event)
+                break
+    await incoming.put({"type": "websocket.disconnect", "code": 1000})
+    await task
+    return results
+
+
+def check(passed: bool, description: str) -> bool:
+    print(f"{'✅' if passed else '❌'} {description}")
+    return passed
+
+
+async def run_self_test(version: str, latency: float, concurrency: int) -> bool:
+    """用桩模型在进程内验证全部接口、每会话锁和背压"""
+    work_dir = tempfile.mkdtemp(prefix="salesgpt_service_")
+    try:
+        with redirect_stdout(StringIO()):
+            service = build_service(version, stub=True, latency=latency, work_dir=work_dir,
+                                    max_concurrent_turns=max(1, concurrency // 2), max_pending_turns=concurrency)
+        app = create_asgi_app(service)
+        results = []
+
+        response = await asgi_http(app, "POST", "/sessions", {"customer_id": "CUST001"})
+        session_id = json.loads(response["body"]).get("session_id")
+        results.append(check(response["status"] == 201 and session_id, "创建会话"))
+
+        events = parse_sse((await asgi_http(app, "POST", f"/sessions/{session_id}/messages",
+                                            {"message": None}))["body"])
+        deltas = [event for event in events if event["event"] == "delta"]
+        done = events[-1] if events else {}
+        results.append(check(deltas and done.get("event") == "done"
+                             and done["data"]["reply"] == "".join(event["data"]["text"] for event in deltas).strip(),
+                             f"SSE 开场白：{len(deltas)} 个片段 + done"))
+
+        response = await asgi_http(app, "POST", f"/sessions/{session_id}/messages",
+                                   {"message": "你们有什么产品？", "stream": False})
+        results.append(check(response["status"] == 200 and json.loads(response["body"])["reply"],
+                             "非流式消息返回完整回复"))
+
+        replies = await asgi_websocket(app, f"/sessions/{session_id}/ws", ["价格大概多少？", "好的，谢谢"])
+        results.append(check([reply["type"] for reply in replies] == ["done", "done"], "WebSocket 连续两条消息"))
+        results.append(check(await asgi_websocket(app, "/sessions/missing/ws", ["你好"]) == [],
+                             "WebSocket 连接不存在的会话被拒绝"))
+
+        # 同一会话同时到达三条消息：一条处理、一条排队、一条被拒绝
+        responses = await asyncio.gather(*[
+            asgi_http(app, "POST", f"/sessions/{session_id}/messages", {"message": f"问题{i}", "stream": False})
+            for i in range(3)])
+        statuses = sorted(response["status"] for response in responses)
+        results.append(check(statuses == [200, 200, 429], f"同一会话并发消息按顺序处理，超出排队上限返回429：{statuses}"))
+
+        response = await asgi_http(app, "GET", f"/sessions/{session_id}")
+        summary = json.loads(response["body"])
+        results.append(check(response["status"] == 200 and summary["turns"] == 6, f"会话摘要：{summary['turns']} 轮"))
+
+        # 多个会话并发对话，超出全局排队上限的请求返回503
+        session_ids = [json.loads((await asgi_http(app, "POST", "/sessions", {}))["body"])["session_id"]
+                       for _ in range(concurrency * 2)]
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            asgi_http(app, "POST", f"/sessions/{sid}/messages", {"message": "你好", "stream": False})
+            for sid in session_ids])
+        elapsed = time.perf_counter() - start
+        statuses = [response["status"] for response in responses]
+        overloaded = [response for response in responses if response["status"] == 503]
+        results.append(check(statuses.count(200) == len(statuses) - len(overloaded) and overloaded
+                             and all("retry-after" in response["headers"] for response in overloaded),
+                             f"{len(session_ids)} 个会话并发：{statuses.count(200)} 成功，"
+                             f"{len(overloaded)} 个503（{elapsed:.2f} s）"))
+
+        response = await asgi_http(app, "DELETE", f"/sessions/{session_id}")
+        missing = await asgi_http(app, "GET", f"/sessions/{session_id}")
+        results.append(check(response["status"] == 200 and missing["status"] == 404, "关闭会话后返回404"))
+
+        health = json.loads((await asgi_http(app, "GET", "/health"))["body"])
+        print(f"\n服务统计: {health}")
+        return all(results)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="SalesGPT 异步Web服务")
+    parser.add_argument("--version", choices=sorted(VERSIONS), default="05")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stub", action="store_true", help="使用离线桩模型（不需要API密钥）")
+    parser.add_argument("--latency", type=float, default=0.05, help="桩模型每次调用的模拟延迟（秒）")
+    parser.add_argument("--knowledge-mode", choices=["qa", "retrieval"], default="qa")
+    parser.add_argument("--stage-mode", choices=["separate", "combined"], default="separate")
+    parser.add_argument("--max-concurrent-turns", type=int, default=64, help="最多同时生成回复的轮数")
+    parser.add_argument("--max-pending-turns", type=int, default=256, help="最多排队等待生成的轮数")
+    parser.add_argument("--self-test", action="store_true", help="在进程内用桩模型自检接口后退出")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("SalesGPT 异步Web服务")
+    print("=" * 60)
+
+    if args.self_test:
+        passed = asyncio.run(run_self_test(args.version, args.latency, concurrency=8))
+        print("\n🎯 自检通过" if passed else "\n❌ 自检失败")
+        sys.exit(0 if passed else 1)
+
+    if not UVICORN_AVAILABLE:
+        print("❌ 运行服务需要 uvicorn：pip install uvicorn[standard]")
+        print("   不启动服务器也可以用 --self-test 在进程内验证接口")
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="salesgpt_service_") if args.stub else None
+    try:
+        service = build_service(args.version, args.stub, args.latency, work_dir,
+                                knowledge_mode=args.knowledge_mode, stage_mode=args.stage_mode,
+                                max_concurrent_turns=args.max_concurrent_turns,
+                                max_pending_turns=args.max_pending_turns)
+        print(f"\n🚀 v{args.version} 服务地址: http://{args.host}:{args.port}"
+              f"（{'桩模型' if args.stub else '真实模型'}）")
+        uvicorn.run(create_asgi_app(service), host=args.host, port=args.port, log_level="warning")
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
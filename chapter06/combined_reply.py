@@ -0,0 +1,95 @@
+"""
+阶段判断与回复合并输出
+====================
+
+合并模式下，一次LLM调用同时给出销售阶段和回复，输出格式为：
+
+    STAGE: 3
+    回复内容……<END_OF_TURN>
+
+首行是阶段编号，其余是回复。解析器既可以解析完整输出，也可以在流式输出时
+逐段解析：首行到达前先缓存，识别出阶段后只输出回复部分。阶段编号不在
+SALES_STAGES 中或模型没有输出首行时，使用调用方给出的备用阶段。
+"""
+
+import re
+from typing import Dict, Tuple
+
+STAGE_HEADER_PATTERN = re.compile(r"^\s*(?:STAGE|Stage|stage|阶段)\s*[:：]\s*(\S*)\s*$")
+
+# 首行超过这个长度仍然没有换行，视为模型没有输出阶段行
+MAX_HEADER_LENGTH = 32
+
+COMBINED_OUTPUT_INSTRUCTIONS = """输出格式要求：
+第一行只写 STAGE: 阶段编号（1-7中最符合当前对话的一个），例如 STAGE: 3
+从第二行开始写给客户的回复，以 <END_OF_TURN> 结尾"""
+
+
+def format_stage_options(stages: Dict[str, str]) -> str:
+    """把阶段表格式化为提示词中的选项列表"""
+    return "\n".join(f"{number}. {description}" for number, description in stages.items())
+
+
+class CombinedReplyParser:
+    """增量解析 “STAGE: n” 首行和回复"""
+
+    def __init__(self, valid_stages: Dict[str, str], fallback_stage: str):
+        self.valid_stages = valid_stages
+        self.fallback_stage = fallback_stage
+        self.stage = fallback_stage
+        self.stage_from_model = False
+        self._header_done = False
+        self._buffer = ""
+
+    def _parse_header(self, line: str) -> bool:
+        """识别阶段行，返回该行是否为阶段行"""
+        match = STAGE_HEADER_PATTERN.match(line)
+        if not match:
+            return False
+
+        stage = match.group(1).strip().rstrip("。.")
+        if stage in self.valid_stages:
+            self.stage = stage
+            self.stage_from_model = True
+        return True
+
+    def feed(self, chunk: str) -> str:
+        """输入一个片段，返回可以输出的回复文本"""
+        if self._header_done:
+            return chunk
+
+        # 忽略首行之前的空白
+        self._buffer = (self._buffer + chunk).lstrip()
+        newline = self._buffer.find("\n")
+        if newline == -1:
+            # 还在等待首行结束；过长说明模型没有输出阶段行
+            if len(self._buffer) <= MAX_HEADER_LENGTH:
+                return ""
+            self._header_done = True
+            text, self._buffer = self._buffer, ""
+            return text
+
+        self._header_done = True
+        first_line, rest = self._buffer[:newline], self._buffer[newline + 1:]
+        self._buffer = ""
+        if self._parse_header(first_line):
+            return rest.lstrip("\n")
+        return first_line + "\n" + rest
+
+    def flush(self) -> str:
+        """输出结束时处理剩余内容（例如只有一行的输出）"""
+        if self._header_done:
+            return ""
+
+        self._header_done = True
+        text, self._buffer = self._buffer, ""
+        if self._parse_header(text):
+            return ""
+        return text
+
+
+def parse_combined_output(text: str, valid_stages: Dict[str, str], fallback_stage: str) -> Tuple[str, str, bool]:
+    """解析完整输出，返回 (阶段, 回复, 阶段是否来自模型)"""
+    parser = CombinedReplyParser(valid_stages, fallback_stage)
+    reply = parser.feed(text) + parser.flush()
+    return parser.stage, reply.strip(), parser.stage_from_model
@@ -0,0 +1,124 @@
+"""
+按token预算维护的对话历史
+======================
+
+SalesGPT 原来每轮都用 "".join(conversation_history[-10:]) 重新拼接最近N轮对话，
+窗口按轮数计算，一条很长的客户消息就会让提示词暴涨。
+
+TokenBudgetHistory 在追加每一轮时计算并记录它的token数，维护累计token数和
+已拼接好的历史文本；超出预算时从最旧的一轮开始淘汰。渲染历史直接返回缓存，
+每轮的维护开销只与新增和淘汰的轮次有关。
+
+单轮就超出预算时截断正文，但保留结尾的轮次结束标记（默认 <END_OF_TURN>，计入预算），
+v2.0 - v5.0 使用空分隔符拼接，丢掉结束标记会让这一轮和下一轮连在一起。
+
+流式生成在准备阶段就记录了客户输入，回复在生成器耗尽后才记录。rollback_on_abort 包住
+流式生成器的主体：调用方提前关闭生成器或任务被取消时，撤销本轮记录的客户输入，
+不留下没有回复的客户发言。
+"""
+
+import asyncio
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Iterator, List, Optional, Sequence, Tuple
+
+from token_utils import estimate_tokens, truncate_to_tokens
+
+
+class TokenBudgetHistory:
+    """按token预算淘汰旧轮次的对话历史"""
+
+    def __init__(self, max_tokens: int = 2000, max_turns: Optional[int] = None, separator: str = "",
+                 turn_delimiter: str = "<END_OF_TURN>"):
+        """
+        Args:
+            max_tokens: 历史文本的token预算
+            max_turns: 可选的最大轮数，与token预算同时生效
+            separator: 拼接各轮时使用的分隔符
+            turn_delimiter: 轮次结束标记，截断超长轮次时保留
+        """
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.separator = separator
+        self.turn_delimiter = turn_delimiter
+        self._separator_tokens = estimate_tokens(separator)
+        self._turns: Deque[Tuple[str, int]] = deque()
+        self._token_count = 0
+        self._rendered = ""
+
+    @property
+    def token_count(self) -> int:
+        """当前历史文本的token数（包括分隔符）"""
+        return self._token_count
+
+    def append(self, text: str):
+        """追加一轮对话，必要时淘汰最旧的轮次"""
+        tokens = estimate_tokens(text)
+        if tokens > self.max_tokens:
+            text = self._truncate_turn(text)
+            tokens = estimate_tokens(text)
+
+        if self._turns:
+            self._rendered += self.separator + text
+            self._token_count += self._separator_tokens + tokens
+        else:
+            self._rendered = text
+            self._token_count = tokens
+        self._turns.append((text, tokens))
+
+        while len(self._turns) > 1 and (
+                self._token_count > self.max_tokens
+                or (self.max_turns is not None and len(self._turns) > self.max_turns)):
+            self._evict_oldest()
+
+    def _truncate_turn(self, text: str) -> str:
+        """单轮就超出预算时只保留正文开头部分，结尾的结束标记保留并计入预算"""
+        delimiter = self.turn_delimiter if self.turn_delimiter and text.endswith(self.turn_delimiter) else ""
+        body = text[:len(text) - len(delimiter)]
+        body_budget = max(0, self.max_tokens - estimate_tokens(delimiter))
+        return truncate_to_tokens(body, body_budget) + delimiter
+
+    def _evict_oldest(self):
+        """淘汰最旧的一轮，同步更新缓存的文本和token数"""
+        text, tokens = self._turns.popleft()
+        self._rendered = self._rendered[len(text) + len(self.separator):]
+        self._token_count -= tokens + self._separator_tokens
+
+    def render(self) -> str:
+        """返回拼接好的历史文本"""
+        return self._rendered
+
+    def clear(self):
+        """清空历史"""
+        self._turns.clear()
+        self._token_count = 0
+        self._rendered = ""
+
+    def rebuild(self, turns: Sequence[str]):
+        """按完整的对话记录重建窗口（例如撤销最近一轮之后），结果与逐轮追加相同"""
+        self.clear()
+        for text in (turns[-self.max_turns:] if self.max_turns is not None else turns):
+            self.append(text)
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def __iter__(self) -> Iterator[str]:
+        return (text for text, _ in self._turns)
+
+
+@contextmanager
+def rollback_on_abort(conversation_history: List[str], history_buffer: TokenBudgetHistory) -> Iterator[None]:
+    """
+    流式生成器被提前关闭（GeneratorExit）或任务被取消时，撤销期间记录的客户输入
+
+    只撤销本轮唯一新增的一条记录；之后已经有新的记录（例如生成器很久以后才被回收）时保持不变。
+    """
+    history_length = len(conversation_history)
+    try:
+        yield
+    except (GeneratorExit, asyncio.CancelledError):
+        if len(conversation_history) == history_length + 1:
+            conversation_history.pop()
+            history_buffer.rebuild(conversation_history)
+        raise
@@ -0,0 +1,135 @@
+"""
+多关键词匹配器
+=============
+
+基于 Aho-Corasick 自动机的多模式匹配：关键词表只编译一次，
+之后每次查询只需扫描一遍文本即可找出全部命中的关键词，
+耗时与关键词数量无关，适合关键词和产品数量很大的知识库。
+"""
+
+from collections import deque
+from typing import Dict, Hashable, List, Tuple
+
+
+class KeywordMatcher:
+    """Aho-Corasick 多关键词匹配器
+
+    每个关键词可以关联多个标签（例如产品名或信息类型），
+    match() 返回每个标签命中的关键词。
+    """
+
+    def __init__(self, case_sensitive: bool = False):
+        self.case_sensitive = case_sensitive
+        # 自动机节点：转移表、失败指针、以该节点结尾的关键词编号
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        self._keywords: List[str] = []
+        self._labels: List[List[Hashable]] = []
+        self._keyword_ids: Dict[str, int] = {}
+        self._built = False
+
+    @classmethod
+    def from_mapping(cls, mapping: Dict[Hashable, List[str]], case_sensitive: bool = False) -> "KeywordMatcher":
+        """从 {标签: [关键词, ...]} 构建匹配器"""
+        matcher = cls(case_sensitive)
+        for label, keywords in mapping.items():
+            for keyword in keywords:
+                matcher.add(keyword, label)
+        matcher.build()
+        return matcher
+
+    def _normalize(self, text: str) -> str:
+        return text if self.case_sensitive else text.lower()
+
+    def add(self, keyword: str, label: Hashable):
+        """添加关键词及其标签，添加完成后需要调用 build()"""
+        keyword = self._normalize(keyword)
+        if not keyword:
+            return
+
+        keyword_id = self._keyword_ids.get(keyword)
+        if keyword_id is not None:
+            if label not in self._labels[keyword_id]:
+                self._labels[keyword_id].append(label)
+            return
+
+        keyword_id = len(self._keywords)
+        self._keyword_ids[keyword] = keyword_id
+        self._keywords.append(keyword)
+        self._labels.append([label])
+
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(keyword_id)
+        self._built = False
+
+    def build(self):
+        """按广度优先计算失败指针，并合并输出"""
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+        self._built = True
+
+    def find_all(self, text: str) -> List[Tuple[int, str]]:
+        """扫描一遍文本，返回全部命中 (结束位置, 关键词)，包括相互重叠的命中"""
+        if not self._built:
+            self.build()
+
+        hits = []
+        node = 0
+        for position, char in enumerate(self._normalize(text)):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for keyword_id in self._output[node]:
+                hits.append((position, self._keywords[keyword_id]))
+        return hits
+
+    def match(self, text: str) -> Dict[Hashable, List[str]]:
+        """返回 {标签: [命中的关键词, ...]}，每个关键词只计一次"""
+        matched: Dict[Hashable, List[str]] = {}
+        seen = set()
+        for _, keyword in self.find_all(text):
+            if keyword in seen:
+                continue
+            seen.add(keyword)
+            for label in self._labels[self._keyword_ids[keyword]]:
+                matched.setdefault(label, []).append(keyword)
+        return matched
+
+    def label_count(self, keyword: str) -> int:
+        """关键词关联的标签数量，用于衡量关键词的区分度"""
+        keyword_id = self._keyword_ids.get(self._normalize(keyword))
+        return len(self._labels[keyword_id]) if keyword_id is not None else 0
+
+    def score(self, keywords: List[str]) -> Tuple[int, float]:
+        """命中得分：(命中关键词数, 特异度)
+
+        特异度为各关键词长度除以其关联标签数之和——越长、越专属的关键词越具体。
+        """
+        specificity = sum(len(keyword) / max(self.label_count(keyword), 1) for keyword in keywords)
+        return len(keywords), specificity
+
+    def __len__(self) -> int:
+        return len(self._keywords)
@@ -0,0 +1,103 @@
+"""
+产品结构化事实索引
+================
+
+从 data/product_summary.json 加载产品参数（价格、续航等），把产品名和属性的别名
+预先编译成多关键词匹配器。价格、续航、配置这类问题直接用索引中的原始数据回答，
+只需一次文本扫描（微秒级），不再经过向量检索和 RetrievalQA 的LLM调用；
+没有命中结构化事实时才回退到原有的知识检索。
+"""
+
+import json
+import os
+import re
+from typing import Dict, List, Tuple
+
+from keyword_matcher import KeywordMatcher
+
+DEFAULT_SUMMARY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "product_summary.json")
+
+# 属性名 -> 客户常用的问法
+DEFAULT_ATTRIBUTE_ALIASES = {
+    "价格": ["价格", "多少钱", "售价", "报价", "价位", "几万", "费用", "贵不贵"],
+    "续航": ["续航", "里程", "能跑多远", "跑多远", "纯电", "充一次电"],
+    "基本信息": ["基本信息", "车型", "几座", "座位", "级别", "什么车", "增程", "动力"],
+    "亮点": ["亮点", "特色", "优势", "卖点", "智能驾驶", "智驾", "座舱"]
+}
+
+# 形如“问界M7”的产品名，型号部分单独作为别名
+MODEL_CODE_PATTERN = re.compile(r"^([\u4e00-\u9fff]+)\s*([A-Za-z0-9][A-Za-z0-9\-]*)$")
+
+
+class ProductFactIndex:
+    """产品结构化事实索引"""
+
+    def __init__(self, products: Dict[str, Dict[str, str]], attribute_aliases: Dict[str, List[str]] = None,
+                 product_aliases: Dict[str, List[str]] = None):
+        """
+        Args:
+            products: {产品名: {属性名: 属性值}}
+            attribute_aliases: {属性名: [别名, ...]}，默认使用 DEFAULT_ATTRIBUTE_ALIASES
+            product_aliases: 额外的 {产品名: [别名, ...]}
+        """
+        self.products = products
+
+        product_keywords = {product: self._default_product_aliases(product) for product in products}
+        for product, aliases in (product_aliases or {}).items():
+            if product in product_keywords:
+                product_keywords[product].extend(aliases)
+        self.product_matcher = KeywordMatcher.from_mapping(product_keywords)
+
+        # 属性名本身也是别名
+        attribute_aliases = attribute_aliases or DEFAULT_ATTRIBUTE_ALIASES
+        attributes = {attribute for facts in products.values() for attribute in facts}
+        attribute_keywords = {attribute: [attribute] + list(attribute_aliases.get(attribute, []))
+                              for attribute in sorted(attributes)}
+        self.attribute_matcher = KeywordMatcher.from_mapping(attribute_keywords)
+
+    @classmethod
+    def load(cls, summary_file: str = DEFAULT_SUMMARY_FILE, **kwargs) -> "ProductFactIndex":
+        """从产品摘要JSON加载索引，文件不存在时返回空索引"""
+        products = {}
+        if os.path.exists(summary_file):
+            with open(summary_file, 'r', encoding='utf-8') as f:
+                products = json.load(f)
+        return cls(products, **kwargs)
+
+    @staticmethod
+    def _default_product_aliases(product: str) -> List[str]:
+        """产品名本身、去掉空格的写法，以及型号部分（问界M7 -> M7、问界 M7）"""
+        aliases = [product, product.replace(" ", "")]
+        match = MODEL_CODE_PATTERN.match(product)
+        if match:
+            brand, model_code = match.groups()
+            aliases += [model_code, f"{brand} {model_code}"]
+        return aliases
+
+    def lookup(self, question: str) -> List[Tuple[str, str, str]]:
+        """查找问题涉及的事实，返回 [(产品名, 属性名, 属性值), ...]；没有命中时返回空列表"""
+        if not question or not self.products:
+            return []
+
+        # 必须提到具体产品；只问属性（例如“你们的产品多少钱”）时交给原有的知识检索
+        products = list(self.product_matcher.match(question))
+        if not products:
+            return []
+        attributes = list(self.attribute_matcher.match(question))
+
+        facts = []
+        for product in products:
+            product_facts = self.products[product]
+            # 只提到产品时返回该产品的全部事实
+            for attribute in attributes or list(product_facts):
+                if attribute in product_facts:
+                    facts.append((product, attribute, product_facts[attribute]))
+        return facts
+
+    def answer(self, question: str) -> str:
+        """把命中的事实格式化为可以直接注入提示词的文本，没有命中时返回空字符串"""
+        facts = self.lookup(question)
+        return "；".join(f"{product} {attribute}：{value}" for product, attribute, value in facts)
+
+    def __len__(self) -> int:
+        return len(self.products)
@@ -0,0 +1,100 @@
+"""
+提示词分段缓存
+============
+
+企业版每轮对话都要把销售人员信息、阶段表和客户档案重新格式化进提示词，
+客户档案还会在阶段分析和回复生成中各格式化一次。这些片段在大多数轮次中并不变化。
+
+PromptAssembler 把提示词拆成静态片段和动态片段：
+- 销售人员信息和阶段表在创建时渲染一次，作为 PromptTemplate 的 partial_variables
+- 客户档案按客户缓存渲染结果，以客户档案版本号（CustomerManager 在档案变化时递增）作为缓存键
+- 只有阶段、知识和对话历史每轮重新填入
+
+同一轮中渲染好的客户档案在阶段分析链和回复链之间复用。
+客户档案缓存按最近使用顺序最多保留 max_customers 个客户，会话关闭时移除该客户的缓存。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from combined_reply import format_stage_options
+
+NEW_CUSTOMER_CONTEXT = "新客户，暂无档案信息"
+MISSING_CUSTOMER_CONTEXT = "客户信息不存在"
+
+
+def render_salesperson_block(salesperson_info: Dict[str, str]) -> str:
+    """渲染销售人员信息片段"""
+    return (f"你是{salesperson_info['name']}，{salesperson_info['role']}，"
+            f"在{salesperson_info['company']}工作，拥有{salesperson_info['experience']}。\n"
+            f"专业领域：{salesperson_info['specialization']}\n\n"
+            f"公司业务：{salesperson_info['company_business']}")
+
+
+def render_customer_block(customer) -> str:
+    """渲染客户档案片段"""
+    return "\n".join([
+        f"客户姓名：{customer.name}",
+        f"公司：{customer.company}",
+        f"职位：{customer.position}",
+        f"行业：{customer.industry}",
+        f"公司规模：{customer.company_size}",
+        f"预算范围：{customer.budget_range}",
+        f"痛点：{', '.join(customer.pain_points)}",
+        f"兴趣点：{', '.join(customer.interests)}",
+        f"当前状态：{customer.status.value}"
+    ])
+
+
+class PromptAssembler:
+    """缓存提示词中的静态片段和按版本失效的客户档案片段"""
+
+    def __init__(self, salesperson_info: Dict[str, str], stages: Dict[str, str], max_customers: int = 1024):
+        """
+        Args:
+            salesperson_info: 销售人员信息（创建时渲染，之后修改不会生效）
+            stages: 阶段编号 -> 阶段说明
+            max_customers: 最多缓存的客户档案片段数，超出时淘汰最久未使用的客户
+        """
+        self.salesperson_name = salesperson_info["name"]
+        self.salesperson_block = render_salesperson_block(salesperson_info)
+        self.stage_table = format_stage_options(stages)
+        self.max_customers = max_customers
+
+        self._lock = threading.Lock()
+        # 客户ID -> (档案版本号, 渲染结果)，按最近使用排序
+        self._customer_blocks: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        self.stats = {"customer_hits": 0, "customer_renders": 0, "customer_evictions": 0}
+
+    def customer_block(self, customer_manager, customer_id: str) -> str:
+        """返回客户档案片段，档案版本号未变化时直接使用缓存"""
+        if not customer_id:
+            return NEW_CUSTOMER_CONTEXT
+
+        version = customer_manager.profile_version(customer_id)
+        with self._lock:
+            cached = self._customer_blocks.get(customer_id)
+            if cached and cached[0] == version:
+                self._customer_blocks.move_to_end(customer_id)
+                self.stats["customer_hits"] += 1
+                return cached[1]
+
+        customer = customer_manager.get_customer(customer_id)
+        if not customer:
+            return MISSING_CUSTOMER_CONTEXT
+
+        block = render_customer_block(customer)
+        with self._lock:
+            self._customer_blocks[customer_id] = (version, block)
+            self._customer_blocks.move_to_end(customer_id)
+            self.stats["customer_renders"] += 1
+            while len(self._customer_blocks) > self.max_customers:
+                self._customer_blocks.popitem(last=False)
+                self.stats["customer_evictions"] += 1
+        return block
+
+    def forget_customer(self, customer_id: str):
+        """移除客户的档案片段缓存（会话关闭时调用）"""
+        with self._lock:
+            self._customer_blocks.pop(customer_id, None)
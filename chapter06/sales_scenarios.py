@@ -0,0 +1,125 @@
+"""
+脚本化销售对话场景
+==================
+
+从 data/comprehensive_sales_data.json 读取对话场景，并补充各版本演示中使用的客户输入，
+供阶段分类器训练、离线回放基准等脚本复用。
+"""
+
+import datetime
+import json
+import os
+from typing import Any, Dict, List
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "comprehensive_sales_data.json")
+
+# 各版本演示函数中使用的客户输入
+DEMO_CONVERSATIONS = [
+    {
+        "scenario_id": "demo_enhanced",
+        "title": "制造企业效率提升咨询",
+        "customer_profile": None,
+        "turns": [
+            "你好，我想了解一下你们公司的产品",
+            "我们是一家制造企业，想要提升生产效率",
+            "具体有什么解决方案吗？价格怎么样？",
+            "听起来不错，但我担心实施起来会很复杂",
+            "需要多长时间才能看到效果？",
+            "我需要和团队讨论一下，你能提供更详细的资料吗？"
+        ]
+    },
+    {
+        "scenario_id": "demo_rag",
+        "title": "办公系统选型咨询",
+        "customer_profile": None,
+        "turns": [
+            "你好，我想了解你们的产品",
+            "我们公司需要一个办公系统，你们有什么推荐？",
+            "智能办公系统的价格怎么样？",
+            "具体有哪些功能？实施起来复杂吗？",
+            "你们的技术支持怎么样？",
+            "有没有类似的客户案例可以参考？"
+        ]
+    },
+    {
+        "scenario_id": "demo_enterprise",
+        "title": "企业级解决方案咨询",
+        "customer_profile": None,
+        "turns": [
+            "你好，我想了解你们的解决方案",
+            "我们是制造业，想要提升生产效率",
+            "具体有什么产品可以帮助我们？",
+            "价格大概是什么范围？"
+        ]
+    }
+]
+
+
+def load_scripted_conversations(data_file: str = DATA_FILE, include_demos: bool = True) -> List[Dict[str, Any]]:
+    """加载脚本化对话
+
+    Returns:
+        对话列表，每个对话包含 scenario_id、title、customer_profile、
+        turns（客户输入列表）和 expected_stages（预期阶段，没有时为None）
+    """
+    conversations = []
+
+    if os.path.exists(data_file):
+        with open(data_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        for scenario in data.get("conversation_scenarios", []):
+            flow = scenario.get("conversation_flow", [])
+            conversations.append({
+                "scenario_id": scenario["scenario_id"],
+                "title": scenario.get("title", ""),
+                "customer_profile": scenario.get("customer_profile"),
+                "turns": [turn["customer"] for turn in flow],
+                "expected_stages": [turn.get("expected_stage") for turn in flow]
+            })
+
+    if include_demos:
+        for demo in DEMO_CONVERSATIONS:
+            conversations.append({**demo, "expected_stages": [None] * len(demo["turns"])})
+
+    return conversations
+
+
+def load_customer_profiles(data_file: str = DATA_FILE) -> Dict[str, Dict[str, Any]]:
+    """加载客户画像，返回 {客户画像ID: 画像}"""
+    if not os.path.exists(data_file):
+        return {}
+
+    with open(data_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {profile["id"]: profile for profile in data.get("customer_profiles", [])}
+
+
+def register_profile_customer(module, customer_manager, profile: Dict[str, Any], customer_id: str = None) -> str:
+    """把客户画像登记到企业版（v5.0）客户库，返回客户ID
+
+    Args:
+        module: 已加载的 05_enterprise_salesGPT 模块
+        customer_manager: 企业版客户管理器
+        profile: load_customer_profiles() 返回的客户画像
+        customer_id: 客户ID，默认使用画像ID
+    """
+    customer_id = customer_id or profile["id"]
+    now = datetime.datetime.now().isoformat()
+    customer_manager.add_customer(module.CustomerProfile(
+        customer_id=customer_id,
+        name=profile.get("name", ""),
+        company="个人客户",
+        position=profile.get("occupation", ""),
+        email="",
+        phone="",
+        industry="",
+        company_size="",
+        budget_range=profile.get("income", ""),
+        pain_points=profile.get("pain_points", []),
+        interests=profile.get("preferences", []),
+        status=module.CustomerStatus.LEAD,
+        created_at=now,
+        last_contact=now
+    ))
+    return customer_id
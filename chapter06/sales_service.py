@@ -0,0 +1,419 @@
+"""
+SalesGPT 异步Web服务
+==================
+
+把 RAGEnhancedSalesGPT（v4.0）或 EnterpriseSalesGPT（v5.0）的会话挂到一个 ASGI 应用上，
+在一个进程中同时服务大量客户对话。只依赖标准库，可以用任意 ASGI 服务器运行（例如 uvicorn）：
+
+- POST   /sessions                  创建会话，请求体 {"customer_id": 可选}
+- POST   /sessions/{id}/messages    发送消息，请求体 {"message": 文本, "stream": 可选}，默认以SSE流式返回
+- GET    /sessions/{id}             会话摘要
+- DELETE /sessions/{id}             关闭会话
+- WS     /sessions/{id}/ws          WebSocket对话：发送 {"message": 文本}，逐段收到 delta，最后收到 done
+- GET    /health                    服务统计
+
+message 为 null 时由销售先开场。回复通过代理的 astream_step 生成，LLM调用不阻塞事件循环。
+
+并发控制：
+- 每个会话一把 asyncio.Lock，同一会话的消息按顺序处理；
+  排队超过 max_queued_per_session 条时返回 429
+- 全局最多 max_concurrent_turns 轮同时生成，另外最多 max_pending_turns 轮排队，
+  超出时返回 503（附 Retry-After），不再无限制地堆积请求
+- 回复逐段拉取、逐段发送，客户端读得慢时不会继续向模型拉取；
+  单次发送超过 send_timeout 秒视为慢客户端，终止本轮
+- 会话数达到 max_sessions 时先淘汰空闲超过 session_ttl_seconds 的会话
+"""
+
+import asyncio
+import enum
+import json
+import time
+import uuid
+from contextlib import aclosing, asynccontextmanager
+from dataclasses import asdict, dataclass, field, is_dataclass
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+
+class ServiceError(Exception):
+    """可以直接返回给客户端的错误"""
+
+    status = 500
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class BadRequest(ServiceError):
+    status = 400
+
+
+class SessionNotFound(ServiceError):
+    status = 404
+
+
+class SessionBusy(ServiceError):
+    status = 429
+
+
+class ServiceOverloaded(ServiceError):
+    status = 503
+
+
+@dataclass
+class ServiceSession:
+    """服务中的一个对话会话"""
+    session_id: str
+    agent: Any
+    customer_id: Optional[str] = None
+    created_at: float = field(default_factory=time.monotonic)
+    last_active: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # 正在处理和排队的消息数
+    waiting: int = 0
+    turns: int = 0
+
+
+def default_summarize(agent) -> Dict[str, Any]:
+    """v4.0 代理使用 get_conversation_summary，v5.0 会话使用 get_comprehensive_summary"""
+    if hasattr(agent, "get_comprehensive_summary"):
+        return agent.get_comprehensive_summary()
+    return agent.get_conversation_summary()
+
+
+class SalesChatService:
+    """会话管理、每会话锁和全局背压"""
+
+    def __init__(self, create_agent: Callable[[str, Optional[str]], Any],
+                 close_agent: Callable[[str], None] = None,
+                 summarize_agent: Callable[[Any], Dict[str, Any]] = default_summarize,
+                 max_sessions: int = 10000, max_concurrent_turns: int = 64, max_pending_turns: int = 256,
+                 max_queued_per_session: int = 1, session_ttl_seconds: float = 1800.0,
+                 send_timeout: float = 10.0):
+        """
+        Args:
+            create_agent: (session_id, customer_id) -> 代理，应只创建会话状态、共享知识库等重量级资源
+            close_agent: 关闭会话时的回调（例如 EnterpriseSalesHost.close_session）
+            summarize_agent: 代理 -> 摘要字典
+            max_sessions: 最多同时存在的会话数
+            max_concurrent_turns: 最多同时生成回复的轮数
+            max_pending_turns: 等待生成的最多轮数，超出时拒绝新消息
+            max_queued_per_session: 每个会话在当前这轮之外最多排队的消息数
+            session_ttl_seconds: 空闲超过该时长的会话在会话数满时被淘汰
+            send_timeout: 单次向客户端发送的超时（秒）
+        """
+        self.create_agent = create_agent
+        self.close_agent = close_agent
+        self.summarize_agent = summarize_agent
+        self.max_sessions = max_sessions
+        self.max_concurrent_turns = max_concurrent_turns
+        self.max_pending_turns = max_pending_turns
+        self.max_queued_per_session = max_queued_per_session
+        self.session_ttl_seconds = session_ttl_seconds
+        self.send_timeout = send_timeout
+
+        self.sessions: Dict[str, ServiceSession] = {}
+        self._turn_slots = asyncio.Semaphore(max_concurrent_turns)
+        # 已接纳但尚未完成的轮数（包括排队中的）
+        self.pending_turns = 0
+        self.stats = {"sessions_created": 0, "sessions_evicted": 0, "turns": 0, "rejected_busy": 0,
+                      "rejected_overloaded": 0, "slow_client_aborts": 0, "client_disconnects": 0}
+
+    # ---- 会话管理 ----
+
+    def create_session(self, customer_id: str = None) -> ServiceSession:
+        """创建会话，会话数已满且没有可淘汰的空闲会话时拒绝"""
+        if len(self.sessions) >= self.max_sessions:
+            self._evict_idle_sessions()
+        if len(self.sessions) >= self.max_sessions:
+            self.stats["rejected_overloaded"] += 1
+            raise ServiceOverloaded("会话数已达上限", retry_after=self.session_ttl_seconds)
+
+        session_id = uuid.uuid4().hex
+        session = ServiceSession(session_id, self.create_agent(session_id, customer_id), customer_id)
+        self.sessions[session_id] = session
+        self.stats["sessions_created"] += 1
+        return session
+
+    def get_session(self, session_id: str) -> ServiceSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise SessionNotFound(f"会话不存在: {session_id}")
+        return session
+
+    def close_session(self, session_id: str):
+        """关闭会话；正在处理的消息会正常结束"""
+        self.get_session(session_id)
+        self._drop_session(session_id)
+
+    def _drop_session(self, session_id: str):
+        self.sessions.pop(session_id, None)
+        if self.close_agent:
+            self.close_agent(session_id)
+
+    def _evict_idle_sessions(self):
+        """淘汰空闲超时且没有进行中消息的会话"""
+        deadline = time.monotonic() - self.session_ttl_seconds
+        for session_id, session in list(self.sessions.items()):
+            if session.waiting == 0 and session.last_active < deadline:
+                self._drop_session(session_id)
+                self.stats["sessions_evicted"] += 1
+
+    def summary(self, session_id: str) -> Dict[str, Any]:
+        session = self.get_session(session_id)
+        return {"session_id": session_id, "customer_id": session.customer_id, "turns": session.turns,
+                "summary": self.summarize_agent(session.agent)}
+
+    # ---- 对话 ----
+
+    @asynccontextmanager
+    async def turn(self, session: ServiceSession):
+        """接纳一轮对话：先检查排队上限，再依次等待会话锁和全局生成名额"""
+        if session.waiting > self.max_queued_per_session:
+            self.stats["rejected_busy"] += 1
+            raise SessionBusy("该会话还有消息正在处理", retry_after=1.0)
+        if self.pending_turns >= self.max_concurrent_turns + self.max_pending_turns:
+            self.stats["rejected_overloaded"] += 1
+            raise ServiceOverloaded("服务繁忙，请稍后重试", retry_after=1.0)
+
+        session.waiting += 1
+        self.pending_turns += 1
+        try:
+            async with session.lock, self._turn_slots:
+                yield
+        finally:
+            session.waiting -= 1
+            self.pending_turns -= 1
+            session.last_active = time.monotonic()
+
+    async def stream_reply(self, session: ServiceSession, message: Optional[str]) -> AsyncIterator[str]:
+        """逐段生成回复，调用方需要先进入 turn(session)"""
+        session.last_active = time.monotonic()
+        # 调用方提前退出时关闭代理的生成器，及时结束模型流
+        async with aclosing(session.agent.astream_step(message)) as replies:
+            async for text in replies:
+                yield text
+        session.turns += 1
+        self.stats["turns"] += 1
+
+    async def send(self, send: Callable, event: Dict[str, Any]):
+        """带超时的发送，客户端长时间不读取时抛出 asyncio.TimeoutError"""
+        try:
+            await asyncio.wait_for(send(event), self.send_timeout)
+        except asyncio.TimeoutError:
+            self.stats["slow_client_aborts"] += 1
+            raise
+
+    def health(self) -> Dict[str, Any]:
+        return {"sessions": len(self.sessions), "pending_turns": self.pending_turns,
+                "max_concurrent_turns": self.max_concurrent_turns, **self.stats}
+
+
+# ---- ASGI ----
+
+def format_sse(event: str, data: Dict[str, Any]) -> bytes:
+    """格式化一条SSE事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _json_default(value):
+    """摘要中的枚举输出其值，dataclass 输出字段字典"""
+    if isinstance(value, enum.Enum):
+        return value.value
+    if is_dataclass(value):
+        return asdict(value)
+    return str(value)
+
+
+def _json_headers(extra: List[Tuple[bytes, bytes]] = ()) -> List[Tuple[bytes, bytes]]:
+    return [(b"content-type", b"application/json; charset=utf-8"), *extra]
+
+
+async def _send_json(send: Callable, status: int, payload: Dict[str, Any],
+                     headers: List[Tuple[bytes, bytes]] = ()):
+    body = json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": _json_headers([(b"content-length", str(len(body)).encode()), *headers])})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_error(send: Callable, error: ServiceError):
+    headers = []
+    if error.retry_after is not None:
+        headers.append((b"retry-after", str(max(1, int(error.retry_after))).encode()))
+    await _send_json(send, error.status, {"error": error.message}, headers)
+
+
+async def _read_json(receive: Callable) -> Dict[str, Any]:
+    chunks = []
+    while True:
+        event = await receive()
+        if event["type"] == "http.disconnect":
+            break
+        chunks.append(event.get("body", b""))
+        if not event.get("more_body"):
+            break
+    raw = b"".join(chunks)
+    if not raw:
+        return {}
+    try:
+        payload = json.loads(raw)
+    except ValueError:
+        raise BadRequest("请求体不是合法的JSON")
+    if not isinstance(payload, dict):
+        raise BadRequest("请求体必须是JSON对象")
+    return payload
+
+
+def _message_from(payload: Dict[str, Any]) -> Optional[str]:
+    message = payload.get("message")
+    if message is not None and not isinstance(message, str):
+        raise BadRequest("message 必须是字符串或 null")
+    return message
+
+
+class SalesASGIApp:
+    """SalesChatService 的 ASGI 入口"""
+
+    def __init__(self, service: SalesChatService):
+        self.service = service
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        parts = [part for part in scope["path"].split("/") if part]
+        if scope["type"] == "websocket":
+            if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "ws":
+                await self._websocket(parts[1], receive, send)
+            else:
+                await send({"type": "websocket.close", "code": 4404})
+            return
+
+        try:
+            await self._http(scope, parts, receive, send)
+        except ServiceError as e:
+            await _send_error(send, e)
+
+    async def _lifespan(self, receive: Callable, send: Callable):
+        while True:
+            event = await receive()
+            if event["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif event["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope: Dict[str, Any], parts: List[str], receive: Callable, send: Callable):
+        method = scope["method"]
+        service = self.service
+
+        if parts == ["health"] and method == "GET":
+            await _send_json(send, 200, service.health())
+        elif parts == ["sessions"] and method == "POST":
+            payload = await _read_json(receive)
+            session = service.create_session(payload.get("customer_id"))
+            await _send_json(send, 201, {"session_id": session.session_id, "customer_id": session.customer_id})
+        elif len(parts) == 2 and parts[0] == "sessions" and method == "GET":
+            await _send_json(send, 200, service.summary(parts[1]))
+        elif len(parts) == 2 and parts[0] == "sessions" and method == "DELETE":
+            service.close_session(parts[1])
+            await _send_json(send, 200, {"session_id": parts[1], "closed": True})
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages" and method == "POST":
+            session = service.get_session(parts[1])
+            payload = await _read_json(receive)
+            query = parse_qs(scope.get("query_string", b"").decode())
+            stream = payload.get("stream", query.get("stream", ["1"])[0] not in ("0", "false"))
+            await self._message(session, _message_from(payload), bool(stream), receive, send)
+        else:
+            await _send_json(send, 404, {"error": f"未知路径: {method} {scope['path']}"})
+
+    async def _message(self, session: ServiceSession, message: Optional[str], stream: bool,
+                       receive: Callable, send: Callable):
+        """处理一条HTTP消息：stream 为 True 时以SSE逐段返回，否则返回完整回复"""
+        service = self.service
+        async with service.turn(session):
+            if not stream:
+                chunks = [text async for text in service.stream_reply(session, message)]
+                await _send_json(send, 200, {"reply": "".join(chunks).strip(),
+                                             "stage": session.agent.current_stage})
+                return
+
+            # 后台等待 http.disconnect，客户端断开后不再继续生成
+            disconnected = asyncio.Event()
+
+            async def watch_disconnect():
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+                disconnected.set()
+
+            watcher = asyncio.create_task(watch_disconnect())
+            try:
+                await service.send(send, {"type": "http.response.start", "status": 200, "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache")]})
+                chunks = []
+                async with aclosing(service.stream_reply(session, message)) as replies:
+                    async for text in replies:
+                        if disconnected.is_set():
+                            service.stats["client_disconnects"] += 1
+                            return
+                        chunks.append(text)
+                        await service.send(send, {"type": "http.response.body", "more_body": True,
+                                                  "body": format_sse("delta", {"text": text})})
+                await service.send(send, {"type": "http.response.body", "more_body": False, "body": format_sse(
+                    "done", {"reply": "".join(chunks).strip(), "stage": session.agent.current_stage})})
+            except asyncio.TimeoutError:
+                return
+            finally:
+                watcher.cancel()
+
+    async def _websocket(self, session_id: str, receive: Callable, send: Callable):
+        """WebSocket对话：同一连接上的消息逐条处理，上一轮结束前不读取下一条"""
+        service = self.service
+        event = await receive()
+        if event["type"] != "websocket.connect":
+            return
+        session = service.sessions.get(session_id)
+        if session is None:
+            await send({"type": "websocket.close", "code": 4404})
+            return
+        await send({"type": "websocket.accept"})
+
+        async def send_json(payload: Dict[str, Any]):
+            await service.send(send, {"type": "websocket.send", "text": json.dumps(payload, ensure_ascii=False)})
+
+        try:
+            while True:
+                event = await receive()
+                if event["type"] == "websocket.disconnect":
+                    return
+                try:
+                    payload = json.loads(event.get("text") or event.get("bytes") or "{}")
+                    if not isinstance(payload, dict):
+                        raise BadRequest("消息必须是JSON对象")
+                    message = _message_from(payload)
+                    async with service.turn(session):
+                        chunks = []
+                        async with aclosing(service.stream_reply(session, message)) as replies:
+                            async for text in replies:
+                                chunks.append(text)
+                                await send_json({"type": "delta", "text": text})
+                        await send_json({"type": "done", "reply": "".join(chunks).strip(),
+                                         "stage": session.agent.current_stage})
+                except ValueError:
+                    await send_json({"type": "error", "status": 400, "error": "消息不是合法的JSON"})
+                except ServiceError as e:
+                    await send_json({"type": "error", "status": e.status, "error": e.message,
+                                     "retry_after": e.retry_after})
+        except asyncio.TimeoutError:
+            await send({"type": "websocket.close", "code": 1008})
+        except (ConnectionError, OSError):
+            service.stats["client_disconnects"] += 1
+
+
+def create_asgi_app(service: SalesChatService) -> SalesASGIApp:
+    """创建 ASGI 应用"""
+    return SalesASGIApp(service)
@@ -0,0 +1,174 @@
+"""
+知识问答语义缓存
+==============
+
+客户每天会用略有不同的说法问同样的产品问题，每次都要经过一次 RetrievalQA
+（向量检索 + LLM生成）。SemanticAnswerCache 放在知识库 query() 前面：
+把问题嵌入为向量，在进程内的小型向量索引中找最相似的已缓存问题，
+余弦相似度超过阈值时直接返回缓存的答案。
+
+- 向量预先归一化并存放在一个 numpy 矩阵中，查询只需一次矩阵-向量乘法
+- 按最近使用顺序（LRU）淘汰，条目超过 ttl_seconds 后过期
+- 缓存绑定知识库的索引键（知识文件内容哈希），索引键变化时清空
+- 统计命中、未命中、淘汰和过期次数
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+@dataclass
+class CacheEntry:
+    """一条缓存的问答"""
+    question: str
+    answer: str
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """基于问题向量相似度的答案缓存"""
+
+    def __init__(self, embeddings=None, similarity_threshold: float = 0.92, max_entries: int = 256,
+                 ttl_seconds: Optional[float] = 3600):
+        """
+        Args:
+            embeddings: 嵌入模型，也可以稍后通过 bind() 设置
+            similarity_threshold: 命中所需的最低余弦相似度
+            max_entries: 最多缓存的问答数，为0时禁用缓存
+            ttl_seconds: 条目的有效期（秒），None 表示不过期
+        """
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.index_key = None
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # (max_entries, 维度)，按槽位存放
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()  # 槽位 -> 条目，按最近使用排序
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.embeddings is not None and self.max_entries > 0
+
+    def bind(self, embeddings, index_key: str):
+        """绑定知识库的嵌入模型和索引键；索引键变化（知识文件已修改）时清空缓存"""
+        with self._lock:
+            if self.index_key is not None and index_key != self.index_key:
+                self._clear_locked()
+                self._stats["invalidations"] += 1
+            self.embeddings = embeddings
+            self.index_key = index_key
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._clear_locked()
+
+    def _clear_locked(self):
+        self._vectors = None
+        self._valid[:] = False
+        self._entries.clear()
+
+    @staticmethod
+    def _normalize(vector) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return vector / norm
+
+    def embed(self, question: str) -> Optional[np.ndarray]:
+        """把问题嵌入为归一化向量；缓存未启用或嵌入失败时返回 None"""
+        if not self.enabled or not question:
+            return None
+        try:
+            return self._normalize(self.embeddings.embed_query(question))
+        except Exception as e:
+            print(f"语义缓存嵌入失败: {e}")
+            return None
+
+    async def aembed(self, question: str) -> Optional[np.ndarray]:
+        """异步嵌入问题"""
+        if not self.enabled or not question:
+            return None
+        try:
+            return self._normalize(await self.embeddings.aembed_query(question))
+        except Exception as e:
+            print(f"语义缓存嵌入失败: {e}")
+            return None
+
+    def _is_expired(self, entry: CacheEntry, now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry.created_at > self.ttl_seconds
+
+    def _remove_locked(self, slot: int):
+        self._valid[slot] = False
+        del self._entries[slot]
+
+    def get(self, vector: Optional[np.ndarray]) -> Optional[str]:
+        """查找与问题向量最相似的缓存答案，相似度低于阈值时返回 None"""
+        if vector is None:
+            return None
+
+        with self._lock:
+            now = time.monotonic()
+            while self._entries and self._vectors is not None and vector.shape[0] == self._vectors.shape[1]:
+                scores = self._vectors @ vector
+                scores[~self._valid] = -np.inf
+                slot = int(np.argmax(scores))
+                if scores[slot] < self.similarity_threshold:
+                    break
+
+                entry = self._entries[slot]
+                if self._is_expired(entry, now):
+                    # 过期条目不再参与匹配，继续找次相似的条目
+                    self._remove_locked(slot)
+                    self._stats["expirations"] += 1
+                    continue
+
+                self._entries.move_to_end(slot)
+                self._stats["hits"] += 1
+                return entry.answer
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, question: str, vector: Optional[np.ndarray], answer: str):
+        """缓存一条问答，缓存已满时淘汰最久未使用的条目"""
+        if vector is None or not answer:
+            return
+
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._clear_locked()
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+            if len(self._entries) >= self.max_entries:
+                oldest_slot = next(iter(self._entries))
+                self._remove_locked(oldest_slot)
+                self._stats["evictions"] += 1
+
+            slot = int(np.argmin(self._valid))
+            self._vectors[slot] = vector
+            self._valid[slot] = True
+            self._entries[slot] = CacheEntry(question, answer, time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中统计"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "size": len(self._entries),
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,163 @@
+"""
+本地销售阶段分类器
+==================
+
+SalesGPT v2.0 - v5.0 每轮对话都要调用一次LLM来判断销售阶段（只输出数字1-7）。
+本模块提供一个可插拔的本地分类器：字符 n-gram TF-IDF + 逻辑回归，
+使用 (conversation_history, stage) 样本训练，预测时返回阶段和置信度。
+置信度达到阈值时直接采用本地结果，否则由调用方回退到LLM阶段分析链。
+
+训练样本可以从现有LLM阶段分析器的输出中采集，
+参见 08_train_stage_classifier.py。
+
+LocalFirstStageAnalysis 封装 v2.0 - v5.0 阶段分析器共用的 "本地分类器优先、LLM兜底" 逻辑：
+本地判断、LLM调用计数和样本记录。
+
+依赖要求：
+pip install scikit-learn
+"""
+
+import json
+import os
+import pickle
+from typing import Container, List, Optional, Tuple
+
+from token_accounting import record_cache_hit
+
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    SKLEARN_AVAILABLE = True
+except ImportError:
+    SKLEARN_AVAILABLE = False
+
+
+class LocalStageClassifier:
+    """基于字符 n-gram TF-IDF 和线性模型的阶段分类器"""
+
+    def __init__(self, confidence_threshold: float = 0.6, max_history_chars: int = 600,
+                 ngram_range: Tuple[int, int] = (1, 3)):
+        """初始化分类器
+
+        Args:
+            confidence_threshold: 置信度阈值，低于该值时应回退到LLM
+            max_history_chars: 只使用对话历史末尾的字符，最近几轮最能反映当前阶段
+            ngram_range: 字符 n-gram 范围，中文不需要分词
+        """
+        self.confidence_threshold = confidence_threshold
+        self.max_history_chars = max_history_chars
+        self.ngram_range = ngram_range
+        self.pipeline = None
+
+    @property
+    def is_trained(self) -> bool:
+        """是否已完成训练"""
+        return self.pipeline is not None
+
+    def _prepare_text(self, conversation_history: str) -> str:
+        """截取对话历史末尾作为特征文本"""
+        return conversation_history[-self.max_history_chars:]
+
+    def train(self, samples: List[Tuple[str, str]]) -> "LocalStageClassifier":
+        """使用 (conversation_history, stage) 样本训练分类器"""
+        if not SKLEARN_AVAILABLE:
+            raise ImportError("本地阶段分类器需要 scikit-learn：pip install scikit-learn")
+
+        texts = [self._prepare_text(history) for history, _ in samples]
+        labels = [stage for _, stage in samples]
+        if len(set(labels)) < 2:
+            raise ValueError("训练样本至少需要包含两个不同的阶段")
+
+        self.pipeline = make_pipeline(
+            TfidfVectorizer(analyzer="char_wb", ngram_range=self.ngram_range, sublinear_tf=True),
+            LogisticRegression(max_iter=1000)
+        )
+        self.pipeline.fit(texts, labels)
+        return self
+
+    def predict(self, conversation_history: str) -> Tuple[Optional[str], float]:
+        """预测阶段，返回 (阶段, 置信度)；未训练时返回 (None, 0.0)"""
+        if not self.is_trained:
+            return None, 0.0
+
+        probabilities = self.pipeline.predict_proba([self._prepare_text(conversation_history)])[0]
+        best = probabilities.argmax()
+        return str(self.pipeline.classes_[best]), float(probabilities[best])
+
+    def save(self, path: str):
+        """导出模型到文件"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalStageClassifier":
+        """从文件加载模型（只加载自己导出的模型文件）"""
+        with open(path, 'rb') as f:
+            classifier = pickle.load(f)
+        if not isinstance(classifier, cls):
+            raise TypeError(f"{path} 不是阶段分类器模型文件")
+        return classifier
+
+
+class LocalFirstStageAnalysis:
+    """本地分类器优先、LLM兜底的阶段判断：负责本地判断、调用统计和样本记录"""
+
+    def __init__(self, valid_stages: Container[str], classifier: Optional[LocalStageClassifier] = None,
+                 label_log_path: str = None):
+        """
+        Args:
+            valid_stages: 有效的阶段编号（例如 SALES_STAGES）
+            classifier: 可选的本地分类器，置信度足够时跳过LLM调用
+            label_log_path: 可选的样本日志，记录LLM给出的有效阶段，用于训练本地分类器
+        """
+        self.valid_stages = valid_stages
+        self.classifier = classifier
+        self.label_log_path = label_log_path
+        # classifier: 本地分类器给出的阶段数；llm: LLM阶段判断的调用次数（包括无效输出和失败）；
+        # sticky: 阶段粘滞策略跳过的轮数（由阶段分析器累加）
+        self.stats = {"classifier": 0, "llm": 0, "sticky": 0}
+
+    def classify(self, conversation_history: str) -> Optional[str]:
+        """使用本地分类器判断阶段，未配置分类器或置信度不足时返回None"""
+        if self.classifier is None:
+            return None
+
+        stage, confidence = self.classifier.predict(conversation_history)
+        if stage in self.valid_stages and confidence >= self.classifier.confidence_threshold:
+            self.stats["classifier"] += 1
+            record_cache_hit("stage_classifier")
+            return stage
+        return None
+
+    def record_llm_stage(self, conversation_history: str, stage: Optional[str]):
+        """记录一次LLM阶段判断；stage 为 None（调用失败）或无效时只计数，不写入样本"""
+        self.stats["llm"] += 1
+        if self.label_log_path and stage in self.valid_stages:
+            append_training_sample(self.label_log_path, conversation_history, stage)
+
+
+def append_training_sample(log_path: str, conversation_history: str, stage: str):
+    """把一条 (conversation_history, stage) 样本追加到JSONL日志"""
+    directory = os.path.dirname(log_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(log_path, 'a', encoding='utf-8') as f:
+        record = {"conversation_history": conversation_history, "stage": stage}
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def load_training_samples(log_path: str) -> List[Tuple[str, str]]:
+    """从JSONL日志读取训练样本"""
+    samples = []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            samples.append((record["conversation_history"], record["stage"]))
+    return samples
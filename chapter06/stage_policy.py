@@ -0,0 +1,97 @@
+"""
+阶段粘滞策略
+==========
+
+销售阶段在相邻几轮中很少变化，但每轮都要付出一次阶段分析（LLM调用或本地分类）。
+StageStickinessPolicy 放在阶段分析前面：客户的新消息没有阶段转换信号时直接沿用
+上一轮的阶段，跳过本轮分析。
+
+转换信号只用廉价的词法和长度特征：
+- 命中需求、方案、价格、异议、成交等关键词（预先编译为 KeywordMatcher）
+- 消息长度达到 long_message_chars（长消息通常带来新信息）
+
+对话中还没有分析过任何客户轮次时（阶段仍是开场白的阶段1）总是分析，不沿用；
+连续沿用达到 max_sticky_turns 轮后强制重新分析，避免阶段长期停滞。
+策略对象只保存配置和汇总统计，可以在多个会话之间共享；
+每个对话连续沿用的轮数由调用方（StageAnalyzer 或会话）保存。
+"""
+
+import threading
+from typing import Dict, List, Optional
+
+from keyword_matcher import KeywordMatcher
+
+# 信号类别 -> 关键词
+DEFAULT_TRANSITION_KEYWORDS: Dict[str, List[str]] = {
+    "需求": ["需要", "需求", "预算", "想要", "打算", "计划", "我们是", "我们公司", "规模", "主要用"],
+    "方案": ["方案", "功能", "配置", "推荐", "案例", "区别", "对比", "优势", "怎么样", "有什么", "有哪些"],
+    "价格": ["价格", "多少钱", "报价", "优惠", "折扣", "费用", "贵"],
+    "异议": ["担心", "但是", "不过", "顾虑", "风险", "复杂", "不确定", "犹豫", "麻烦", "安全吗", "竞品"],
+    "成交": ["合同", "签约", "下单", "购买", "试用", "试驾", "付款", "下一步", "安排", "资料", "讨论", "决定"]
+}
+
+
+class StageStickinessPolicy:
+    """客户消息没有阶段转换信号时沿用上一轮阶段"""
+
+    def __init__(self, max_sticky_turns: int = 2, long_message_chars: int = 30,
+                 transition_keywords: Dict[str, List[str]] = None):
+        """
+        Args:
+            max_sticky_turns: 最多连续沿用的轮数，达到后强制重新分析
+            long_message_chars: 消息长度达到该值时视为有转换信号
+            transition_keywords: {信号类别: [关键词, ...]}，默认使用 DEFAULT_TRANSITION_KEYWORDS
+        """
+        self.max_sticky_turns = max_sticky_turns
+        self.long_message_chars = long_message_chars
+        self.matcher = KeywordMatcher.from_mapping(transition_keywords or DEFAULT_TRANSITION_KEYWORDS)
+
+        self._lock = threading.Lock()
+        self.stats = {"skipped": 0, "initial": 0, "forced": 0, "keyword": 0, "length": 0}
+
+    def transition_signal(self, user_input: Optional[str]) -> Optional[str]:
+        """返回消息中的转换信号（"keyword:类别" 或 "length"），没有信号时返回 None"""
+        if not user_input:
+            return None
+        if len(user_input) >= self.long_message_chars:
+            return "length"
+        labels = self.matcher.match(user_input)
+        if labels:
+            return f"keyword:{next(iter(labels))}"
+        return None
+
+    def should_reuse(self, user_input: Optional[str], sticky_turns: int, stage_analyzed: bool = True) -> bool:
+        """判断本轮能否沿用上一轮阶段
+
+        Args:
+            user_input: 本轮客户消息
+            sticky_turns: 该对话已经连续沿用的轮数
+            stage_analyzed: 该对话是否已经分析过客户轮次；还没有时当前阶段只是初始阶段，必须分析
+        """
+        if not stage_analyzed:
+            self._count("initial")
+            return False
+
+        if sticky_turns >= self.max_sticky_turns:
+            self._count("forced")
+            return False
+
+        signal = self.transition_signal(user_input)
+        if signal:
+            self._count(signal.split(":", 1)[0])
+            return False
+
+        self._count("skipped")
+        return True
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def summary(self) -> Dict[str, float]:
+        """跳过次数、各类重新分析的次数和跳过比例"""
+        with self._lock:
+            stats = dict(self.stats)
+        decisions = sum(stats.values())
+        stats["skip_rate"] = round(stats["skipped"] / decisions, 3) if decisions else 0.0
+        return stats
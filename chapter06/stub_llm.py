@@ -0,0 +1,162 @@
+"""
+离线桩模型
+=========
+
+不访问网络的确定性聊天模型和嵌入模型，供基准测试和回放脚本使用。
+桩模型按提示词类型返回固定格式的回复，并统计调用次数和token用量，
+便于在没有API密钥的环境中比较各版本SalesGPT的调用开销。
+
+- 阶段分析提示（包含“只回答数字1-7”）：根据对话轮数返回阶段编号
+- RetrievalQA 提示：返回一段简短的知识摘要
+- 阶段与回复合并提示（包含“第一行只写 STAGE”）：首行返回阶段编号，其后是销售回复
+- 其他提示：返回销售回复，并在 <END_OF_TURN> 之后附加多余内容，模拟模型不停止的情况
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from token_utils import estimate_tokens
+
+STAGE_PROMPT_MARKER = "只回答数字1-7"
+QA_PROMPT_MARKER = "Use the following pieces of context"
+COMBINED_PROMPT_MARKER = "第一行只写 STAGE"
+
+DEFAULT_REPLY = "您好，感谢您的关注！我们的方案可以帮助您提升效率，请问您目前最关心哪方面的问题？"
+DEFAULT_QA_ANSWER = "根据知识库，相关产品提供多个版本，可按企业规模选择，实施周期为2-6周。"
+DEFAULT_TRAILING_TEXT = "客户：好的，那我再考虑一下。"
+
+
+def respond_to_prompt(prompt: str, reply: str = DEFAULT_REPLY, qa_answer: str = DEFAULT_QA_ANSWER,
+                      trailing_text: str = DEFAULT_TRAILING_TEXT) -> str:
+    """根据提示词类型生成确定性的回复（桩模型和本地桩服务共用）"""
+    # 按客户发言次数推进阶段
+    stage = min(max(prompt.count("客户："), 1), 7)
+
+    if STAGE_PROMPT_MARKER in prompt:
+        return str(stage)
+
+    if QA_PROMPT_MARKER in prompt:
+        return qa_answer
+
+    if COMBINED_PROMPT_MARKER in prompt:
+        return f"STAGE: {stage}\n{reply}<END_OF_TURN>{trailing_text}"
+
+    return f"{reply}<END_OF_TURN>{trailing_text}"
+
+
+class StubChatModel(BaseChatModel):
+    """确定性的离线聊天模型
+
+    latency 为每次调用的模拟延迟（秒），流式输出时平均分摊到各个片段。
+    """
+
+    latency: float = 0.0
+    reply: str = DEFAULT_REPLY
+    qa_answer: str = DEFAULT_QA_ANSWER
+    trailing_text: str = DEFAULT_TRAILING_TEXT
+    chunk_size: int = 4
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _usage: Dict[str, int] = PrivateAttr(
+        default_factory=lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        """根据提示词类型生成回复"""
+        prompt = "\n".join(str(message.content) for message in messages)
+        return respond_to_prompt(prompt, self.reply, self.qa_answer, self.trailing_text)
+
+    def _record(self, messages: List[BaseMessage], text: str) -> Dict[str, int]:
+        """记录一次调用的token用量"""
+        prompt_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+        completion_tokens = estimate_tokens(text)
+        with self._lock:
+            self._usage["calls"] += 1
+            self._usage["prompt_tokens"] += prompt_tokens
+            self._usage["completion_tokens"] += completion_tokens
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    def _result(self, messages: List[BaseMessage], text: str) -> ChatResult:
+        token_usage = self._record(messages, text)
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": token_usage["prompt_tokens"],
+            "output_tokens": token_usage["completion_tokens"],
+            "total_tokens": token_usage["total_tokens"]
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)],
+                          llm_output={"token_usage": token_usage, "model_name": self._llm_type})
+
+    def _chunks(self, text: str) -> List[str]:
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._result(messages, self._respond(messages))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._result(messages, self._respond(messages))
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text = self._respond(messages)
+        chunks = self._chunks(text)
+        emitted = []
+        try:
+            for chunk in chunks:
+                if self.latency:
+                    time.sleep(self.latency / len(chunks))
+                emitted.append(chunk)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+        finally:
+            # 调用方提前关闭流时，只统计已经生成的部分
+            self._record(messages, "".join(emitted))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        text = self._respond(messages)
+        chunks = self._chunks(text)
+        emitted = []
+        try:
+            for chunk in chunks:
+                if self.latency:
+                    await asyncio.sleep(self.latency / len(chunks))
+                emitted.append(chunk)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+        finally:
+            self._record(messages, "".join(emitted))
+
+    def usage(self) -> Dict[str, int]:
+        """返回累计的调用次数和token用量"""
+        with self._lock:
+            return dict(self._usage)
+
+    def reset_usage(self):
+        """清零统计"""
+        with self._lock:
+            for key in self._usage:
+                self._usage[key] = 0
+
+
+def create_stub_embeddings(size: int = 64) -> DeterministicFakeEmbedding:
+    """创建确定性的离线嵌入模型（相同文本得到相同向量）"""
+    return DeterministicFakeEmbedding(size=size)
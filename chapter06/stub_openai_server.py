@@ -0,0 +1,232 @@
+"""
+本地 OpenAI 兼容桩服务
+====================
+
+在本机端口上提供与 OpenAI API 兼容的最小接口，供压测脚本把真实的 ChatOpenAI /
+OpenAIEmbeddings 客户端（HTTP连接池、序列化、SSE解析都照常执行）指向本地，
+不访问网络、不需要API密钥：
+
+- POST /v1/chat/completions：回复内容与 stub_llm.StubChatModel 相同，支持 stream=true（SSE）
+- POST /v1/embeddings：按文本哈希生成确定性向量
+- GET /v1/stats：各类请求的计数
+
+每个请求在独立线程中处理，latency 为每次请求的模拟延迟（流式输出时平均分摊到各个片段）。
+压测时建议用独立进程运行，避免服务线程和被测客户端争用同一个GIL：
+python stub_openai_server.py --port 8765 --latency 0.2
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from stub_llm import respond_to_prompt
+from token_utils import estimate_tokens
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    """处理 OpenAI 兼容请求"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # 压测时每秒数千个请求，不输出访问日志
+        pass
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.stub.counters())
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def do_POST(self):
+        server: "StubOpenAIServer" = self.server.stub
+        try:
+            request = self._read_json()
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            server.record("chat_requests")
+            if request.get("stream"):
+                self._stream_chat(server, request)
+            else:
+                self._complete_chat(server, request)
+        elif path.endswith("/embeddings"):
+            server.record("embedding_requests")
+            self._embed(server, request)
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    @staticmethod
+    def _prompt(request: Dict[str, Any]) -> str:
+        return "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+
+    def _complete_chat(self, server: "StubOpenAIServer", request: Dict[str, Any]):
+        prompt = self._prompt(request)
+        text = respond_to_prompt(prompt)
+        if server.latency:
+            time.sleep(server.latency)
+
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+    def _stream_chat(self, server: "StubOpenAIServer", request: Dict[str, Any]):
+        text = respond_to_prompt(self._prompt(request))
+        chunks = [text[i:i + server.chunk_size] for i in range(0, len(text), server.chunk_size)] or [""]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        # 流式响应不预先知道长度，发送完毕后关闭连接
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            for index, chunk in enumerate(chunks):
+                if server.latency:
+                    time.sleep(server.latency / len(chunks))
+                event = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub"),
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": chunk} if index == 0
+                                 else {"content": chunk}, "finish_reason": None}]
+                }
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端检测到 <END_OF_TURN> 后会提前断开
+            server.record("client_disconnects")
+
+    def _embed(self, server: "StubOpenAIServer", request: Dict[str, Any]):
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if server.latency:
+            time.sleep(server.latency)
+
+        data = [{"object": "embedding", "index": index, "embedding": server.embed(text)}
+                for index, text in enumerate(inputs)]
+        tokens = sum(estimate_tokens(str(text)) for text in inputs)
+        self._send_json(200, {"object": "list", "data": data, "model": request.get("model", "stub"),
+                              "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+
+class StubOpenAIServer:
+    """在后台线程中运行的本地 OpenAI 兼容桩服务
+
+    用法：
+        with StubOpenAIServer(latency=0.2) as server:
+            llm = ChatOpenAI(base_url=server.base_url, api_key="stub")
+    """
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0,
+                 embedding_size: int = 64, chunk_size: int = 4):
+        """
+        Args:
+            latency: 每次请求的模拟延迟（秒）
+            port: 监听端口，0 表示自动分配
+            embedding_size: 嵌入向量维度
+            chunk_size: 流式输出时每个片段的字符数
+        """
+        self.latency = latency
+        self.embedding_size = embedding_size
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._counters = {"chat_requests": 0, "embedding_requests": 0, "client_disconnects": 0}
+
+        self._httpd = ThreadingHTTPServer((host, port), _StubRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def record(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def counters(self) -> Dict[str, int]:
+        """请求计数"""
+        with self._lock:
+            return dict(self._counters)
+
+    def embed(self, text: str) -> List[float]:
+        """相同文本得到相同的向量"""
+        seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [rng.gauss(0.0, 1.0) for _ in range(self.embedding_size)]
+
+    def start(self) -> "StubOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="stub-openai-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> "StubOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    """以独立进程运行桩服务；启动后在标准输出打印一行服务地址"""
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="监听端口，0 表示自动分配")
+    parser.add_argument("--latency", type=float, default=0.0, help="每次请求的模拟延迟（秒）")
+    parser.add_argument("--embedding-size", type=int, default=64)
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(args.latency, args.host, args.port, args.embedding_size)
+    print(server.base_url, flush=True)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+token与成本核算
+=============
+
+通过 LangChain 回调记录 SalesGPT 每次LLM调用的 prompt/completion token 数、耗时和模型，
+按轮次汇总（连同语义缓存、产品参数索引等命中次数），再按会话和客户累计。
+
+用法：
+    accountant = TokenAccountant(prices={"Qwen/Qwen2.5-7B-Instruct": (0.0005, 0.0005)},
+                                 export_path="data/token_usage.jsonl")
+    with accountant.turn(session_id="s1", customer_id="CUST001"):
+        chain.invoke(inputs, config=usage_config("conversation"))
+        record_cache_hit("answer_cache")
+
+当前轮次保存在 contextvars 中：asyncio.gather 创建的任务和 asyncio.to_thread 都会继承它，
+多个会话并发时调用也能归到正确的会话。没有活动轮次时 usage_config() 返回空配置，不产生任何开销。
+
+流式生成器不能在 yield 期间保持当前轮次：生成器暂停时上下文变量仍然有效，
+同一上下文中其他会话的调用会被记到暂停的轮次上。生成器使用 stream_turn() 创建轮次，
+只在不含 yield 的代码段外用 use_turn(usage) 设为当前轮次；
+usage_config() 返回的回调直接绑定轮次，之后逐段读取流式输出时不需要当前轮次。
+
+    with accountant.stream_turn(session_id="s1") as usage:
+        with use_turn(usage):
+            inputs = prepare()
+            config = usage_config("conversation")
+        for text in llm.stream(prompt, config=config):
+            yield text
+
+模型返回用量（token_usage 或 usage_metadata）时直接使用；流式输出没有用量、或在
+<END_OF_TURN> 处提前关闭时，按 token_utils.estimate_tokens 估算并标记 estimated。
+prices 的单位为每1000个token的价格（prompt, completion），未配置价格的模型成本记为0。
+"""
+
+import contextvars
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from token_utils import estimate_tokens
+
+_CURRENT_TURN: contextvars.ContextVar[Optional["TurnUsage"]] = contextvars.ContextVar(
+    "salesgpt_turn_usage", default=None)
+
+USAGE_FIELDS = ("turns", "llm_calls", "prompt_tokens", "completion_tokens", "estimated_calls", "cost")
+
+
+class TurnUsage:
+    """一轮对话中的全部LLM调用和缓存命中"""
+
+    def __init__(self, accountant: "TokenAccountant", session_id: str, customer_id: Optional[str], turn: int):
+        self.accountant = accountant
+        self.turn_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.customer_id = customer_id
+        self.turn = turn
+        self.started_at = datetime.datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.calls: List[Dict[str, Any]] = []
+        self.cache_hits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        """在块内把本轮设为当前轮次（块内不能 yield）"""
+        token = _CURRENT_TURN.set(self)
+        try:
+            yield self
+        finally:
+            _CURRENT_TURN.reset(token)
+
+    def add_call(self, call: Dict[str, Any]):
+        with self._lock:
+            self.calls.append(call)
+
+    def add_cache_hit(self, kind: str):
+        with self._lock:
+            self.cache_hits[kind] = self.cache_hits.get(kind, 0) + 1
+
+    def to_record(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self.calls)
+            cache_hits = dict(self.cache_hits)
+        return {
+            "turn_id": self.turn_id,
+            "session_id": self.session_id,
+            "customer_id": self.customer_id,
+            "turn": self.turn,
+            "started_at": self.started_at,
+            "latency_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "llm_calls": len(calls),
+            "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in calls),
+            "estimated_calls": sum(call["estimated"] for call in calls),
+            "cost": round(sum(call["cost"] for call in calls), 6),
+            "cache_hits": cache_hits,
+            "calls": calls
+        }
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """把一次链调用中的LLM用量记到指定轮次，label 标明调用来源（conversation、stage_analysis 等）"""
+
+    def __init__(self, turn: TurnUsage, label: str):
+        self.turn = turn
+        self.label = label
+        # run_id -> {"model", "start", "prompt_tokens", "streamed"}
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, prompt_text: str, kwargs: Dict[str, Any]):
+        params = kwargs.get("invocation_params") or {}
+        metadata = kwargs.get("metadata") or {}
+        model = (params.get("model_name") or params.get("model") or metadata.get("ls_model_name")
+                 or params.get("_type") or "unknown")
+        with self._lock:
+            self._runs[run_id] = {"model": model, "start": time.perf_counter(),
+                                  "prompt_tokens": estimate_tokens(prompt_text), "streamed": []}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, "\n".join(prompts), kwargs)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            **kwargs: Any):
+        self._start(run_id, "\n".join(str(message.content) for batch in messages for message in batch), kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None:
+                run["streamed"].append(token)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+        if prompt_tokens is None:
+            metadata = [getattr(getattr(generation, "message", None), "usage_metadata", None)
+                        for generations in response.generations for generation in generations]
+            metadata = [item for item in metadata if item]
+            if metadata:
+                prompt_tokens = sum(item.get("input_tokens", 0) for item in metadata)
+                completion_tokens = sum(item.get("output_tokens", 0) for item in metadata)
+
+        estimated = prompt_tokens is None
+        if estimated:
+            text = "".join(generation.text for generations in response.generations for generation in generations)
+            prompt_tokens, completion_tokens = run["prompt_tokens"], estimate_tokens(text)
+        self._record(run, prompt_tokens, completion_tokens, estimated)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        # 在 <END_OF_TURN> 处提前关闭的流式调用会以 GeneratorExit 结束，按已生成的片段估算
+        self._record(run, run["prompt_tokens"], estimate_tokens("".join(run["streamed"])), True,
+                     truncated=isinstance(error, GeneratorExit),
+                     error=None if isinstance(error, GeneratorExit) else type(error).__name__)
+
+    def _record(self, run: Dict[str, Any], prompt_tokens: int, completion_tokens: int, estimated: bool,
+                truncated: bool = False, error: str = None):
+        call = {
+            "label": self.label,
+            "model": run["model"],
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_ms": round((time.perf_counter() - run["start"]) * 1000, 3),
+            "estimated": estimated,
+            "cost": self.turn.accountant.cost(run["model"], prompt_tokens, completion_tokens)
+        }
+        if truncated:
+            call["truncated"] = True
+        if error:
+            call["error"] = error
+        self.turn.add_call(call)
+
+
+def usage_config(label: str) -> Dict[str, Any]:
+    """当前轮次的回调配置，传给 invoke/ainvoke/stream 的 config 参数；没有活动轮次时为空"""
+    turn = _CURRENT_TURN.get()
+    if turn is None:
+        return {}
+    return {"callbacks": [UsageCallbackHandler(turn, label)]}
+
+
+def use_turn(turn: Optional[TurnUsage]):
+    """在块内把 turn 设为当前轮次；turn 为 None（未配置核算器）时不做任何事"""
+    return turn.activate() if turn is not None else nullcontext()
+
+
+def record_cache_hit(kind: str):
+    """记录一次缓存命中（省去的LLM调用），没有活动轮次时忽略"""
+    turn = _CURRENT_TURN.get()
+    if turn is not None:
+        turn.add_cache_hit(kind)
+
+
+class TokenAccountant:
+    """按轮次、会话和客户汇总LLM用量与成本"""
+
+    def __init__(self, prices: Dict[str, Tuple[float, float]] = None, export_path: str = None,
+                 max_turns_kept: int = 10000):
+        """
+        Args:
+            prices: 模型名 -> (每1000个prompt token的价格, 每1000个completion token的价格)
+            export_path: 每轮结束后追加一行JSON的日志文件（可选）
+            max_turns_kept: 内存中保留的最近轮次数
+        """
+        self.prices = dict(prices or {})
+        self.export_path = export_path
+        self.turns = deque(maxlen=max_turns_kept)
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._customers: Dict[str, Dict[str, Any]] = {}
+        self._totals = self._empty_usage()
+        self._session_turns: Dict[str, int] = {}
+
+    @staticmethod
+    def _empty_usage() -> Dict[str, Any]:
+        usage = {field: 0 for field in USAGE_FIELDS}
+        usage["cache_hits"] = {}
+        usage["by_label"] = {}
+        return usage
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+    @contextmanager
+    def turn(self, session_id: str = "default", customer_id: str = None):
+        """
+        把块内的LLM调用记为一轮对话；已经处于本核算器的轮次中时沿用外层轮次
+
+        块内会设置当前轮次，不能在生成器的 yield 期间使用，生成器使用 stream_turn()
+        """
+        with self.stream_turn(session_id, customer_id) as usage:
+            with usage.activate():
+                yield usage
+
+    @contextmanager
+    def stream_turn(self, session_id: str = "default", customer_id: str = None):
+        """
+        创建一轮对话但不设为当前轮次，供流式生成器使用
+
+        调用方只在不含 yield 的代码段外用 use_turn(usage) 激活，块结束时汇总本轮用量；
+        已经处于本核算器的轮次中时沿用外层轮次
+        """
+        current = _CURRENT_TURN.get()
+        if current is not None and current.accountant is self:
+            yield current
+            return
+
+        session_id = session_id or "default"
+        with self._lock:
+            index = self._session_turns.get(session_id, 0) + 1
+            self._session_turns[session_id] = index
+        usage = TurnUsage(self, session_id, customer_id, index)
+        try:
+            yield usage
+        finally:
+            self._finish(usage)
+
+    def _finish(self, usage: TurnUsage):
+        record = usage.to_record()
+        with self._lock:
+            self.turns.append(record)
+            targets = [self._totals, self._sessions.setdefault(record["session_id"], self._empty_usage())]
+            if record["customer_id"]:
+                targets.append(self._customers.setdefault(record["customer_id"], self._empty_usage()))
+            for target in targets:
+                self._accumulate(target, record)
+
+        if self.export_path:
+            directory = os.path.dirname(self.export_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.export_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    @staticmethod
+    def _accumulate(target: Dict[str, Any], record: Dict[str, Any]):
+        target["turns"] += 1
+        for field in USAGE_FIELDS[1:]:
+            target[field] += record[field]
+        target["cost"] = round(target["cost"], 6)
+        for kind, count in record["cache_hits"].items():
+            target["cache_hits"][kind] = target["cache_hits"].get(kind, 0) + count
+        for call in record["calls"]:
+            label = target["by_label"].setdefault(call["label"], {"llm_calls": 0, "prompt_tokens": 0,
+                                                                  "completion_tokens": 0})
+            label["llm_calls"] += 1
+            label["prompt_tokens"] += call["prompt_tokens"]
+            label["completion_tokens"] += call["completion_tokens"]
+
+    @staticmethod
+    def _snapshot(usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if usage is None:
+            return TokenAccountant._empty_usage()
+        snapshot = dict(usage)
+        snapshot["cache_hits"] = dict(usage["cache_hits"])
+        snapshot["by_label"] = {label: dict(values) for label, values in usage["by_label"].items()}
+        turns = snapshot["turns"]
+        snapshot["tokens_per_turn"] = round(
+            (snapshot["prompt_tokens"] + snapshot["completion_tokens"]) / turns, 1) if turns else 0.0
+        return snapshot
+
+    def session_summary(self, session_id: str = "default") -> Dict[str, Any]:
+        with self._lock:
+            return self._snapshot(self._sessions.get(session_id))
+
+    def customer_summary(self, customer_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._snapshot(self._customers.get(customer_id))
+
+    def summary(self) -> Dict[str, Any]:
+        """全部会话的累计用量"""
+        with self._lock:
+            totals = self._snapshot(self._totals)
+            totals["sessions"] = len(self._sessions)
+            totals["customers"] = len(self._customers)
+        return totals
+
+    def last_turn(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self.turns[-1] if self.turns else None
+
+    def export_jsonl(self, path: str) -> int:
+        """把内存中保留的轮次写入JSONL文件，返回写入的行数"""
+        with self._lock:
+            records = list(self.turns)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return len(records)
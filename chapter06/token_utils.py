@@ -0,0 +1,42 @@
+"""
+Token 估算工具
+=============
+
+不依赖分词器的快速 token 估算，用于控制注入提示词的知识片段长度。
+中日韩字符大约每个字一个 token，其余文本按约 4 个字符一个 token 计算。
+"""
+
+
+def _is_cjk(char: str) -> bool:
+    """判断字符是否为中日韩文字或全角标点"""
+    code = ord(char)
+    return (
+        0x4E00 <= code <= 0x9FFF      # 中日韩统一表意文字
+        or 0x3400 <= code <= 0x4DBF   # 扩展A
+        or 0x3000 <= code <= 0x30FF   # 中日韩标点、假名
+        or 0xAC00 <= code <= 0xD7AF   # 韩文音节
+        or 0xFF00 <= code <= 0xFFEF   # 全角字符
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    if not text:
+        return 0
+
+    cjk_count = sum(1 for char in text if _is_cjk(char))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """把文本截断到不超过 max_tokens 的前缀"""
+    if max_tokens <= 0:
+        return ""
+
+    tokens = 0.0
+    for index, char in enumerate(text):
+        tokens += 1 if _is_cjk(char) else 0.25
+        if tokens > max_tokens:
+            return text[:index]
+    return text
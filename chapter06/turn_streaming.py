@@ -0,0 +1,99 @@
+"""
+SalesGPT 流式回复工具
+====================
+
+SalesGPT 的对话提示要求模型以 <END_OF_TURN> 结尾，但模型经常在标记之后继续生成。
+本模块在流式输出时逐段检测结束标记（包括被拆分到多个片段中的情况），
+一旦出现就停止读取并关闭底层流，减少首字延迟和无用的输出token。
+"""
+
+from typing import AsyncIterator, Iterator
+
+END_OF_TURN = "<END_OF_TURN>"
+
+
+class EndOfTurnFilter:
+    """增量过滤结束标记
+
+    尾部可能是结束标记前缀的字符会暂时保留，等下一个片段到达后再决定是否输出，
+    因此输出的文本中永远不会出现结束标记或它的一部分。
+    """
+
+    def __init__(self, sentinel: str = END_OF_TURN):
+        self.sentinel = sentinel
+        self.finished = False
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> str:
+        """输入一个片段，返回可以安全输出的文本；遇到结束标记后 finished 为 True"""
+        if self.finished:
+            return ""
+
+        self._buffer += chunk
+        index = self._buffer.find(self.sentinel)
+        if index != -1:
+            text = self._buffer[:index]
+            self._buffer = ""
+            self.finished = True
+            return text
+
+        # 保留最长的、可能是结束标记前缀的尾部
+        keep = 0
+        for length in range(min(len(self._buffer), len(self.sentinel) - 1), 0, -1):
+            if self._buffer.endswith(self.sentinel[:length]):
+                keep = length
+                break
+
+        text = self._buffer[:len(self._buffer) - keep]
+        self._buffer = self._buffer[len(self._buffer) - keep:]
+        return text
+
+    def flush(self) -> str:
+        """流结束但没有出现结束标记时，输出剩余的文本"""
+        text = self._buffer
+        self._buffer = ""
+        return text
+
+
+def chunk_text(chunk) -> str:
+    """取出流式片段中的文本（聊天模型返回消息片段，普通LLM返回字符串）"""
+    return chunk.content if hasattr(chunk, "content") else str(chunk)
+
+
+def stream_until_end_of_turn(llm, prompt, **kwargs) -> Iterator[str]:
+    """流式调用模型，遇到结束标记时停止生成"""
+    end_filter = EndOfTurnFilter()
+    stream = llm.stream(prompt, **kwargs)
+    try:
+        for chunk in stream:
+            text = end_filter.feed(chunk_text(chunk))
+            if text:
+                yield text
+            if end_filter.finished:
+                break
+        else:
+            text = end_filter.flush()
+            if text:
+                yield text
+    finally:
+        # 提前结束时关闭底层流，服务端随之停止生成
+        stream.close()
+
+
+async def astream_until_end_of_turn(llm, prompt, **kwargs) -> AsyncIterator[str]:
+    """异步流式调用模型，遇到结束标记时停止生成"""
+    end_filter = EndOfTurnFilter()
+    stream = llm.astream(prompt, **kwargs)
+    try:
+        async for chunk in stream:
+            text = end_filter.feed(chunk_text(chunk))
+            if text:
+                yield text
+            if end_filter.finished:
+                break
+        else:
+            text = end_filter.flush()
+            if text:
+                yield text
+    finally:
+        await stream.aclose()
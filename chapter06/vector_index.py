@@ -0,0 +1,84 @@
+"""
+向量索引持久化
+============
+
+v4.0 和 v5.0 的知识库原来每次启动都重新分割、嵌入整个知识文件。
+这里把 FAISS 索引保存在知识文件旁边（<知识文件名>_faiss_index/），
+并用索引键标记它对应的内容：索引键由知识文件内容、分割参数和嵌入模型计算，
+三者都没有变化时直接加载本地索引，否则重新构建并覆盖保存。
+
+索引键文件 index_key.txt 只在索引完整保存之后才写入（先删除旧键，保存成功后原子替换），
+保存中途失败时目录里没有索引键，下次启动会重新构建，不会误加载不完整或过期的索引。
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Tuple
+
+from langchain_community.document_loaders import TextLoader
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import CharacterTextSplitter
+
+INDEX_KEY_FILE = "index_key.txt"
+
+
+def get_index_dir(knowledge_file_path: str) -> str:
+    """向量索引目录，保存在知识库文件旁边"""
+    return os.path.splitext(knowledge_file_path)[0] + "_faiss_index"
+
+
+def compute_index_key(knowledge_file_path: str, splitter_settings: Dict[str, Any], embeddings) -> str:
+    """根据知识文件内容、分割参数和嵌入模型计算索引键"""
+    model_name = getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None)
+    hasher = hashlib.sha256()
+    with open(knowledge_file_path, 'rb') as f:
+        hasher.update(f.read())
+    hasher.update(json.dumps(splitter_settings, sort_keys=True).encode('utf-8'))
+    hasher.update(f"{type(embeddings).__name__}:{model_name}".encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def load_or_build_vectorstore(knowledge_file_path: str, splitter_settings: Dict[str, Any],
+                              embeddings) -> Tuple[FAISS, str]:
+    """
+    索引键一致时直接加载本地索引，否则重新分割、嵌入并保存
+
+    Returns:
+        Tuple[FAISS, str]: 向量存储和它的索引键
+    """
+    index_key = compute_index_key(knowledge_file_path, splitter_settings, embeddings)
+    index_dir = get_index_dir(knowledge_file_path)
+    key_file = os.path.join(index_dir, INDEX_KEY_FILE)
+
+    if os.path.exists(key_file):
+        with open(key_file, 'r', encoding='utf-8') as f:
+            cached_key = f.read().strip()
+        if cached_key == index_key:
+            try:
+                # 索引由本程序自己生成，可以安全地反序列化
+                vectorstore = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+                print(f"✅ 已加载本地向量索引: {index_dir}")
+                return vectorstore, index_key
+            except Exception as e:
+                print(f"加载本地向量索引失败，将重新构建: {e}")
+
+    # 加载并分割文档
+    documents = TextLoader(knowledge_file_path, encoding='utf-8').load()
+    texts = CharacterTextSplitter(**splitter_settings).split_documents(documents)
+    vectorstore = FAISS.from_documents(texts, embeddings)
+
+    try:
+        # 先删除旧索引键再覆盖索引，保存中途失败时不会留下与旧键匹配的半新索引
+        if os.path.exists(key_file):
+            os.remove(key_file)
+        vectorstore.save_local(index_dir)
+        tmp_key_file = key_file + ".tmp"
+        with open(tmp_key_file, 'w', encoding='utf-8') as f:
+            f.write(index_key)
+        os.replace(tmp_key_file, key_file)
+        print(f"✅ 向量索引已保存: {index_dir}")
+    except Exception as e:
+        print(f"保存向量索引失败: {e}")
+
+    return vectorstore, index_key